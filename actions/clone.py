@@ -0,0 +1,347 @@
+"""Cloning a template into a new simulation.
+
+A clone starts out as its Simulation row alone, which records the
+template it came from (template_id) and that it has not been
+materialised. Until something changes it, it is identical to its
+template, which was valued and set up when it was loaded (see
+actions/reload.py initialise_template), so requests which only read it
+are served the template's rows (see rows_of). Its commodities,
+industries, classes, stocks, buyers and sellers are copied from the
+template the first time something is written to it (see materialise):
+an action, a change of prices or parameters, or attaching it to memory.
+A simulation which is cloned and only looked at therefore costs one row,
+and cloning takes the same time whatever the size of the template.
+
+The rows are copied from the template as it is when the simulation is
+materialised, so a template should not be deleted while it has clones
+which have not been materialised.
+
+A simulation can also be forked: copied as it is now, in whatever period
+and state it has reached, into a new simulation (see fork_simulation).
+"""
+
+from sqlalchemy import case, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+from actions.reload import assign_stock_roles, initialise_buyers_and_sellers
+from database.database import after_bulk_load, before_bulk_load
+from models.models import (
+    Buyer,
+    Class_stock,
+    Commodity,
+    Industry,
+    Industry_stock,
+    JournalEntry,
+    Seller,
+    Simulation,
+    SocialClass,
+    role_columns,
+    simulation_models,
+)
+from report.report import report
+
+def clone_model(model, session: Session, **kwargs):
+    """Clone an arbitrary sqlalchemy model object without its 
+    primary key values. These primary keys are then added by the caller.  
+
+        Returns the clone unless the call is illegal (eg null model).
+
+        Returns None if it can't be done
+    """
+    try:
+        table = model.__table__
+        non_pk_columns = [
+            k for k in table.columns.keys() if k not in table.primary_key.columns.keys()
+        ]
+        data = {c: getattr(model, c) for c in non_pk_columns}
+        data.update(kwargs)
+        clone = model.__class__(**data)
+        session.add(clone)
+        session.flush()
+        return clone
+    except:
+        return None
+
+def clone_simulation(session: Session, template: Simulation, username: str)->Simulation|None:
+    """Create the Simulation row of a clone of 'template', belonging to
+    'username', ready to start at DEMAND. Its other rows are copied when
+    it is materialised. Does not commit.
+
+        Returns None if it can't be done
+    """
+    return clone_model(template, session, username=username, state="DEMAND", template_id=template.id, materialised=False)
+
+def materialise(session: Session, simulation: Simulation):
+    """Copy the rows of the template into 'simulation', if it is a clone
+    which has not yet been materialised. Does nothing otherwise. Does not
+    commit.
+
+    The simulation is first marked as materialised with a conditional
+    UPDATE, which waits for any other request doing the same, so the rows
+    are copied only once.
+
+        Raises ValueError if the template no longer exists or is inconsistent
+    """
+    if simulation.materialised is not False:
+        return
+    claimed=session.execute(
+        update(Simulation)
+        .where(Simulation.id==simulation.id,Simulation.materialised==False)
+        .values(materialised=True)
+    ).rowcount
+    if claimed==0:  # another request got there first
+        return
+    template=session.get(Simulation,simulation.template_id)
+    if template is None:
+        raise ValueError(f"Simulation {simulation.id} cannot be materialised, because its template {simulation.template_id} no longer exists")
+    try:
+        copy_template(session, template, simulation)
+    except ValueError as e:
+        raise ValueError(f"Simulation {simulation.id} cannot be materialised, because template {template.id} is inconsistent ({e})")
+
+def materialise_by_id(session: Session, simulation_id: int):
+    """Materialise the simulation 'simulation_id' if it needs it, and
+    commit. Costs one query if it does not."""
+    simulation=session.get(Simulation,simulation_id)
+    if simulation is not None and simulation.materialised is False:
+        materialise(session,simulation)
+        session.commit()
+
+def rows_of(session: Session, simulation_id: int)->int:
+    """The id of the simulation whose commodities, industries, classes and
+    stocks are those of simulation 'simulation_id': its template, if it is
+    a clone which has not been materialised, otherwise its own. The rows
+    read in this way carry the template's ids. Costs one query."""
+    row=session.execute(
+        select(Simulation.materialised,Simulation.template_id).where(Simulation.id==simulation_id)
+    ).first()
+    if row is not None and row.materialised is False:
+        return row.template_id
+    return simulation_id
+
+def copy_template(session: Session, template: Simulation, new_simulation: Simulation):
+    """Copy the commodities, industries, classes and stocks of 'template'
+    into 'new_simulation', with their values and capitals, and give them
+    stock roles, buyers and sellers of their own. Does not commit.
+
+        Raises ValueError if the template is inconsistent (see assign_stock_roles)
+    """
+    report(1,new_simulation.id,f"Copying template {template.name} into simulation {new_simulation.id}",session)
+
+    # Clone all commodities in this simulation
+    commodities = session.query(Commodity).filter(Commodity.simulation_id == template.id)
+    report(1,new_simulation.id,f"Cloning Commodities",session)
+    for commodity in commodities:
+        report(2,new_simulation.id,f"Cloning commodity {commodity.name}",session,)
+        new_commodity = clone_model(commodity, session)
+        session.add(new_commodity)  # flush twice, because we want to get the autogenerated id. There's probably a better way
+        session.add(commodity)  # seems to be transient after it is committed, which is a bit weird. So bring it out again, because we will modify it by adding successor_id
+        new_commodity.simulation_id = new_simulation.id
+        new_commodity.username = new_simulation.username
+        commodity.successor_id = new_commodity.id
+        session.flush()
+
+    # Clone all industries in this simulation
+    industries = session.query(Industry).filter(Industry.simulation_id == template.id)
+    report(1,new_simulation.id,f"Cloning Industries",session)
+    for industry in industries:
+        report(2,new_simulation.id,f"Cloning industry {industry.name}",session)
+        new_industry = clone_model(industry, session)
+        session.add(new_industry)  # flush twice, because we want to get the autogenerated id. There's probably a better way
+        session.add(industry)   # seems to be transient after we committed it, which is a bit weird - so bring it out again, because we're going to modify it
+        new_industry.simulation_id = new_simulation.id
+        new_industry.username = new_simulation.username
+        industry.successor_id = new_industry.id
+        session.flush()
+
+    # Clone all classes in this simulation
+    classes = session.query(SocialClass).filter(SocialClass.simulation_id == template.id)
+    report(1,new_simulation.id,f"Cloning Classes",session)
+    for socialClass in classes:
+        report(2,new_simulation.id,f"Cloning class {socialClass.name}",session,)
+        new_class = clone_model(socialClass, session)
+        session.add(new_class)  # we flush twice, because we want to get the autogenerated id. There's probably a better way
+        session.add(socialClass) # seems to be transient after we committed it, which is a bit weird - so bring it out again, because we're going to modify it
+        new_class.simulation_id = new_simulation.id
+        new_class.username = new_simulation.username
+        socialClass.successor_id = new_class.id
+        session.flush()
+
+    # Clone all industry stocks in this simulation
+    stocks = session.query(Industry_stock).filter(Industry_stock.simulation_id == template.id)
+    report(1,new_simulation.id,f"Cloning Industry Stocks",session)
+    for stock in stocks:
+        report(2,new_simulation.id,
+            f"Cloning industry stock [{stock.name}] with id {stock.id}, industry id {stock.industry.id} , and commodity  {stock.commodity.name} [id {stock.commodity.id}]",
+            session,
+        )
+        old_industry = stock.industry
+        old_commodity = stock.commodity
+        successor_commodity_id = old_commodity.successor_id
+        successor_id = old_industry.successor_id
+        new_stock = clone_model(stock, session)
+        session.add(new_stock)  # we flush twice, because we want to get the autogenerated id. There's probably a better way
+        new_stock.simulation_id = new_simulation.id
+        # This stock now has to be connected with its owner and commodity objects in the new simulation
+        new_stock.industry_id = successor_id
+        new_stock.username = new_simulation.username
+        new_stock.commodity_id = successor_commodity_id
+        new_stock.name = (
+            new_stock.industry.name+ "."
+            + new_stock.commodity.name+ "."
+            + new_stock.usage_type+ "."
+            + str(new_stock.simulation_id)
+        )
+        session.flush()
+
+    # Clone all class stocks in this simulation
+    stocks = session.query(Class_stock).filter(Class_stock.simulation_id == template.id)
+    report(1,new_simulation.id,f"Cloning Class Stocks",session)
+
+    for stock in stocks:
+        report(2,new_simulation.id,
+            f"Cloning class stock [{stock.name}] with id {stock.id}, class id {stock.social_class.id} , and commodity  {stock.commodity.name} [id {stock.commodity.id}]",
+            session,
+        )
+        old_class = stock.social_class #TODO deal with No result (ie error in the static file) - also throughout
+        old_commodity = stock.commodity
+        successor_commodity_id = old_commodity.successor_id
+        successor_id = old_class.successor_id
+        new_stock = clone_model(stock, session)
+        session.add(new_stock)  # we flush twice, because we want to get the autogenerated id. There's probably a better way
+        new_stock.simulation_id = new_simulation.id
+        # This stock now has to be connected with its owner and commodity objects in the new simulation
+        new_stock.class_id = successor_id
+        new_stock.username = new_simulation.username
+        new_stock.commodity_id = successor_commodity_id
+        new_stock.name = (
+            new_stock.social_class.name+ "."
+            + new_stock.commodity.name+ "."
+            + new_stock.usage_type+ "."
+            + str(new_stock.simulation_id)
+        )
+        session.flush()
+
+    # The values and capitals were copied with the rows: the template was
+    # valued when it was loaded (see actions/reload.py initialise_template)
+    assign_stock_roles(session, new_simulation.id)
+    initialise_buyers_and_sellers(session, new_simulation.id)
+
+# The columns of each table which refer to rows of the same simulation,
+# other than its role columns, and the model those rows belong to. None
+# means an industry stock or a class stock, according to owner_type.
+references={
+    Industry_stock:{"industry_id":Industry,"commodity_id":Commodity},
+    Class_stock:{"class_id":SocialClass,"commodity_id":Commodity},
+    Buyer:{"purchase_stock_id":None,"money_stock_id":None,"commodity_id":Commodity},
+    Seller:{"sales_stock_id":None,"money_stock_id":None,"commodity_id":Commodity},
+}
+
+# The model to which the role columns of each model refer
+role_models={Industry:Industry_stock, SocialClass:Class_stock}
+
+def fork_simulation(session: Session, source: Simulation, username: str)->Simulation:
+    """Copy 'source', as it is now, into a new simulation belonging to
+    'username', in the same period and state. Does not commit.
+
+    The copy is set-based: one INSERT ... SELECT for each table, then one
+    UPDATE for the role columns of industries and of classes. Each row of
+    the copy is given the id of its original plus an offset which puts it
+    above every id in its table, so that a reference from one row to
+    another is remapped by adding the offset of the table it refers to.
+    The journal is copied too, so that the fork can be replayed (see
+    actions/journal.py).
+
+    Nothing is written to the source, which may belong to another user. A
+    clone which has not been materialised has no rows of its own, so its
+    fork is another clone of the same template, with its Simulation row
+    and journal, which is materialised when it is first changed.
+
+        Raises ValueError if the source cannot be copied
+    """
+    fork=clone_model(source,session,username=username)
+    if fork is None:
+        raise ValueError(f"Simulation {source.id} could not be copied")
+    if source.materialised is False:
+        copy_journal(session,source,fork)
+        report(0,fork.id,f"FORKED FROM SIMULATION {source.id} IN PERIOD {source.time_stamp} FOR USER {username}",session)
+        return fork
+
+    # For each table, the largest id, and the smallest id of the source, in one query.
+    # Nobody else may insert into the tables until this transaction ends (see database/postgresql.py)
+    before_bulk_load(session,simulation_models)
+    bounds=session.execute(select(*[
+        column for model in simulation_models for column in (
+            select(func.max(model.id)).scalar_subquery(),
+            select(func.min(model.id)).where(model.simulation_id==source.id).scalar_subquery(),
+        )
+    ])).one()
+    offsets={
+        model:(bounds[2*i] or 0)+1-(bounds[2*i+1] or 0)
+        for i,model in enumerate(simulation_models)
+    }
+
+    suffix=f".{source.id}"
+    for model in simulation_models:
+        table=model.__table__
+        roles=role_columns.get(model,())
+        values={}
+        for column in table.columns:
+            key=column.key
+            if key=="id":
+                value=column+offsets[model]
+            elif key=="simulation_id":
+                value=literal(fork.id)
+            elif key in roles or key=="successor_id":
+                value=None  # roles are set below; successors only matter to templates
+            elif key=="name" and model in (Industry_stock,Class_stock):
+                # Stock names end with the id of their simulation (see copy_template)
+                value=case(
+                    (column.like(f"%{suffix}"),func.substr(column,1,func.length(column)-len(suffix))+f".{fork.id}"),
+                    else_=column,
+                )
+            elif key in references.get(model,{}):
+                target=references[model][key]
+                if target is None:
+                    value=case(
+                        (table.c.owner_type=="Industry",column+offsets[Industry_stock]),
+                        else_=column+offsets[Class_stock],
+                    )
+                else:
+                    value=column+offsets[target]
+            else:
+                value=column
+            values[key]=literal(None) if value is None else value
+        session.execute(insert(table).from_select(
+            list(values),
+            select(*values.values()).where(table.c.simulation_id==source.id).order_by(table.c.id),
+        ))
+
+    for model,columns in role_columns.items():
+        table=model.__table__
+        original=table.alias("original")
+        session.execute(
+            update(table)
+            .where(table.c.simulation_id==fork.id)
+            .values({
+                column:select(original.c[column]+offsets[role_models[model]])
+                .where(original.c.id==table.c.id-offsets[model])
+                .scalar_subquery()
+                for column in columns
+            })
+        )
+
+    copy_journal(session,source,fork)
+    after_bulk_load(session,simulation_models)
+    report(0,fork.id,f"FORKED FROM SIMULATION {source.id} IN PERIOD {source.time_stamp} FOR USER {username}",session)
+    return fork
+
+def copy_journal(session: Session, source: Simulation, fork: Simulation):
+    """Copy the journal of 'source', in order, into that of 'fork'. Does not commit."""
+    journal=JournalEntry.__table__
+    columns=[column for column in journal.columns if column.key!="id"]
+    session.execute(insert(journal).from_select(
+        [column.key for column in columns],
+        select(*[literal(fork.id) if column.key=="simulation_id" else column for column in columns])
+        .where(journal.c.simulation_id==source.id)
+        .order_by(journal.c.id),
+    ))
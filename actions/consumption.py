@@ -1,7 +1,9 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, selectinload
 from actions.utils import calculate_current_capitals, revalue_commodities,revalue_stocks
+from actions.dirty import clear_dirty, dirty_commodities, mark_dirty
 from models.models import Commodity, SocialClass, Simulation, Class_stock
-from report.report import report
+from report.report import report, report_event
+from report.metrics import stage
 
 """This module contains functions needed to implement the consumption action.
 """
@@ -9,9 +11,10 @@ from report.report import report
 def process_consume(session,simulation):
     consume(session, simulation)
 
-    # Recalculate the price and value of every stock, then calculate capital
+    # Recalculate the price and value of every stock that has changed, then calculate capital
+    # Commodities none of whose stocks have changed since the last revaluation are left alone
     report(1,simulation.id,f"Production and reproduction complete. Now revalue all commodities",session)
-    commodities=session.query(Commodity).where(Commodity.simulation_id==simulation.id)
+    commodities=dirty_commodities(session,simulation)
     c:Commodity
     for c in commodities:
         session.add(c)
@@ -21,13 +24,18 @@ def process_consume(session,simulation):
         c.revalue_stocks(session,simulation)
     report(1,simulation.id,f"Revaluation complete. Now recalculate current capital and profits",session)
     calculate_current_capitals(session,simulation)
-    session.commit()
+    clear_dirty(session,simulation)
+    session.flush()
 
+@stage
 def consume(session:Session, simulation:Simulation)->str:
     """Tell all classes to consume and reproduce their product if they have one.
     TODO currently there are no population dynamics
     """
-    squery = session.query(SocialClass).where(
+    squery = session.query(SocialClass).options(
+        joinedload(SocialClass.simulation),
+        selectinload(SocialClass.stocks).joinedload(Class_stock.commodity),
+    ).where(
         SocialClass.simulation_id == simulation.id
     )
 
@@ -55,24 +63,20 @@ def class_consume(
             the Simulation currently under way
     """
     sales_stock = social_class.sales_stock(session)
-    sales_commodity:Commodity=sales_stock.commodity(session)
+    sales_commodity:Commodity=sales_stock.commodity
     session.add(sales_stock)
+    mark_dirty(sales_stock)
     report(2,simulation.id,f"Sales stock size before consumption is {sales_stock.size} with value {sales_stock.value}",session)
 
-    consumption_stocks_query = session.query(Class_stock).where(
-        Class_stock.simulation_id == simulation.id,
-        Class_stock.class_id == social_class.id,
-        Class_stock.usage_type == "Consumption",
-    )
-
-    for stock in consumption_stocks_query:
+    for stock in social_class.consumption_stocks(session):
         session.add(stock)
-        commodity=stock.commodity(session)
-        report(2,simulation.id,f"Consuming size  {stock.size} and value {stock.value} by stock [{stock.name}]",session)
+        mark_dirty(stock)
+        commodity=stock.commodity
+        report_event(2,simulation.id,"consumption.before",session,commodity=commodity,stock=stock,size=stock.size,value=stock.value)
         stock.size -=stock.flow_per_period(session)  # eat according to defined consumption standards
         stock.price-=stock.flow_per_period(session)*commodity.unit_price
         stock.value-=stock.flow_per_period(session)*commodity.unit_value
-        report(2,simulation.id,f"Consumption stock size {stock.size}, value {stock.value} and price {stock.price} for [{stock.name}] ",session)
+        report_event(2,simulation.id,"consumption.after",session,commodity=commodity,stock=stock,size=stock.size,value=stock.value,price=stock.price)
     
     # Currently no population dynamics and no differential labour intensity
     # Capitalists are assumed here (as per Cheng et al.) to supply services
@@ -88,4 +92,4 @@ def class_consume(
     sales_stock.value += (social_class.population/simulation.periods_per_year)*sales_commodity.unit_value
     sales_stock.price += (social_class.population/simulation.periods_per_year)*sales_commodity.unit_price
     report(2,simulation.id,f"Its size is now {sales_stock.size}, value {sales_stock.value} and price {sales_stock.price}",session)
-    session.commit()
+    session.flush()
@@ -0,0 +1,88 @@
+"""Functions which detect when a simulation has reached a stationary state.
+
+Under Simple Reproduction the economy reproduces itself unchanged from
+one period to the next. Once this has happened, every further period
+costs a full circuit of demand, supply, trade, production, consumption
+and revaluation, yet tells us nothing new.
+
+These functions take a snapshot of the state of a simulation at the end
+of each period and compare it with the snapshot taken at the end of the
+previous period. If nothing has changed by more than a given tolerance,
+the simulation is stationary and multi-period runs can stop.
+"""
+
+from models.models import Class_stock, Commodity, Industry, Industry_stock, Simulation
+from sqlalchemy.orm import Session
+
+# Commodity usages which take part in the circuit of production and exchange
+circulating_usages=("PRODUCTIVE","CONSUMPTION","MONEY")
+
+def snapshot(session:Session, simulation:Simulation)->dict:
+    """Record the magnitudes which define the state of a simulation.
+
+    These are the size of every stock, the unit value and unit price of
+    every commodity, and the output scale of every industry.
+
+    Stocks of commodities which play no part in the circuit (such as
+    'Capital Services', whose usage is 'Useless') are left out, because
+    they pile up without limit even when the economy is stationary.
+
+        session(Session):
+            the sqlAlchemy session holding the simulation
+
+        simulation(Simulation):
+            the simulation whose state is recorded
+
+        returns(dict):
+            the magnitudes, keyed by (table name, id, field name)
+    """
+    state={}
+    for c in session.query(Commodity).where(Commodity.simulation_id==simulation.id):
+        state[("commodities",c.id,"unit_value")]=c.unit_value
+        state[("commodities",c.id,"unit_price")]=c.unit_price
+    for ind in session.query(Industry).where(Industry.simulation_id==simulation.id):
+        state[("industries",ind.id,"output_scale")]=ind.output_scale
+    for stock in session.query(Industry_stock).join(Commodity,Industry_stock.commodity_id==Commodity.id).where(
+        Industry_stock.simulation_id==simulation.id,
+        Commodity.usage.in_(circulating_usages),
+    ):
+        state[("industry_stocks",stock.id,"size")]=stock.size
+    for stock in session.query(Class_stock).join(Commodity,Class_stock.commodity_id==Commodity.id).where(
+        Class_stock.simulation_id==simulation.id,
+        Commodity.usage.in_(circulating_usages),
+    ):
+        state[("class_stocks",stock.id,"size")]=stock.size
+    return state
+
+def is_stationary(previous:dict, current:dict, tolerance:float)->bool:
+    """Compare two snapshots taken by snapshot().
+
+    A magnitude has not changed if the difference between its old and new
+    values is no more than 'tolerance' times the old value (or no more than
+    'tolerance', if the old value is smaller than 1).
+
+        previous(dict):
+            the snapshot at the end of the previous period, or None if
+            there was no previous period
+
+        current(dict):
+            the snapshot at the end of this period
+
+        tolerance(float):
+            the relative change below which a magnitude is treated as
+            unchanged
+
+        returns(bool):
+            True if no magnitude has changed, False otherwise
+    """
+    if previous is None or previous.keys()!=current.keys():
+        return False
+    for key, new in current.items():
+        old=previous[key]
+        if old is None or new is None:
+            if old is not new:
+                return False
+            continue
+        if abs(new-old)>tolerance*max(1.0,abs(old)):
+            return False
+    return True
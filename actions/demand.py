@@ -7,8 +7,9 @@ elsewhere.
 
 from models import models
 from models.models import Class_stock, Commodity,Industry, Industry_stock,SocialClass, Simulation
-from report.report import report
-from sqlalchemy.orm import Session
+from report.report import report, report_event
+from report.metrics import stage
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 def process_demand(session:Session, simulation:Simulation):
         
@@ -26,6 +27,7 @@ def process_demand(session:Session, simulation:Simulation):
     class_demand(session, simulation)  # tell classes to register their demand with their stocks.
     commodity_demand(session, simulation)  # tell the commodities to tot up the demand from all stocks of them.
 
+@stage
 def initialise_demand(session: Session,simulation: Simulation):
     """Set demand to zero for all commodities and stocks, prior to recalculating total demand."""
 
@@ -42,11 +44,15 @@ def initialise_demand(session: Session,simulation: Simulation):
     for s in squery:
         session.add(s)
         s.demand=0
-    session.commit()
+    session.flush()
 
+@stage
 def industry_demand(session:Session,simulation:Simulation):
     """Tell each industry to set demand for each of its productive stocks."""
-    query=session.query(Industry).where(Industry.simulation_id==simulation.id)
+    query=session.query(Industry).options(
+        joinedload(Industry.simulation),
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity),
+    ).where(Industry.simulation_id==simulation.id)
     report(1,simulation.id, "Calculating demand from industries",session)
     industry:Industry
     for industry in query:
@@ -55,67 +61,73 @@ def industry_demand(session:Session,simulation:Simulation):
         cost:float =0
         money_stock:Industry_stock=industry.money_stock(session)
         money=money_stock.size
-        query=session.query(Industry_stock).filter(Industry_stock.industry_id==industry.id,Industry_stock.usage_type=="Production")
-        for stock in query:
+        for stock in industry.productive_stocks():
             session.add(stock)
-            commodity: Commodity=stock.commodity(session)
+            commodity: Commodity=stock.commodity
             demand=round(stock.flow_per_period(session),4)
             stock.demand+=demand
             cost+=demand*commodity.unit_price
-            report(3,simulation.id,f'Demand for {commodity.name} has grown by {demand} to {stock.demand}, from [{stock.name}]',session)
+            report_event(3,simulation.id,"demand.grown",session,commodity=commodity,stock=stock,amount=demand,size=stock.demand)
         report(2, simulation.id,f"Industry {industry.name} has {money} to finance costs of {cost}",session)
         if money<cost:
             report(2, simulation.id,f"Insufficient money to maintain production: CALL FOR HELP!",session)
             finance_ratio=industry.get_capitalist_help(cost-money,session)
             report(2, simulation.id,f"After getting help, industry has {money_stock.size}",session)
             # TODO adjust demand depending on finance? I think this is done in Trade
-    session.commit()
+    session.flush()
 
+@stage
 def class_demand(session:Session,simulation:Simulation):
     """Tell each class to set demand for each of its consumption stocks."""
     report(1,simulation.id, "Calculating demand from social classes",session)
-    query=session.query(SocialClass).where(SocialClass.simulation_id==simulation.id)
+    query=session.query(SocialClass).options(
+        joinedload(SocialClass.simulation),
+        selectinload(SocialClass.stocks).joinedload(Class_stock.commodity),
+    ).where(SocialClass.simulation_id==simulation.id)
     for socialClass in query:
         report(2, simulation.id,f"Asking class {socialClass.name} to set demand for all its consumption stocks",session)
         session.add(socialClass)
-        query=session.query(Class_stock).filter(Class_stock.class_id==socialClass.id,Class_stock.usage_type=="Consumption")
-        for stock in query:
+        for stock in socialClass.consumption_stocks(session):
             session.add(stock)
-            commodity=stock.commodity(session)
+            commodity=stock.commodity
             demand=round(stock.flow_per_period(session),4) 
             stock.demand+=demand
-            report(3,simulation.id,f'Demand for {commodity.name} has grown by {demand} to {stock.demand}, from [{stock.name}]',session)
+            report_event(3,simulation.id,"demand.grown",session,commodity=commodity,stock=stock,amount=demand,size=stock.demand)
         report(2, simulation.id,f"Class {socialClass.name} has finished setting demand",session)
-    session.commit()
+    session.flush()
 
+@stage
 def commodity_demand(session:Session,simulation:Simulation):
     """For each commodity, add up the total demand by asking all its stocks what they need.
     Do this separately from the stocks as a kind of check - could be done at the same time.
     """
     report(1,simulation.id,"Adding up demand for commodities",session)
-    query=session.query(models.Commodity).where(Commodity.simulation_id==simulation.id)
+    query=session.query(models.Commodity).options(
+        selectinload(Commodity.industry_stocks).joinedload(Industry_stock.industry),
+        selectinload(Commodity.class_stocks).joinedload(Class_stock.social_class),
+    ).where(Commodity.simulation_id==simulation.id)
     for commodity in query:
        
 # Demand from Industry Stocks
 
         session.add(commodity)
         # report(2,simulation.id, f'Calculating total demand for {commodity.name} from Industries',session)
-        squery=session.query(Industry_stock).filter(Industry_stock.commodity_id==commodity.id,Industry_stock.usage_type=="Production")
-        for stock in squery:
-            industry:Industry=stock.industry(session)
-            report(3,simulation.id,f'Demand for {commodity.name} with owner ({industry.name}) is {stock.demand}, from [{stock.name}] ',session)
+        for stock in commodity.industry_stocks:
+            if stock.usage_type!="Production":
+                continue
+            industry:Industry=stock.industry
+            report_event(3,simulation.id,"demand.owner",session,commodity=commodity,owner=industry,stock=stock,size=stock.demand)
             commodity.demand+=stock.demand
         report (2,simulation.id, f'Total demand from industries for {commodity.name} is {commodity.demand}',session)
 
 # Demand from Class Stocks
 
         # report(2,simulation.id, f'Calculating total demand for {commodity.name} from Classes',session)
-        squery=session.query(Class_stock).filter(Class_stock.commodity_id==commodity.id)
-        for stock in squery:
-            social_class:SocialClass=stock.social_class(session)
-            report(3,simulation.id,f'Demand for {commodity.name}  with owner ({social_class.name}) is {stock.demand} from [{stock.name}]',session)
+        for stock in commodity.class_stocks:
+            social_class:SocialClass=stock.social_class
+            report_event(3,simulation.id,"demand.owner",session,commodity=commodity,owner=social_class,stock=stock,size=stock.demand)
             commodity.demand+=stock.demand
         report (2,simulation.id, f'Total demand from classes for {commodity.name} is now {commodity.demand}',session)
     report (1,simulation.id, f'Finished calculating demand for {commodity.name} is now {commodity.demand}',session)
-    session.commit()
+    session.flush()
 
@@ -0,0 +1,91 @@
+"""Helper functions which keep track of which commodities and stocks have
+changed since they were last revalued.
+
+Every Commodity, Industry_stock and Class_stock carries a 'dirty' flag.
+The places that change the size of a stock (trade, production,
+consumption, investment) or the unit value or price of a commodity
+(price reset, revaluation) set it. Revaluation and the calculation of
+capital then visit only the dirty commodities, the stocks of them, and
+the industries that own those stocks. When revaluation is complete, the
+flags are cleared.
+
+New objects start out dirty, because they have never been valued. So a
+freshly cloned simulation is revalued in full.
+
+The flags are stored in the database rather than in memory, because
+the actions that change stocks and the action that revalues them arrive
+in separate requests, which may be handled by separate workers.
+"""
+
+from models.models import Class_stock, Commodity, Industry, Industry_stock, Simulation
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+def mark_dirty(*objects):
+    """Flag one or more commodities or stocks as changed."""
+    for item in objects:
+        item.dirty=True
+
+def dirty_commodities(session:Session, simulation:Simulation)->list[Commodity]:
+    """The commodities of this simulation which are dirty themselves, or
+    have a dirty stock."""
+    industry_stock_commodities=select(Industry_stock.commodity_id).where(
+        Industry_stock.simulation_id==simulation.id,
+        Industry_stock.dirty==True,
+    )
+    class_stock_commodities=select(Class_stock.commodity_id).where(
+        Class_stock.simulation_id==simulation.id,
+        Class_stock.dirty==True,
+    )
+    return session.query(Commodity).where(
+        Commodity.simulation_id==simulation.id,
+        or_(
+            Commodity.dirty==True,
+            Commodity.id.in_(industry_stock_commodities),
+            Commodity.id.in_(class_stock_commodities),
+        )
+    ).all()
+
+def dirty_industry_stocks(session:Session, simulation:Simulation)->list[Industry_stock]:
+    """The industry stocks of this simulation which are dirty themselves, or
+    are stocks of a dirty commodity."""
+    return session.query(Industry_stock).join(Commodity,Industry_stock.commodity_id==Commodity.id).options(
+        joinedload(Industry_stock.commodity)
+    ).where(
+        Industry_stock.simulation_id==simulation.id,
+        or_(Industry_stock.dirty==True,Commodity.dirty==True),
+    ).all()
+
+def dirty_class_stocks(session:Session, simulation:Simulation)->list[Class_stock]:
+    """The class stocks of this simulation which are dirty themselves, or
+    are stocks of a dirty commodity."""
+    return session.query(Class_stock).join(Commodity,Class_stock.commodity_id==Commodity.id).options(
+        joinedload(Class_stock.commodity)
+    ).where(
+        Class_stock.simulation_id==simulation.id,
+        or_(Class_stock.dirty==True,Commodity.dirty==True),
+    ).all()
+
+def dirty_industries(session:Session, simulation:Simulation)->list[Industry]:
+    """The industries of this simulation which own at least one dirty stock,
+    or a stock of a dirty commodity. Only these need their capital recalculated."""
+    owners=select(Industry_stock.industry_id).join(Commodity,Industry_stock.commodity_id==Commodity.id).where(
+        Industry_stock.simulation_id==simulation.id,
+        or_(Industry_stock.dirty==True,Commodity.dirty==True),
+    )
+    return session.query(Industry).options(selectinload(Industry.stocks)).where(
+        Industry.simulation_id==simulation.id,
+        Industry.id.in_(owners),
+    ).all()
+
+def clear_dirty(session:Session, simulation:Simulation):
+    """Mark every commodity and stock in the simulation as clean.
+    Call this once revaluation and the calculation of capital are complete."""
+    session.flush()
+    for model in (Commodity,Industry_stock,Class_stock):
+        session.execute(
+            update(model)
+            .where(model.simulation_id==simulation.id,model.dirty==True)
+            .values(dirty=False)
+            .execution_options(synchronize_session="fetch")
+        )
@@ -0,0 +1,242 @@
+"""Functions which calculate the path of balanced growth directly from
+the requirement matrix of a simulation.
+
+The expanded reproduction algorithm in invest.py works this out by
+recalculating supply and demand several times over, and it only works if
+there is a single means of production. The functions here do the same
+job for any number of departments and means of production in a single
+step of linear algebra:
+
+    1. At the present output scales s, the industries use A.s of the
+       means of production each period. On a balanced path every industry
+       grows by the same factor r, and so needs r.(A.s).
+    2. r is the largest factor at which the supply of every means of
+       production covers these inputs: the smallest, over the means of
+       production, of supply[k]/(A.s)[k]. The scarcest means of production
+       is just used up; any other is left over. A surplus of means of
+       production therefore gives r>1, and simple reproduction r=1.
+    3. The labour needed at the new output scales fixes the demand for
+       labour power, and hence the size of the working class.
+    4. Whatever consumer goods the workers do not need is left for the
+       capitalists, and this fixes their consumption per head.
+
+The solver itself (solve_balanced_growth) works on plain lists, so it
+can be used both by the 'Balanced' investment algorithm and to project
+the growth path without changing the simulation.
+"""
+
+from models.models import (
+    Class_stock,
+    Commodity,
+    Industry,
+    Industry_stock,
+    Simulation,
+    capitalists,
+    workers,
+)
+from sqlalchemy.orm import Session, selectinload
+
+def growth_data(session:Session, simulation:Simulation)->dict:
+    """Extract from a simulation everything the solver needs.
+
+        returns(dict):
+            industries: the industries, in a fixed order (index j below)
+            mp_commodities: the means of production (index k below)
+            consumer_commodities: the consumer goods (index c below)
+            A: per-period requirement A[k][j] of means of production k for
+                one unit of output of industry j
+            labour: annual requirement labour[j] of labour power for one unit
+                of output of industry j
+            scales: the current output_scale of each industry
+            produces_mp: whether each industry produces a means of production
+            output_index: for each industry, the index of what it produces,
+                in mp_commodities or consumer_commodities as appropriate
+            mp_supply: the per-period supply of each means of production
+            consumer_supply: the per-period supply of each consumer good
+            workers_requirement: consumption per worker per year of each
+                consumer good
+            workers, capitalists: the two classes
+            capitalist_stocks: the capitalists' consumption stock of each
+                consumer good (None if they have none)
+            periods_per_year: from the simulation
+    """
+    ppy=simulation.periods_per_year
+    industries=session.query(Industry).options(selectinload(Industry.stocks)).where(Industry.simulation_id==simulation.id).order_by(Industry.id).all()
+    commodities=session.query(Commodity).where(Commodity.simulation_id==simulation.id).order_by(Commodity.id).all()
+    mp_commodities=[c for c in commodities if c.origin=="INDUSTRIAL" and c.usage=="PRODUCTIVE"]
+    consumer_commodities=[c for c in commodities if c.usage=="CONSUMPTION"]
+    mp_index={c.id:k for k,c in enumerate(mp_commodities)}
+    consumer_index={c.id:i for i,c in enumerate(consumer_commodities)}
+
+    A=[[0.0]*len(industries) for _ in mp_commodities]
+    labour=[0.0]*len(industries)
+    produces_mp=[False]*len(industries)
+    output_index=[None]*len(industries)
+    commodity_origin={c.id:c.origin for c in commodities}
+    for j,industry in enumerate(industries):
+        for stock in industry.stocks:
+            if stock.usage_type=="Production":
+                if stock.commodity_id in mp_index:
+                    A[mp_index[stock.commodity_id]][j]+=stock.requirement/ppy
+                elif commodity_origin[stock.commodity_id]=="SOCIAL":
+                    labour[j]+=stock.requirement
+            elif stock.usage_type=="Sales":
+                if stock.commodity_id in mp_index:
+                    produces_mp[j]=True
+                    output_index[j]=mp_index[stock.commodity_id]
+                elif stock.commodity_id in consumer_index:
+                    output_index[j]=consumer_index[stock.commodity_id]
+
+    mp_supply=[0.0]*len(mp_commodities)
+    consumer_supply=[0.0]*len(consumer_commodities)
+    sales_stocks=session.query(Industry_stock).where(
+        Industry_stock.simulation_id==simulation.id,
+        Industry_stock.usage_type=="Sales",
+    ).all()+session.query(Class_stock).where(
+        Class_stock.simulation_id==simulation.id,
+        Class_stock.usage_type=="Sales",
+    ).all()
+    for stock in sales_stocks:
+        if stock.commodity_id in mp_index:
+            mp_supply[mp_index[stock.commodity_id]]+=stock.size
+        elif stock.commodity_id in consumer_index:
+            consumer_supply[consumer_index[stock.commodity_id]]+=stock.size
+
+    wc=workers(simulation,session)
+    cc=capitalists(simulation,session)
+    workers_requirement=[0.0]*len(consumer_commodities)
+    capitalist_stocks=[None]*len(consumer_commodities)
+    if wc is not None:
+        for stock in wc.consumption_stocks(session):
+            if stock.commodity_id in consumer_index:
+                workers_requirement[consumer_index[stock.commodity_id]]+=stock.requirement
+    if cc is not None:
+        for stock in cc.consumption_stocks(session):
+            if stock.commodity_id in consumer_index:
+                capitalist_stocks[consumer_index[stock.commodity_id]]=stock
+
+    return {
+        "industries":industries,
+        "mp_commodities":mp_commodities,
+        "consumer_commodities":consumer_commodities,
+        "A":A,
+        "labour":labour,
+        "scales":[industry.output_scale for industry in industries],
+        "produces_mp":produces_mp,
+        "output_index":output_index,
+        "mp_supply":mp_supply,
+        "consumer_supply":consumer_supply,
+        "workers_requirement":workers_requirement,
+        "workers":wc,
+        "capitalists":cc,
+        "capitalist_stocks":capitalist_stocks,
+        "periods_per_year":ppy,
+    }
+
+def solve_balanced_growth(
+        A:list,
+        labour:list,
+        scales:list,
+        mp_supply:list,
+        consumer_supply:list,
+        workers_requirement:list,
+        capitalist_population:float,
+        periods_per_year:float)->dict:
+    """Calculate output scales, labour demand and capitalist consumption
+    for the next period. See the module docstring for the method. All
+    arguments have the meaning given in growth_data().
+
+    Every industry expands by the same factor. If no means of production
+    is used at all, there is nothing to decide the factor, and the scales
+    are left as they are.
+
+        returns(dict):
+            scales: the new output scale of each industry
+            expansion_ratio: the factor by which every industry expands
+            labour_demand: the annual demand for labour power at the new scales
+            workers_consumption: the per-period consumption of each consumer good
+                by a working class whose size equals labour_demand
+            capitalist_requirements: the consumption per capitalist per year of each
+                consumer good which uses up what the workers leave over (None
+                if there are no capitalists)
+    """
+    n=len(scales)
+    # What the industries use of each means of production at their present scales
+    inputs=[sum(A[k][j]*scales[j] for j in range(n)) for k in range(len(A))]
+    ratios=[max(0.0,supply)/used for supply,used in zip(mp_supply,inputs) if used>0]
+    expansion_ratio=min(ratios) if ratios else 1.0
+    new_scales=[scale*expansion_ratio for scale in scales]
+
+    labour_demand=sum(labour[j]*new_scales[j] for j in range(n))
+    workers_consumption=[b*labour_demand/periods_per_year for b in workers_requirement]
+    if capitalist_population:
+        capitalist_requirements=[
+            max(0.0,(supply-consumed)*periods_per_year/capitalist_population)
+            for supply,consumed in zip(consumer_supply,workers_consumption)
+        ]
+    else:
+        capitalist_requirements=None
+    return {
+        "scales":new_scales,
+        "expansion_ratio":expansion_ratio,
+        "labour_demand":labour_demand,
+        "workers_consumption":workers_consumption,
+        "capitalist_requirements":capitalist_requirements,
+    }
+
+def solve_for(data:dict, scales:list=None, mp_supply:list=None, consumer_supply:list=None)->dict:
+    """Apply solve_balanced_growth() to the data extracted by growth_data(),
+    optionally replacing the scales and supplies (as the projection does)."""
+    cc=data["capitalists"]
+    return solve_balanced_growth(
+        A=data["A"],
+        labour=data["labour"],
+        scales=data["scales"] if scales is None else scales,
+        mp_supply=data["mp_supply"] if mp_supply is None else mp_supply,
+        consumer_supply=data["consumer_supply"] if consumer_supply is None else consumer_supply,
+        workers_requirement=data["workers_requirement"],
+        capitalist_population=cc.population if cc is not None else 0,
+        periods_per_year=data["periods_per_year"],
+    )
+
+def project_growth(session:Session, simulation:Simulation, periods:int)->list:
+    """Project the balanced growth path of a simulation for 'periods' periods,
+    without changing it.
+
+    Assumes that the output of each period is fully sold in the next, so
+    that the supply of each commodity in a period is the output of the
+    industries that produce it in the period before.
+
+        returns(list):
+            one dict per period, with the period, the output scale of each
+            industry, the demand for labour power, and the capitalists'
+            consumption per head of each consumer good
+    """
+    data=growth_data(session,simulation)
+    ppy=data["periods_per_year"]
+    scales=data["scales"]
+    mp_supply=data["mp_supply"]
+    consumer_supply=data["consumer_supply"]
+    path=[]
+    for period in range(1,periods+1):
+        solution=solve_for(data,scales,mp_supply,consumer_supply)
+        scales=solution["scales"]
+        path.append({
+            "period":simulation.time_stamp+period,
+            "output_scales":{industry.id:scale for industry,scale in zip(data["industries"],scales)},
+            "labour_demand":solution["labour_demand"],
+            "capitalist_requirements":{} if solution["capitalist_requirements"] is None else {
+                commodity.id:requirement
+                for commodity,requirement in zip(data["consumer_commodities"],solution["capitalist_requirements"])
+            },
+        })
+        mp_supply=[0.0]*len(mp_supply)
+        consumer_supply=[0.0]*len(consumer_supply)
+        for j,scale in enumerate(scales):
+            if data["output_index"][j] is None:
+                continue
+            if data["produces_mp"][j]:
+                mp_supply[data["output_index"][j]]+=scale/ppy
+            else:
+                consumer_supply[data["output_index"][j]]+=scale/ppy
+    return path
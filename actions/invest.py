@@ -12,14 +12,19 @@ from models.models import (
     workers,
 )
 from report.report import report
+from report.metrics import stage
 from actions.supply import process_supply
 from actions.utils import validate
+from actions.growth import growth_data, solve_for
 from .demand import process_demand
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-def process_invest(simulation: Simulation, session: Session):
+def process_invest(session: Session, simulation: Simulation):
     """
     Selects an investment algorithm and applies it.
+
+    Investment is the last stage of the circuit, so once it is complete
+    the simulation moves on to the next period.
     """
     match simulation.investment_algorithm:
         case "Standard":
@@ -28,9 +33,16 @@ def process_invest(simulation: Simulation, session: Session):
         case "Expanded":
             expanded_reproduction_invest(simulation, session)
 
+        case "Balanced":
+            balanced_growth_invest(simulation, session)
+
         case _:
             report(1, simulation.id, "UNKNOWN INVESTMENT ALGORITHM", session)
+    session.add(simulation)
+    simulation.time_stamp+=1
+    report(1, simulation.id, f"Circuit complete. The simulation has moved on to period {simulation.time_stamp}", session)
 
+@stage
 def expanded_reproduction_invest(simulation: Simulation, session: Session):
     """
     The algorithm for expanded reproduction - see the spreadsheet in 'supplementary'
@@ -66,8 +78,8 @@ def expanded_reproduction_invest(simulation: Simulation, session: Session):
     if not (validate(cc, "capitalists")and validate(wc, "workers")):
         report(2, simulation, "One or more classes is missing", session)
         return
-    cc_consumption_stock: Class_stock = cc.consumption_stocks(session).first()
-    wc_consumption_stock: Class_stock = wc.consumption_stocks(session).first()
+    cc_consumption_stock: Class_stock = (cc.consumption_stocks(session) or [None])[0]
+    wc_consumption_stock: Class_stock = (wc.consumption_stocks(session) or [None])[0]
     DI_mp_stock: Industry_stock = DI_industry.mp_stock(session)
     DII_mp_stock: Industry_stock = DII_industry.mp_stock(session)
     lp_commodity: Commodity = labour_power(simulation, session)
@@ -166,9 +178,57 @@ def expanded_reproduction_invest(simulation: Simulation, session: Session):
     report(2,simulation.id,f"capitalist requirement per head for necessities has been reduced to {cc_requirement}",session)
 
     # session.rollback()
-    session.commit()
+    session.flush()
     return
 
+@stage
+def balanced_growth_invest(simulation: Simulation, session: Session):
+    """
+    A generalisation of the expanded reproduction algorithm to any number
+    of departments and means of production. Instead of recalculating supply
+    and demand to find the new output scales, it solves for them directly
+    from the requirement matrix. See actions/growth.py for the method.
+
+    Sets the output scale of every industry, raises the working population
+    (and its sales stock of labour power) to meet the demand for labour, and
+    resets the capitalists' consumption per head so that they consume what
+    the workers leave over.
+    """
+    report(1,simulation.id,"Applying the balanced growth algorithm for investment",session)
+    data=growth_data(session,simulation)
+    wc:SocialClass=data["workers"]
+    if not validate(wc,"workers"):
+        report(2,simulation.id,"The working class is missing",session)
+        return
+    solution=solve_for(data)
+
+    report(2,simulation.id,f"All industries will expand by a factor of {solution['expansion_ratio']}",session)
+    for industry,scale in zip(data["industries"],solution["scales"]):
+        session.add(industry)
+        report(3,simulation.id,f"Output scale of {industry.name} changes from {industry.output_scale} to {scale}",session)
+        industry.output_scale=scale
+
+    labour_demand=solution["labour_demand"]
+    report(2,simulation.id,f"Demand for labour power is {labour_demand}. There are {wc.population} workers",session)
+    session.add(wc)
+    wc.population=labour_demand
+    lp_sales_stock:Class_stock=wc.sales_stock(session)
+    if lp_sales_stock is not None:
+        session.add(lp_sales_stock)
+        new_size=labour_demand/simulation.periods_per_year
+        report(3,simulation.id,f"Raise sales stock of labour power from {lp_sales_stock.size} to {new_size}",session)
+        lp_sales_stock.change_size(new_size-lp_sales_stock.size,session)
+
+    if solution["capitalist_requirements"] is not None:
+        for commodity,stock,requirement in zip(data["consumer_commodities"],data["capitalist_stocks"],solution["capitalist_requirements"]):
+            if stock is None:
+                continue
+            session.add(stock)
+            report(2,simulation.id,f"Capitalist consumption per head of {commodity.name} changes from {stock.requirement} to {requirement}",session)
+            stock.requirement=requirement
+    session.flush()
+
+@stage
 def standard_invest(simulation: Simulation, session: Session):
     """ The standard investment algorithm. 
     Instructs every industry to assess whether it has a money surplus above
@@ -187,13 +247,15 @@ def standard_invest(simulation: Simulation, session: Session):
             Otherwise success message
     """    
     report(1, simulation.id, "Applying the standard investment algorithm", session)
-    industries = session.query(Industry).where(Industry.simulation_id == simulation.id)
+    industries = session.query(Industry).options(
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity)
+    ).where(Industry.simulation_id == simulation.id)
     for industry in industries:
         session.add(industry)
         transfer_profits(industry,simulation,session)
         industry.output_scale=estimateIndustryScale(industry, simulation,session)  
     simulation.state = "DEMAND"
-    session.commit()
+    session.flush()
 
 def transfer_profits(industry:Industry, simulation: Simulation, session: Session):
 
@@ -219,7 +281,7 @@ def transfer_profits(industry:Industry, simulation: Simulation, session: Session
     session.add(ims)
     cms.change_size(private_capitalist_consumption, session)
     ims.change_size(-private_capitalist_consumption, session)
-    session.commit()
+    session.flush()
 
     report(3,simulation.id,f"Capitalists now have a money stock of {capitalists.money_stock(session).size}",session,)
     report(3,simulation.id,f"Industry {industry.name} now has a money stock of {industry.money_stock(session).size}",session )
@@ -256,7 +318,9 @@ def D1_industry(simulation: Simulation, session: Session) -> Industry:
     Short-term fix for the ER algorithm only.
     NOTE this will fail if there is more than one such industry
     """
-    industries = session.query(Industry).where(Industry.simulation_id == simulation.id)
+    industries = session.query(Industry).options(
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity)
+    ).where(Industry.simulation_id == simulation.id)
     for industry in industries:
         output_commodity: Commodity = industry.output_commodity(session)
         if output_commodity.usage == "PRODUCTIVE":
@@ -269,7 +333,9 @@ def D2_industry(simulation: Simulation, session: Session) -> Industry:
     Short-term fix for the ER algorithm only.
     NOTE this will fail if there is more than one such industry
     """
-    industries = session.query(Industry).where(Industry.simulation_id == simulation.id)
+    industries = session.query(Industry).options(
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity)
+    ).where(Industry.simulation_id == simulation.id)
     for industry in industries:
         output_commodity: Commodity = industry.output_commodity(session)
         if output_commodity.usage == "CONSUMPTION":
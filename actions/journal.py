@@ -0,0 +1,117 @@
+"""The journal of a simulation, and replaying it.
+
+Everything done to a simulation from outside is recorded in its journal
+(see models.JournalEntry), in the same transaction as the change itself:
+each action, each list of prices a user posts, each change of
+parameters, and each fast-forward of a stationary simulation. What the
+actions do is determined by the state of the simulation, so the journal
+is enough to rebuild the simulation as it was at any point, without
+storing a snapshot of it each period.
+
+replay does this. It copies the template into an in-memory database,
+materialises a clone of it there with the id of the simulation (so that
+the stocks have the same names), and applies the journal to it, up to a
+given period or a given number of entries. Nothing is traced while it
+does so. The rows of the replayed simulation have ids of their own, so
+prices are journalled by commodity name rather than by id.
+
+A simulation can only be replayed from a template it was cloned from
+which has not since been reloaded with different contents, or deleted.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from actions.clone import clone_model, materialise
+from models.models import Commodity, JournalEntry, Simulation
+
+def record(session: Session, simulation: Simulation, operation: str, data=None):
+    """Add an entry to the journal of 'simulation', with its period and
+    state as they are before 'operation' changes them. Does not commit.
+    Does nothing during a replay."""
+    if session.info.get("replay"):
+        return
+    session.add(JournalEntry(
+        simulation_id=simulation.id,
+        time_stamp=simulation.time_stamp,
+        state=simulation.state,
+        operation=operation,
+        data=data,
+    ))
+
+def journal(session: Session, simulation_id: int, period: int|None=None, entries: int|None=None)->list[JournalEntry]:
+    """The journal of a simulation, in order: all of it, or the entries
+    made before 'period', or the first 'entries' entries (or both)."""
+    query=select(JournalEntry).where(JournalEntry.simulation_id==simulation_id)
+    if period is not None:
+        query=query.where(JournalEntry.time_stamp<period)
+    query=query.order_by(JournalEntry.id)
+    if entries is not None:
+        query=query.limit(entries)
+    return list(session.scalars(query))
+
+def replay(session: Session, simulation_id: int, period: int|None=None, entries: int|None=None):
+    """Rebuild simulation 'simulation_id' as it was at the start of 'period',
+    or after its first 'entries' journal entries, or as it is now if
+    neither is given, in a new in-memory store (see database/memory.py).
+    The caller should dispose of the store's engine when finished with it.
+
+        Returns the store, a session on it, the replayed simulation and
+        the number of entries replayed. The caller should close the session.
+
+        Raises ValueError if the simulation does not exist, was not cloned
+        from a template, or its journal cannot be replayed
+    """
+    from database.memory import MemoryStore, copy_simulation  # these import modules which import this one
+    from models.schemas import PostedPrice
+    from routers.actions import circuit, conductAction, set_parameters, set_prices
+
+    simulation=session.get(Simulation,simulation_id)
+    if simulation is None:
+        raise ValueError(f"Simulation {simulation_id} does not exist")
+    if simulation.template_id is None:
+        raise ValueError(f"Simulation {simulation_id} was not cloned from a template, so it cannot be replayed")
+    if session.get(Simulation,simulation.template_id) is None:
+        raise ValueError(f"Simulation {simulation_id} cannot be replayed, because its template {simulation.template_id} no longer exists")
+    operations=journal(session,simulation_id,period,entries)
+    actions={act.actionName:act for act in circuit.values()}
+
+    store=MemoryStore(simulation_id)
+    replica_session=store.Session()
+    replica_session.info["replay"]=True
+    try:
+        copy_simulation(session,replica_session,simulation.template_id)
+        template=replica_session.get(Simulation,simulation.template_id)
+        replica=clone_model(template,replica_session,
+            id=simulation_id,
+            username=simulation.username,
+            state="DEMAND",
+            template_id=template.id,
+            materialised=False,
+        )
+        materialise(replica_session,replica)
+        replica_session.commit()
+        commodities=None
+        for entry in operations:
+            if entry.state!=replica.state:
+                raise ValueError(f"The journal of simulation {simulation_id} cannot be replayed: entry {entry.id} was made in state {entry.state}, but the replay is in state {replica.state}")
+            if entry.operation in actions:
+                conductAction(actions[entry.operation],replica,replica_session)
+            elif entry.operation=="setprices":
+                if commodities is None:
+                    commodities={c.name:c.id for c in replica_session.query(Commodity).where(Commodity.simulation_id==simulation_id)}
+                set_prices(replica_session,[
+                    PostedPrice(commodityId=commodities[price["commodity"]],simulationId=simulation_id,unitPrice=price["unit_price"])
+                    for price in entry.data
+                ],simulation.username)
+            elif entry.operation=="parameters":
+                set_parameters(replica_session,replica,entry.data,simulation.username)
+            elif entry.operation=="fast forward":
+                replica.time_stamp+=entry.data["periods"]
+                replica_session.commit()
+            else:
+                raise ValueError(f"The journal of simulation {simulation_id} cannot be replayed: entry {entry.id} is an unknown operation {entry.operation}")
+    except Exception:
+        replica_session.close()
+        store.engine.dispose()
+        raise
+    return store,replica_session,replica,len(operations)
@@ -0,0 +1,95 @@
+"""A pool of ready-made clones of each template.
+
+With CLONE_POOL_SIZE set (see authorization/config.py), that many clones
+of each template are kept ready: materialised, with their stocks valued,
+their buyers and sellers initialised and their capitals computed. A
+pooled simulation belongs to no user and is in the state POOL. When a
+user clones a template, take_from_pool hands them one of its pooled
+simulations, which costs three statements, and the pool is topped up again
+in the background (fill_pool). When the pool of a template is empty, the
+clone is made as usual (see actions/clone.py).
+
+At the start of a class, when everyone clones at once, the administrator
+can fill every pool beforehand with /admin/pool/fill.
+
+Pooled simulations are copies of their template as it was when they were
+made, so the pool of a template is emptied when it is reloaded (drain_pool).
+"""
+
+import threading
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+from actions.clone import clone_simulation, materialise
+from actions.reload import delete_template
+from authorization import config
+from database.database import SessionLocal
+from models.models import Simulation
+from report.report import logger
+
+pool_size=config.CLONE_POOL_SIZE
+
+# Only one fill at a time in this process, so that two do not both make up the same shortfall
+_fill_lock=threading.Lock()
+
+def take_from_pool(session: Session, template_id: int, username: str)->Simulation|None:
+    """Give 'username' a pooled clone of the template, ready to start at
+    DEMAND. Does not commit.
+
+        Returns None if the pool of this template is empty.
+    """
+    while True:
+        candidate=session.execute(
+            select(Simulation.id)
+            .where(Simulation.template_id==template_id,Simulation.state=="POOL")
+            .order_by(Simulation.id)
+            .limit(1)
+        ).scalar()
+        if candidate is None:
+            return None
+        claimed=session.execute(
+            update(Simulation)
+            .where(Simulation.id==candidate,Simulation.state=="POOL")  # unless another request has just taken it
+            .values(state="DEMAND",username=username)
+        ).rowcount
+        if claimed==1:
+            return session.get(Simulation,candidate)
+
+def fill_pool(template_ids: list[int]|None=None):
+    """Make clones of every template, or of those in 'template_ids', until
+    each has pool_size of them ready. Each clone is committed as it is made.
+    Uses a session of its own, so that it can run as a background task."""
+    if pool_size<=0:
+        return
+    with _fill_lock:
+        session=SessionLocal()
+        try:
+            query=session.query(Simulation).where(Simulation.state=="TEMPLATE")
+            if template_ids is not None:
+                query=query.where(Simulation.id.in_(template_ids))
+            for template in query.order_by(Simulation.id).all():
+                ready=session.execute(
+                    select(func.count()).select_from(Simulation).where(Simulation.template_id==template.id,Simulation.state=="POOL")
+                ).scalar()
+                try:
+                    for _ in range(pool_size-ready):
+                        simulation=clone_simulation(session,template,None)
+                        materialise(session,simulation)
+                        simulation.state="POOL"
+                        session.commit()
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"Could not fill the pool of template {template.id}: {e}")
+        finally:
+            session.close()
+
+def drain_pool(session: Session, template_id: int)->int:
+    """Delete the pooled clones of a template. Does not commit.
+
+        Returns the number deleted.
+    """
+    pooled=session.execute(
+        select(Simulation.id).where(Simulation.template_id==template_id,Simulation.state=="POOL")
+    ).scalars().all()
+    for simulation_id in pooled:
+        delete_template(session,simulation_id)
+    return len(pooled)
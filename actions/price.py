@@ -7,9 +7,13 @@ are transformed as a result.
 """
 
 from actions.utils import revalue_stocks
+from actions.dirty import mark_dirty
+from database import changes
 from models import models
 from models.models import Class_stock, Commodity,Industry, Industry_stock,SocialClass, Simulation
-from report.report import report
+from report.report import report, report_event
+from report.metrics import stage
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 
 def process_setprice(session: Session,simulation:Simulation):
@@ -24,6 +28,7 @@ def process_setprice(session: Session,simulation:Simulation):
     print("invoked pricess_price_reset")
     report(2, simulation.id, f"Finished processing price changes", session)
 
+@stage
 def process_price_reset(session: Session,simulation:Simulation):
     """
     Apply the effects of a change in money prices. 
@@ -35,7 +40,8 @@ def process_price_reset(session: Session,simulation:Simulation):
         2. do NOT resize, because a price change should not affect sizes TODO maybe test for this
         3. calculate MELT as sum of all commodity prices divided by sum of all commodity values
         4. modify all unit values by dividing by the MELT
-        5. for each commodity, propagate the change in unit values to the value of its stocks.
+        5. for each commodity, propagate the change in unit values and prices to the value and price of its stocks,
+           all in one statement (see reset_stocks)
         6. TEST that the total value of all stocks has not changed?
         7. TEST that total surplus value has not changed/is equal to profit in value terms?
     """
@@ -45,11 +51,10 @@ def process_price_reset(session: Session,simulation:Simulation):
     total_price=0
     total_value=0
     # TODO FOR DEMONSTRATION PURPOSES HERE WE ONLY INCLUDE PRODUCED COMMODITIES. FULL VERSION SHOULD LET USER CHOOSE
-    commodities=session.query(Commodity).where(Commodity.simulation_id==simulation.id).where(Commodity.origin=="INDUSTRIAL")
+    commodities=session.query(Commodity).where(Commodity.simulation_id==simulation.id).where(Commodity.origin=="INDUSTRIAL").all()
     c:Commodity
     for c in commodities:
-        session.add(c)
-        report(2,simulation.id,f"Commodity {c.name} before processing: total price is {c.total_price}",session)
+        report_event(2,simulation.id,"price.before",session,commodity=c,price=c.total_price)
         extra_price=c.unit_price*c.size
         extra_value=c.unit_value*c.size
         c.total_price=extra_price
@@ -58,13 +63,10 @@ def process_price_reset(session: Session,simulation:Simulation):
         # NOTE total value of c should be invariant; this calculation is ONLY used to set the simulation.total_value and hence calculate the MELT.
         # NOTE extra_value should not be used to reset c.total_value. Instead, we test they are equal and report a warning if they are not.
 
-        # report(2,simulation.id,f"Calculated value of {c.name} is {extra_value} bringing economy-wide total to {total_value}",session)
-        # report(2,simulation.id,f"Total price has reached {simulation.total_price}",session)
-
-        report(2,simulation.id,f"Price of {c.name} is {extra_price} bringing economy-wide total to {total_price}",session)
-        report(2,simulation.id,f"Value of {c.name} is {extra_value} bringing calculated economy-wide total to {total_value}",session)
+        report_event(2,simulation.id,"price.total",session,commodity=c,price=extra_price,amount=total_price)
+        report_event(2,simulation.id,"price.value",session,commodity=c,value=extra_value,amount=total_value)
         if c.total_value!=extra_value:
-            report(2,simulation.id,f"WARNING: value of {c.name} was {c.total_value} and the calculated value is {extra_value}. These should be the same but are not")
+            report(2,simulation.id,f"WARNING: value of {c.name} was {c.total_value} and the calculated value is {extra_value}. These should be the same but are not",session)
 
     # TODO simulation.total_value should be set separately from this. But since it isn't as yet, we set it here
     simulation.total_value=total_value
@@ -76,11 +78,41 @@ def process_price_reset(session: Session,simulation:Simulation):
     report(1,simulation.id,f"Applying MELT to unit values and then to stocks",session)
     for c in commodities:
         new_unit_value=c.unit_price/simulation.melt
-        report(2,simulation.id,f"Unit price of {c.name} was {c.unit_price} so unit value was reset to {new_unit_value}",session)
+        report_event(2,simulation.id,"price.unit_value",session,commodity=c,price=c.unit_price,value=new_unit_value)
+        if new_unit_value!=c.unit_value:
+            mark_dirty(c)
         c.unit_value=new_unit_value
-        c.revalue_stocks(session,simulation)
+    # no need to revalue the stocks if neither the unit price nor the unit value has changed
+    reset_stocks(session,simulation,[c.id for c in commodities if c.dirty])
     report(1,simulation.id,f"Finished applying MELT",session)
 
 #   TODO tests (steps 6-7)
 
-    session.commit()
+    session.flush()
+
+def reset_stocks(session:Session, simulation:Simulation, commodity_ids:list[int]):
+    """Set the value and price of every stock of the given commodities from
+    the unit value and unit price of its commodity.
+
+    Uses one UPDATE for industry stocks and one for class stocks, however
+    many stocks there are, so the unit values and prices of the commodities
+    are written (flushed) first. The commodities stay dirty, so they and
+    their stocks are revalued again in the usual way at the next revaluation.
+    """
+    if len(commodity_ids)==0:
+        return
+    session.flush()
+    for model in (Industry_stock,Class_stock):
+        unit_value=select(Commodity.unit_value).where(Commodity.id==model.commodity_id).scalar_subquery()
+        unit_price=select(Commodity.unit_price).where(Commodity.id==model.commodity_id).scalar_subquery()
+        statement=(
+            update(model)
+            .where(model.simulation_id==simulation.id,model.commodity_id.in_(commodity_ids))
+            .values(value=model.size*unit_value,price=model.size*unit_price)
+            .execution_options(synchronize_session="fetch")
+        )
+        if changes.watched(session,simulation.id):  # someone is watching, so tell them what changed
+            for id,value,price in session.execute(statement.returning(model.id,model.value,model.price)):
+                changes.record(session,simulation.id,model.__tablename__,id,{"value":float(value),"price":float(price)})
+        else:
+            session.execute(statement)
@@ -1,7 +1,9 @@
 from actions.utils import calculate_current_capitals
+from actions.dirty import mark_dirty
 from models.models import Simulation, Industry, Industry_stock
-from report.report import report
-from sqlalchemy.orm import Session
+from report.report import report, report_event
+from report.metrics import stage
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 def process_produce(session,simulation):
     produce(session, simulation)
@@ -10,6 +12,7 @@ def process_produce(session,simulation):
     # be complete before all the facts are in. 
 
 
+@stage
 def produce(session:Session, simulation:Simulation):
     """Tell all industries to produce. Then reset unit values.
     Once Production and Consumption are *both* complete, we recalculate
@@ -24,7 +27,10 @@ def produce(session:Session, simulation:Simulation):
     of production' whether ficitious or not.
     """
     report(1, simulation.id, "Tell all industries to produce", session)
-    iquery = session.query(Industry).where(Industry.simulation_id == simulation.id)
+    iquery = session.query(Industry).options(
+        joinedload(Industry.simulation),
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity),
+    ).where(Industry.simulation_id == simulation.id)
     for ind in iquery:
         industry_produce(ind, session, simulation)
     
@@ -59,20 +65,17 @@ def industry_produce(
     report(2, simulation.id, f"{industry.name} is producing", session)
     sales_stock = industry.sales_stock(session)
     session.add(sales_stock)
-    sales_commodity = sales_stock.commodity(session)
+    mark_dirty(sales_stock)
+    sales_commodity = sales_stock.commodity
     report(3,simulation.id,
         f"{sales_stock.name} of {sales_commodity.name} before production is {sales_stock.size} with value {sales_stock.value}",session,
     )
 
-    productive_stocks_query = session.query(Industry_stock).filter(
-        Industry_stock.simulation_id == simulation.id,
-        Industry_stock.industry_id == industry.id,
-        Industry_stock.usage_type == "Production",
-    )
-    for stock in productive_stocks_query:
+    for stock in industry.productive_stocks():
         session.add(stock)
-        commodity = stock.commodity(session)
-        report(4,simulation.id,f"Processing productive input '{stock.name}' with size {stock.size} and value {stock.value}",session)
+        mark_dirty(stock)
+        commodity = stock.commodity
+        report_event(4,simulation.id,"production.input",session,commodity=commodity,stock=stock,size=stock.size,value=stock.value)
 
         # Evaluate the size and value contribution of this stock
         if commodity.name == "Labour Power":
@@ -81,16 +84,16 @@ def industry_produce(
             stock.size -= value_contribution
             stock.value-=value_contribution*commodity.unit_value
             stock.price-= value_contribution*commodity.unit_price
-            report(4, simulation.id, f"{stock.name} creates value {value_contribution}", session)
+            report_event(4,simulation.id,"production.labour",session,commodity=commodity,stock=stock,amount=value_contribution)
         else:
             value_contribution = stock.flow_per_period(session)* sales_commodity.unit_value
             # Other productive stocks transfer their value, not their magnitude
             stock.value -= value_contribution
             stock.size -=stock.flow_per_period(session)
             stock.price-= stock.flow_per_period(session)*commodity.unit_price
-            report(4,simulation.id,f"{stock.name} transfers value {value_contribution} at unit value {commodity.unit_value} ",session)
+            report_event(4,simulation.id,"production.transfer",session,commodity=commodity,stock=stock,amount=value_contribution,value=commodity.unit_value)
         sales_stock.value += value_contribution
-        report(3, simulation.id, f"Sales value is {sales_stock.value} after inputs from [{stock.name}]", session)
+        report_event(3,simulation.id,"production.sales_value",session,commodity=commodity,stock=stock,value=sales_stock.value)
     # report(4, simulation.id, f"output scale is {industry.output_scale}", session) # Uncomment for more verbose diagnostics
     sales_stock.size += industry.output_scale/simulation.periods_per_year
     report(3, simulation.id, f"Sales value after production is {sales_stock.value} and size {sales_stock.size}", session)
@@ -98,6 +101,6 @@ def industry_produce(
     # TODO If MELT is not 1, we have to account below for the value of money
     sales_stock.price=sales_stock.value
     report(3, simulation.id, f"Sales price after production is {sales_stock.price}", session)
-    session.commit()
+    session.flush()
     report(2, simulation.id, f"Industry {industry.name} has finished producing", session)
 
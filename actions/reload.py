@@ -1,9 +1,28 @@
 from sqlalchemy.orm import Session
-from database.database import Base
+from database.database import Base, after_bulk_load
+import hashlib
 import json
-from sqlalchemy import insert
-from models.models import Buyer, Class_stock, Industry_stock, Seller
-from report.report import report
+import os
+from sqlalchemy import delete, insert, literal, select, union_all
+from sqlalchemy.orm import joinedload, selectinload
+from models.models import Buyer, Class_stock, Commodity, Industry, Industry_stock, JournalEntry, Seller, Simulation, SocialClass, TemplateFixture, simulation_models
+from actions.dirty import clear_dirty
+from actions.utils import calculate_current_capitals, calculate_initial_capitals, revalue_commodities, revalue_stocks
+from report.report import logger, report
+
+# The fixture file of each table of a template, in an order in which they can be inserted
+template_files=[
+    (Simulation,"simulations.json"),
+    (SocialClass,"classes.json"),
+    (Commodity,"commodities.json"),
+    (Industry,"industries.json"),
+    (Class_stock,"class_stocks.json"),
+    (Industry_stock,"industry_stocks.json"),
+]
+
+# Part of the hash of every template, so that changing what initialise_template
+# does makes every template count as changed, and be loaded and initialised again
+template_preparation="initialised with roles, buyers and sellers, values and capitals"
 
 def clear_table(session: Session, baseModel, simulation_id:int):
 
@@ -12,7 +31,7 @@ def clear_table(session: Session, baseModel, simulation_id:int):
     report(2,simulation_id,f"Clearing table {baseModel}", session)
     query = session.query(baseModel)
     query.delete(synchronize_session=False)
-    session.commit()
+    session.flush()
 
 def load_table(session: Session, baseModel, filename: str, reload: bool, simulation_id:int):
 
@@ -21,17 +40,223 @@ def load_table(session: Session, baseModel, filename: str, reload: bool, simulat
     table, use empty_table()"""
     
     report(2,simulation_id,f"Initialising table {filename}", session)
-    query = session.query(baseModel)
-    file = open(filename)
-    jason = json.load(file)
-    for item in jason:
-        try:
-            new_object = baseModel(**item)
-            session.add(new_object)
-        except Exception as e:
-            print(f"could not load {filename} because of exception {e} ")
-    session.commit()
+    with open(filename) as file:
+        insert_rows(session, baseModel, json.load(file), filename)
+
+def insert_rows(session: Session, baseModel, rows: list[dict], source: str):
+
+    """Insert fixture rows, ids and all, into the table of baseModel, with one
+    executemany for each set of columns the rows supply (normally just one).
+    Keys which are not columns of the table are reported and left out."""
+
+    columns=set(baseModel.__table__.columns.keys())
+    unknown=set()
+    groups={}
+    for row in rows:
+        unknown.update(set(row)-columns)
+        row={key:value for key,value in row.items() if key in columns}
+        groups.setdefault(tuple(sorted(row)),[]).append(row)
+    if unknown:
+        logger.warning(f"could not load {sorted(unknown)} from {source}: not columns of {baseModel.__tablename__}")
+    for group in groups.values():
+        session.execute(insert(baseModel.__table__),group)
+
+def template_folders(root: str="static")->list[str]:
+
+    """The folders under root which hold a template (those named by a number), in numerical order."""
+
+    return [f"{root}/{name}" for name in sorted((name for name in os.listdir(root) if name.isdigit()),key=int)]
+
+def read_template(folder: str)->tuple[dict,str]:
+
+    """The rows of each table of the template in folder, by model, and a
+    hash of the content of its fixture files."""
+
+    digest=hashlib.sha256(template_preparation.encode())
+    rows={}
+    for baseModel,filename in template_files:
+        with open(f"{folder}/{filename}","rb") as file:
+            content=file.read()
+        digest.update(filename.encode())
+        digest.update(content)
+        rows[baseModel]=json.loads(content)
+    return rows,digest.hexdigest()
+
+def folder_template_id(folder: str)->int:
+
+    """The id of the simulation defined by the template in folder."""
+
+    with open(f"{folder}/simulations.json") as file:
+        return json.load(file)[0]["id"]
+
+def delete_template(session: Session, simulation_id: int):
+
+    """Delete the simulation with this id and every row that belongs to it,
+    with one statement for each table."""
+
+    session.execute(delete(JournalEntry.__table__).where(JournalEntry.__table__.c.simulation_id==simulation_id))
+    for baseModel in reversed(simulation_models):
+        table=baseModel.__table__
+        session.execute(delete(table).where(table.c.simulation_id==simulation_id))
+    session.execute(delete(Simulation.__table__).where(Simulation.__table__.c.id==simulation_id))
+
+def load_template(session: Session, folder: str, only_changed: bool=False)->str:
+
+    """Load the template in folder, replacing the template with the same id
+    if there is one. Other simulations and users are not touched.
+
+        only_changed(bool):
+            if True, do nothing if the fixture files are the same as when
+            the template was last loaded
+
+    Returns 'loaded', 'unchanged', or why the template could not be loaded,
+    which happens if its ids are used by any other simulation or template,
+    or it cannot be initialised (see initialise_template). Does not commit.
+    """
+
+    rows,content_hash=read_template(folder)
+    simulation_id=rows[Simulation][0]["id"]
+    fixture=session.get(TemplateFixture,folder)
+    if only_changed and fixture is not None and fixture.content_hash==content_hash:
+        return "unchanged"
+
+    problems=[]
+    other=session.scalars(select(TemplateFixture).where(
+        TemplateFixture.simulation_id==simulation_id,
+        TemplateFixture.folder!=folder,
+    )).first()
+    if other is not None:
+        problems.append(f"simulation {simulation_id} is the template loaded from {other.folder}")
+    state=session.scalar(select(Simulation.state).where(Simulation.id==simulation_id))
+    if state is not None and state!="TEMPLATE":
+        problems.append(f"simulation {simulation_id} is not a template")
+    taken={}  # the ids of each file which other simulations already use, found with one query
+    for filename,id in session.execute(union_all(*[
+        select(literal(filename).label("filename"),baseModel.__table__.c.id).where(
+            baseModel.__table__.c.id.in_([row["id"] for row in rows[baseModel]]),
+            baseModel.__table__.c.simulation_id!=simulation_id,
+        ) for baseModel,filename in template_files[1:]
+    ])):
+        taken.setdefault(filename,[]).append(id)
+    for baseModel,filename in template_files[1:]:
+        if any(row["simulation_id"]!=simulation_id for row in rows[baseModel]):
+            problems.append(f"{filename} has rows which do not belong to simulation {simulation_id}")
+        if filename in taken:
+            problems.append(f"the ids {sorted(taken[filename])} of {filename} are used by another simulation")
+    if problems:
+        message=f"not loaded, because {'; '.join(problems)}"
+        report(1,0,f"ERROR: the template in {folder} was {message}",session)
+        return message
+
+    report(1,0,f"Loading template {rows[Simulation][0]['name']} (simulation {simulation_id}) from {folder}",session)
+    savepoint=session.begin_nested()
+    try:
+        if fixture is not None and fixture.simulation_id!=simulation_id:
+            delete_template(session,fixture.simulation_id)
+        if state is not None:
+            delete_template(session,simulation_id)
+        for baseModel,filename in template_files:
+            insert_rows(session,baseModel,rows[baseModel],f"{folder}/{filename}")
+        initialise_template(session,simulation_id)
+    except ValueError as e:
+        savepoint.rollback()
+        message=f"not loaded, because it is inconsistent ({e})"
+        report(1,0,f"ERROR: the template in {folder} was {message}",session)
+        return message
+    savepoint.commit()
+    if fixture is None:
+        session.add(TemplateFixture(folder=folder,simulation_id=simulation_id,content_hash=content_hash))
+    else:
+        fixture.simulation_id=simulation_id
+        fixture.content_hash=content_hash
+    session.flush()
+    return "loaded"
+
+def initialise_template(session: Session, simulation_id: int):
+
+    """Give a template which has just been loaded from its fixtures what a
+    clone needs before it can run: stock roles, buyers and sellers, and the
+    values, prices and capitals of its commodities, stocks and industries.
+    This is done once, here. Clones copy the results (see actions/clone.py),
+    and a clone which has not been materialised is shown with them. Does
+    not commit.
+
+    Raises ValueError if the template is inconsistent (see assign_stock_roles)
+    """
+
+    session.flush()
+    session.expire_all()  # the rows were inserted without the ORM, perhaps with the ids of rows it has loaded
+    template=session.get(Simulation,simulation_id)
+    assign_stock_roles(session,simulation_id)
+    initialise_buyers_and_sellers(session,simulation_id)
+    revalue_commodities(session,template)
+    revalue_stocks(session,template)
+    calculate_initial_capitals(session,template)
+    calculate_current_capitals(session,template)
+    clear_dirty(session,template)
+
+def reload_templates(session: Session, folders: list[str]|None=None, only_changed: bool=False)->dict[str,str]:
+
+    """Load the templates in folders (by default, every template folder),
+    in one transaction, which the caller commits. See load_template.
+
+    Returns what was done with each folder.
+    """
+
+    results={folder:load_template(session,folder,only_changed) for folder in (template_folders() if folders is None else folders)}
+    after_bulk_load(session,[baseModel for baseModel,_ in template_files])
+    return results
     
+def assign_stock_roles(session: Session, simulation_id:int):
+
+    """
+    Record, in each industry and class of one simulation, which of its
+    stocks is its Sales stock and which its Money stock. Record also, in
+    each industry that uses only one industrially-produced means of
+    production, the stock of it.
+
+    These are written to sales_stock_id, money_stock_id and mp_stock_id,
+    so that the actions can fetch them by id instead of searching the
+    owner's stocks. Called when a simulation is cloned, after its stocks
+    have been cloned.
+
+    Raises ValueError if an industry or class does not have exactly one
+    Sales stock and one Money stock, because the actions cannot work
+    without them.
+    """
+
+    report(1, simulation_id, f"Assigning the sales, money and means of production stocks of simulation {simulation_id}", session)
+    errors=[]
+    industries=session.query(Industry).options(
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity)
+    ).where(Industry.simulation_id==simulation_id)
+    for industry in industries:
+        sales=[stock for stock in industry.stocks if stock.usage_type=="Sales"]
+        money=[stock for stock in industry.stocks if stock.usage_type=="Money"]
+        means=[stock for stock in industry.productive_stocks() if stock.commodity.origin=="INDUSTRIAL"]
+        if len(sales)!=1 or len(money)!=1:
+            errors.append(f"Industry {industry.name} has {len(sales)} sales stocks and {len(money)} money stocks")
+            continue
+        industry.sales_stock_id=sales[0].id
+        industry.money_stock_id=money[0].id
+        industry.mp_stock_id=means[0].id if len(means)==1 else None
+    classes=session.query(SocialClass).options(
+        selectinload(SocialClass.stocks)
+    ).where(SocialClass.simulation_id==simulation_id)
+    for social_class in classes:
+        sales=[stock for stock in social_class.stocks if stock.usage_type=="Sales"]
+        money=[stock for stock in social_class.stocks if stock.usage_type=="Money"]
+        if len(sales)!=1 or len(money)!=1:
+            errors.append(f"Class {social_class.name} has {len(sales)} sales stocks and {len(money)} money stocks")
+            continue
+        social_class.sales_stock_id=sales[0].id
+        social_class.money_stock_id=money[0].id
+    if errors:
+        for error in errors:
+            report(1, simulation_id, f"ERROR: {error}", session)
+        raise ValueError("; ".join(errors))
+    session.flush()
+
 def initialise_buyers_and_sellers(db, simulation_id):
 
     """
@@ -50,17 +275,20 @@ def initialise_buyers_and_sellers(db, simulation_id):
 # Create seller list
 
     report(1, simulation_id, f"Creating a list of sellers for simulation {simulation_id}", db)
-    query = db.query(Seller)
+    query = db.query(Seller).where(Seller.simulation_id == simulation_id)
     query.delete(synchronize_session=False)
 
 # Add all Industry Sales stocks to seller list
 
-    stock_query = db.query(Industry_stock).filter(
+    stock_query = db.query(Industry_stock).options(
+        joinedload(Industry_stock.industry).selectinload(Industry.stocks),
+        joinedload(Industry_stock.commodity),
+    ).filter(
         Industry_stock.simulation_id == simulation_id, Industry_stock.usage_type == "Sales"
     )
     for stock in stock_query:
-        owner = stock.owner(db)
-        commodity = stock.commodity(db)
+        owner = stock.industry
+        commodity = stock.commodity
         money_stock_id = owner.money_stock(db).id
         sales_stock_id = stock.id
         commodity_id = commodity.id
@@ -79,12 +307,15 @@ def initialise_buyers_and_sellers(db, simulation_id):
 
 # Add all Class Sales stocks to seller list
 
-    stock_query = db.query(Class_stock).filter(
+    stock_query = db.query(Class_stock).options(
+        joinedload(Class_stock.social_class).selectinload(SocialClass.stocks),
+        joinedload(Class_stock.commodity),
+    ).filter(
         Class_stock.simulation_id == simulation_id, Class_stock.usage_type == "Sales"
     )
     for stock in stock_query:
-        owner = stock.owner(db)
-        commodity = stock.commodity(db)
+        owner = stock.social_class
+        commodity = stock.commodity
         money_stock_id = owner.money_stock(db).id
         sales_stock_id = stock.id
         commodity_id = commodity.id
@@ -100,24 +331,27 @@ def initialise_buyers_and_sellers(db, simulation_id):
         }
         new_seller = Seller(**seller)
         db.add(new_seller)
-    db.commit()
+    db.flush()
 
 # Create buyer list
 
     report(1, simulation_id, f"Creating a list of buyers for simulation {simulation_id}", db)
-    query = db.query(Buyer)
+    query = db.query(Buyer).where(Buyer.simulation_id == simulation_id)
     query.delete(synchronize_session=False)
 
 # Add all productive Industry stocks to buyer list
     
-    stock_query = db.query(Industry_stock).filter(
+    stock_query = db.query(Industry_stock).options(
+        joinedload(Industry_stock.industry).selectinload(Industry.stocks),
+        joinedload(Industry_stock.commodity),
+    ).filter(
         Industry_stock.simulation_id == simulation_id,
         Industry_stock.usage_type != "Money",
         Industry_stock.usage_type != "Sales",
     )
     for stock in stock_query:
-        owner = stock.owner(db)
-        commodity = stock.commodity(db)
+        owner = stock.industry
+        commodity = stock.commodity
         money_stock_id = owner.money_stock(db).id
         purchase_stock_id = stock.id
         commodity_id = commodity.id
@@ -136,14 +370,17 @@ def initialise_buyers_and_sellers(db, simulation_id):
 
 # Add all consumption Class stocks to buyer list
     
-    stock_query = db.query(Class_stock).filter(
+    stock_query = db.query(Class_stock).options(
+        joinedload(Class_stock.social_class).selectinload(SocialClass.stocks),
+        joinedload(Class_stock.commodity),
+    ).filter(
         Class_stock.simulation_id == simulation_id,
         Class_stock.usage_type != "Money",
         Class_stock.usage_type != "Sales",
     )
     for stock in stock_query:
-        owner = stock.owner(db)
-        commodity = stock.commodity(db)
+        owner = stock.social_class
+        commodity = stock.commodity
         money_stock_id = owner.money_stock(db).id
         purchase_stock_id = stock.id
         commodity_id = commodity.id
@@ -159,4 +396,4 @@ def initialise_buyers_and_sellers(db, simulation_id):
         }
         new_buyer = Buyer(**buyer)
         db.add(new_buyer)
-    db.commit()
+    db.flush()
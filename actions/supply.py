@@ -6,8 +6,9 @@ preparation for Trade.
 Quite simple: supply is simply the size of the Sales Stock.
 """
 from models.models import Class_stock, Commodity,Industry, Industry_stock,SocialClass, Simulation
-from report.report import report
-from sqlalchemy.orm import Session
+from report.report import report, report_event
+from report.metrics import stage
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 def process_supply(session:Session, simulation:Simulation):
     """
@@ -20,42 +21,49 @@ def process_supply(session:Session, simulation:Simulation):
     report(1,simulation.id, "Calculating supply from social classes",session)
     class_supply(session, simulation)  # tell classes to register their supply 
 
+@stage
 def initialise_supply(session,simulation):
     """Set supply of every commodity to zero to prepare for the calculation."""
     cquery = session.query(Commodity).where(Commodity.simulation_id==simulation.id)
     for c in cquery:
         session.add(c)
         c.supply=0
-    session.commit()
+    session.flush()
 
 # Ask each industry to tell its sale commodity how much it has to sell
+@stage
 def industry_supply(session,simulation):
     """Calculate supply from every industries for each commodity it produces."""
 
-    query=session.query(Industry).where(Industry.simulation_id==simulation.id)
+    query=session.query(Industry).options(
+        selectinload(Industry.stocks).joinedload(Industry_stock.commodity)
+    ).where(Industry.simulation_id==simulation.id)
     for industry in query:
         sales_stock:Industry_stock=industry.sales_stock(session)
-        commodity:Commodity=sales_stock.commodity(session)
+        commodity:Commodity=sales_stock.commodity
         # print(f"Debugging supply by industry {industry.name} and id {industry.id}")
         # print(f"Processing sales stock with name {sales_stock.name} and id {sales_stock.id}")
         # print(f"The commodity of this stock is {commodity.name} and its ID is {commodity.id}")
         session.add(commodity) # session.add(sales_stock) # not needed because we are not changing the stock
         ns=sales_stock.size 
-        report(2,simulation.id,f'{industry.name} adds {ns:.0f} to the supply of {commodity.name}, which was previously {commodity.supply:.0f}',session)
+        report_event(2,simulation.id,"supply.added",session,commodity=commodity,owner=industry,stock=sales_stock,amount=ns,size=commodity.supply)
         commodity.supply+=ns
-    session.commit()
+    session.flush()
 
 # Ask each class to tell its sale commodity how much it has to sell
+@stage
 def class_supply(session,simulation):
     """Calculate supply from every class for each commodity it produces."""
 
-    query=session.query(SocialClass).where(SocialClass.simulation_id==simulation.id)
+    query=session.query(SocialClass).options(
+        selectinload(SocialClass.stocks).joinedload(Class_stock.commodity)
+    ).where(SocialClass.simulation_id==simulation.id)
     for socialClass in query:
         sales_stock:Class_stock=socialClass.sales_stock(session)
-        commodity:Commodity=sales_stock.commodity(session) # commodity that this owner supplies
+        commodity:Commodity=sales_stock.commodity # commodity that this owner supplies
         session.add(commodity)
         ns=sales_stock.size 
-        report(2,simulation.id,f'{socialClass.name} adds {ns:.0f} to the supply of {commodity.name}, which was previously {commodity.supply:.0f}',session)  
+        report_event(2,simulation.id,"supply.added",session,commodity=commodity,owner=socialClass,stock=sales_stock,amount=ns,size=commodity.supply)  
         commodity.supply+=ns
-    session.commit()
+    session.flush()
 
@@ -1,8 +1,9 @@
 """This module contains functions used in handling the trade action."""
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from models.models import Buyer, Class_stock, Industry_stock, Seller, Commodity, Simulation
-from report.report import report
+from report.report import report, report_event
+from report.metrics import stage
 
 def process_trade(session,simulation):
     """
@@ -15,12 +16,16 @@ def process_trade(session,simulation):
     constrain_demand(session, simulation)
     buy_and_sell(session, simulation)
 
+@stage
 def constrain_demand(session,simulation):
     """Constrain demand to supply.
     TODO mostly untested
     """
     report(1,simulation.id,"Constraining demand to supply",session)
-    query=session.query(Commodity).where(Commodity.simulation_id==simulation.id)
+    query=session.query(Commodity).options(
+        selectinload(Commodity.industry_stocks),
+        selectinload(Commodity.class_stocks),
+    ).where(Commodity.simulation_id==simulation.id)
     for commodity in query:
         session.add(commodity)
         if (commodity.usage=="PRODUCTIVE".strip()) or (commodity.usage=="CONSUMPTION".strip()):
@@ -39,20 +44,32 @@ def constrain_demand(session,simulation):
                 report(3,simulation.id,f'Constraining stocks of {commodity.name} by a factor of {commodity.allocation_ratio}',session)
 
 # Tell industry stocks the bad news.
-                stock_query=session.query(Industry_stock).where(Industry_stock.commodity_id==commodity.id)
-                for stock in stock_query:
+                for stock in commodity.industry_stocks:
                     session.add(stock)
                     stock.demand=stock.demand*commodity.allocation_ratio
                     report(3,simulation.id, f"constraining demand in industry stock {stock.id} called {stock.name} to {stock.demand}",session)
 
 # Tell class stocks the bad news.
-                stock_query=session.query(Class_stock).where(Class_stock.commodity_id==commodity.id)
-                for stock in stock_query:
+                for stock in commodity.class_stocks:
                     session.add(stock)
                     stock.demand=stock.demand*commodity.allocation_ratio
                     report(3,simulation.id, f"constraining demand in class stock {stock.id} called {stock.name} {stock.demand}",session)
             report(2,simulation.id,f'Finished constraining demand',session)
 
+def trader_options(trader:type[Buyer]|type[Seller])->list:
+    """Loader options which fetch, along with each Buyer or Seller, the
+    commodity it trades and every stock it may refer to (and their owners),
+    so that trade does not issue a query for each of them."""
+    stock_kind="purchase" if trader is Buyer else "sales"
+    return [
+        selectinload(trader.commodity),
+        selectinload(getattr(trader,f"industry_{stock_kind}_stock")).selectinload(Industry_stock.industry),
+        selectinload(getattr(trader,f"class_{stock_kind}_stock")).selectinload(Class_stock.social_class),
+        selectinload(trader.industry_money_stock),
+        selectinload(trader.class_money_stock),
+    ]
+
+@stage
 def buy_and_sell(session:Session, simulation:Simulation):
     """Implements buying and selling.
 
@@ -70,39 +87,44 @@ def buy_and_sell(session:Session, simulation:Simulation):
     TODO if demand is actually less than supply then we need some mechanism
     to oblige sellers to sell less. This can probably done within this 
     function - as indeed may be possible for the allocation of demand itself.
+
+    Does not catch exceptions: a trade which fails part of the way through
+    is rolled back as a whole by the caller of conductAction.
     """
 
-    for seller in session.query(Seller).where(Seller.simulation_id == simulation.id):
-        sales_stock = seller.sales_stock(session)
-        try:
-            report(2,simulation.id,f"seller {seller.owner_name(session)} can sell {sales_stock.size} and is looking for buyers {sales_stock.name}",session,)
-
-            for buyer in session.query(Buyer).where(
-                Buyer.simulation_id == simulation.id,
-                Buyer.commodity_id == seller.commodity_id,
-            ):
-                report(3,simulation.id,f"buyer {buyer.owner_name(session)} will buy {buyer.purchase_stock(session).demand}",session,)
-                buy(buyer, seller, simulation, session)
-            report(2,simulation.id,"Finished selling",session,)
-        except Exception as e:
-            print(f"Error {e} looking for buyers")
-    session.commit()
+    buyers_of={}  # the buyers of each commodity, in the order they were created
+    for buyer in session.query(Buyer).options(*trader_options(Buyer)).where(
+        Buyer.simulation_id == simulation.id
+    ).order_by(Buyer.id):
+        buyers_of.setdefault(buyer.commodity_id,[]).append(buyer)
+
+    for seller in session.query(Seller).options(*trader_options(Seller)).where(
+        Seller.simulation_id == simulation.id
+    ).order_by(Seller.id):
+        sales_stock = seller.sales_stock
+        report_event(2,simulation.id,"trade.offer",session,commodity=seller.commodity,stock=sales_stock,size=sales_stock.size)
+
+        for buyer in buyers_of.get(seller.commodity_id,[]):
+            report_event(3,simulation.id,"trade.demand",session,commodity=buyer.commodity,stock=buyer.purchase_stock,amount=buyer.purchase_stock.demand)
+            buy(buyer, seller, simulation, session)
+        report(2,simulation.id,"Finished selling",session,)
+    session.flush()
 
 def buy(buyer:Buyer, seller:Seller, simulation:Simulation, session:Session):
     """Tell seller to sell whatever the buyer demands and collect the money."""
-    report(3,simulation.id,f"buyer {buyer.owner_name(session)} is buying {buyer.purchase_stock(session).demand}",session,)
-    buyer_purchase_stock:Industry_stock|Class_stock = buyer.purchase_stock(session)
-    seller_sales_stock:Industry_stock|Class_stock = seller.sales_stock(session)
-    buyer_money_stock:Industry_stock|Class_stock = buyer.money_stock(session)
-    seller_money_stock:Industry_stock|Class_stock = seller.money_stock(session)
-    commodity:Commodity = seller.commodity(session)  # does not change yet, so no need to add it to the session
+    report_event(3,simulation.id,"trade.buying",session,commodity=buyer.commodity,stock=buyer.purchase_stock,amount=buyer.purchase_stock.demand)
+    buyer_purchase_stock:Industry_stock|Class_stock = buyer.purchase_stock
+    seller_sales_stock:Industry_stock|Class_stock = seller.sales_stock
+    buyer_money_stock:Industry_stock|Class_stock = buyer.money_stock
+    seller_money_stock:Industry_stock|Class_stock = seller.money_stock
+    commodity:Commodity = seller.commodity  # does not change yet, so no need to add it to the session
     amount = buyer_purchase_stock.demand
     # report(4,simulation.id,f"seller sales stock is {seller_sales_stock.name}",session)
     # report(4,simulation.id,f"buyer purchase stock is {buyer_purchase_stock.name}",session)
     # report(4,simulation.id,f"buyer money stock is {buyer_money_stock.name}",session)
     # report(4,simulation.id,f"seller money stock is {seller_money_stock.name}",session)
-    report(3,simulation.id,
-        f"{buyer.owner_name(session)} is buying {amount} at price {commodity.unit_price} and value {commodity.unit_value}",session,
+    report_event(3,simulation.id,"trade.bought",session,
+        commodity=commodity,stock=buyer_purchase_stock,amount=amount,price=commodity.unit_price,value=commodity.unit_value,
     )
 
 # Transfer the goods
@@ -125,6 +147,6 @@ def buy(buyer:Buyer, seller:Seller, simulation:Simulation, session:Session):
         # TODO account for MELT. Money can have a value different from its price
         seller_money_stock.change_size(amount * commodity.unit_price,session)
         buyer_money_stock.change_size(-amount * commodity.unit_price,session)
-    # db.commit() # TODO verify that this is achieved by the final commit.
+    # db.flush() # TODO verify that this is achieved by the final commit.
     report(3,simulation.id,"Finished Paying",session,)
     
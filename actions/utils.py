@@ -1,9 +1,12 @@
 from models.models import Class_stock, Commodity,Industry, Industry_stock, Simulation
-from report.report import report
-from sqlalchemy.orm import Session
+from actions.dirty import dirty_class_stocks, dirty_industries, dirty_industry_stocks
+from report.report import report, report_event
+from report.metrics import stage
+from sqlalchemy.orm import Session, selectinload
 
 """Helper functions for use in all parts of the simulation."""
 
+@stage
 def revalue_commodities(
       session:Session, 
       simulation:Simulation):
@@ -11,7 +14,10 @@ def revalue_commodities(
   Recalculate unit values and unit prices on this basis.
   """
   report(1,simulation.id,"Calculate the size, value and price of all commodities",session)
-  commodities=session.query(Commodity).where(Commodity.simulation_id==simulation.id)
+  commodities=session.query(Commodity).options(
+      selectinload(Commodity.industry_stocks),
+      selectinload(Commodity.class_stocks),
+  ).where(Commodity.simulation_id==simulation.id).all()
   for c in commodities:
       session.add(c)
       c.total_value=0
@@ -19,27 +25,25 @@ def revalue_commodities(
       c.size=0
 
 # Calculate the contribution of all stocks belonging to industries
-      istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==c.id)
-      for si in istocks:
-          report(2,simulation.id,f"Processing industrial stock of {c.name} called [{si.name}]",session)
+      for si in c.industry_stocks:
+          report_event(2,simulation.id,"commodity.stock",session,commodity=c,stock=si)
           c.total_value+=si.value
           c.total_price+=si.price
           c.size+=si.size
-          report(3,simulation.id,f"Adding {si.size} to the size of {c.name}",session)
-          report(3,simulation.id,f"Adding {si.value} to the value of {c.name}",session)
-          report(3,simulation.id,f"Adding {si.price} to the price of {c.name}",session)
+          report_event(3,simulation.id,"commodity.size",session,commodity=c,stock=si,size=si.size)
+          report_event(3,simulation.id,"commodity.value",session,commodity=c,stock=si,value=si.value)
+          report_event(3,simulation.id,"commodity.price",session,commodity=c,stock=si,price=si.price)
           # report(2,simulation.id,f"Commodity {c.name} now has size {c.size}, value {c.total_value}, price {c.total_price}",session)
 
 # Calculate the contribution of all stocks belonging to classes
-      cstocks=session.query(Class_stock).where(Class_stock.commodity_id==c.id)
-      for sc in cstocks:
-          report(2,simulation.id,f"Processing class stock of {c.name} called [{sc.name}]",session)
+      for sc in c.class_stocks:
+          report_event(2,simulation.id,"commodity.stock",session,commodity=c,stock=sc)
           c.total_value+=sc.value
           c.total_price+=sc.price
           c.size+=sc.size
-          report(3,simulation.id,f"Adding {sc.size} to the size of {c.name}",session)
-          report(3,simulation.id,f"Adding {sc.value} to the value of {c.name}",session)
-          report(3,simulation.id,f"Adding {sc.price} to the price of {c.name}",session)
+          report_event(3,simulation.id,"commodity.size",session,commodity=c,stock=sc,size=sc.size)
+          report_event(3,simulation.id,"commodity.value",session,commodity=c,stock=sc,value=sc.value)
+          report_event(3,simulation.id,"commodity.price",session,commodity=c,stock=sc,price=sc.price)
           # report(2,simulation.id,f"Commodity {c.name} now has size {c.size}, value {c.total_value}, price {c.total_price}",session)
 
 # Recalculate the unit values and prices of all commodities from their size and totals
@@ -53,40 +57,42 @@ def revalue_commodities(
       else:
         report(3,simulation.id,f"Commodity {c.name} has zero size; no action taken",session)
       report(2,simulation.id,f"Finished resetting unit value and price of commodity {c.name}",session)
-  session.commit()
+  session.flush()
   report(1,simulation.id,"Finished calculating both total and unit value and price of all commodities",session)
 
+@stage
 def revalue_stocks(
       session:Session, 
       simulation:Simulation):
-  """ Revalue all stocks.
+  """ Revalue all stocks that have changed, or whose commodity has changed
+  (see actions/dirty.py).
   Set value from unit value and size of their commodity
   Set price from unit price and size of their commodity
   """
   report(1,simulation.id,"Reset stock values and prices from the unit values and prices of their commodities",session)
 
 # Industry stocks
-  istocks=session.query(Industry_stock).where(Industry_stock.simulation_id==simulation.id)
+  istocks=dirty_industry_stocks(session,simulation)
   report(2,simulation.id,"Resetting industry stocks",session)
   for stock in istocks:
-      commodity=session.query(Commodity).where(Commodity.id == stock.commodity_id).first()
+      commodity=stock.commodity
       session.add(stock)
       stock.value=stock.size*commodity.unit_value
       stock.price=stock.size*commodity.unit_price
-      report(3,simulation.id,f"Setting value {stock.value} and price {stock.price} for stock [{stock.name}]",session)
-  session.commit()
+      report_event(3,simulation.id,"stock.revalued",session,commodity=commodity,stock=stock,value=stock.value,price=stock.price)
+  session.flush()
   report(2,simulation.id,"Finished resetting industry stocks",session)
 
 # Class stocks
-  cstocks=session.query(Class_stock).where(Class_stock.simulation_id==simulation.id)
+  cstocks=dirty_class_stocks(session,simulation)
   report(2,simulation.id,"Resetting class stocks",session)
   for stock in cstocks:
-      commodity=session.query(Commodity).where(Commodity.id == stock.commodity_id).first()
+      commodity=stock.commodity
       session.add(stock)
       stock.value=stock.size*commodity.unit_value
       stock.price=stock.size*commodity.unit_price
-      report(3,simulation.id,f"Setting value to {stock.value} and price to {stock.price} for stock called {stock.name} ",session)
-  session.commit()
+      report_event(3,simulation.id,"stock.revalued",session,commodity=commodity,stock=stock,value=stock.value,price=stock.price)
+  session.flush()
   report(2,simulation.id,"Finished resetting class stocks",session)
 
 def capital(
@@ -110,13 +116,13 @@ def capital(
           the capital of the industry concerned
     """
     result=0
-    istocks=session.query(Industry_stock).where(Industry_stock.industry_id==industry.id)
-    for stock in istocks:
-        report(3,simulation.id,f"Adding {stock.price} to capital of {industry.name} for Industry stock [{stock.name}]",session)
+    for stock in industry.stocks:
+        report_event(3,simulation.id,"capital.stock",session,owner=industry,stock=stock,price=stock.price)
         result+=stock.price
     return result
 
 
+@stage
 def calculate_initial_capitals(
       session:Session, 
       simulation:Simulation):
@@ -131,7 +137,7 @@ def calculate_initial_capitals(
           the simulation that is currently being processed    
     """
     report(1,simulation.id,f"Calculate initial capital for simulation {simulation.id}",session)
-    industries=session.query(Industry).where(Industry.simulation_id==simulation.id)
+    industries=session.query(Industry).options(selectinload(Industry.stocks)).where(Industry.simulation_id==simulation.id)
     for ind in industries:
       session.add(ind)
       report(2,simulation.id,f"Calculating the initial capital of {ind.name}",session)
@@ -139,8 +145,9 @@ def calculate_initial_capitals(
       report(2,simulation.id,f"Initial capital of {ind.name} is {ind.initial_capital}",session)
     # report(1,simulation.id,f"Finished calculating initial capital",session)
 
-    session.commit()
+    session.flush()
 
+@stage
 def calculate_current_capitals(
       session:Session, 
       simulation:Simulation):
@@ -148,6 +155,9 @@ def calculate_current_capitals(
     Calculate the current capital of all industries in the simulation and store it.
     Set the profit and the profit rate of each industry.
 
+    Only industries which own a stock that has changed since the last revaluation
+    are visited, since the capital of the others cannot have changed (see actions/dirty.py).
+
     Assumes that the prices of all stocks have  been set correctly.
 
       session(Session):
@@ -158,7 +168,7 @@ def calculate_current_capitals(
 
     """
     report(1,simulation.id,f"Calculating current capital for simulation {simulation.id}",session)
-    industries=session.query(Industry).where(Industry.simulation_id==simulation.id)
+    industries=dirty_industries(session,simulation)
     for ind in industries:
       report(2,simulation.id,f"Calculating the current capital of {ind.name}",session)
       session.add(ind)
@@ -166,7 +176,7 @@ def calculate_current_capitals(
       ind.profit=ind.current_capital-ind.initial_capital
       ind.profit_rate=ind.profit/ind.initial_capital
       report(2,simulation.id,f"Current capital of {ind.name} is {ind.current_capital}, profit is {ind.profit} and profit rate is {ind.profit_rate}",session)
-    session.commit()
+    session.flush()
     # report(1,simulation.id,f"Finished calculating current capital",session)
 
 def validate(object:any, name:str)->bool:
@@ -6,6 +6,42 @@ config.read('config.cfg')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
-SQLALCHEMY_DATABASE_URL= "sqlite:///./sql_app.db"
 
+def setting(name:str, fallback:str, section:str="database")->str:
+    """A setting. Taken from the environment variable 'name' if there is
+    one, otherwise from 'section' of config.cfg, otherwise 'fallback'."""
+    return os.environ.get(name, config.get(section, name, fallback=fallback))
 
+# Any database that SQLAlchemy supports. PostgreSQL needs a driver such as psycopg2.
+# DATABASE_URL is the name that hosting services such as Heroku use.
+SQLALCHEMY_DATABASE_URL = setting("SQLALCHEMY_DATABASE_URL", os.environ.get("DATABASE_URL", "sqlite:///./sql_app.db"))
+
+# Connection pool (ignored for in-memory SQLite)
+DB_POOL_SIZE = int(setting("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(setting("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(setting("DB_POOL_RECYCLE", "1800"))  # seconds; -1 never recycles
+DB_POOL_PRE_PING = setting("DB_POOL_PRE_PING", "true").lower()=="true"
+
+# The performance profile applied to every SQLite connection (see database/sqlite.py).
+# Set SQLITE_PROFILE to 'off' to leave SQLite with its defaults.
+SQLITE_PROFILE = setting("SQLITE_PROFILE", "on")
+SQLITE_JOURNAL_MODE = setting("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = setting("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(setting("SQLITE_MMAP_SIZE", str(256*1024*1024)))  # bytes
+SQLITE_CACHE_SIZE = int(setting("SQLITE_CACHE_SIZE", str(-64*1024)))  # negative means KiB, positive means pages
+SQLITE_TEMP_STORE = setting("SQLITE_TEMP_STORE", "MEMORY")
+SQLITE_BUSY_TIMEOUT = int(setting("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+SQLITE_FOREIGN_KEYS = setting("SQLITE_FOREIGN_KEYS", "ON")
+
+# Timing and SQL statement counts, published on /metrics (see report/metrics.py).
+# Off by default; when off, nothing is measured.
+METRICS = setting("METRICS", "off", "metrics")
+
+# Reporting of SQL statements repeated within one request or action (see report/querywatch.py).
+# Off by default.
+QUERY_WATCH = setting("QUERY_WATCH", "off", "metrics")
+QUERY_REPEAT_THRESHOLD = int(setting("QUERY_REPEAT_THRESHOLD", "10", "metrics"))
+
+# The number of ready-made clones of each template to keep (see actions/pool.py).
+# 0, the default, keeps none, and every clone is made when it is asked for.
+CLONE_POOL_SIZE = int(setting("CLONE_POOL_SIZE", "0", "clones"))
@@ -0,0 +1,129 @@
+"""Benchmark: throughput of readers while an action is writing.
+
+Runs the same workload twice, once with the SQLite performance profile
+(see database/sqlite.py) and once with SQLite's defaults, and prints the
+results side by side.
+
+The workload is one writer, which takes a freshly cloned simulation round
+the circuit for as long as the benchmark lasts, and several readers, each
+of which repeatedly fetches the commodities and stocks of that simulation
+as the front end would. Each run uses a new database in a temporary
+directory, so the working database is not touched.
+
+Usage (from the root of the project):
+
+    python -m benchmarks.concurrent_reads [--readers 4] [--seconds 10]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_workload(readers:int, seconds:float)->dict:
+    """Run the workload against a database in the current directory, with
+    whatever profile the environment selects, and return the counts."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0,ROOT)
+    from fastapi import Response
+    from sqlalchemy.exc import OperationalError
+    from actions.clone import materialise_by_id
+    from database.database import Base, SessionLocal, engine
+    from models.models import Commodity, Industry_stock, Class_stock, Simulation, User
+    from routers.actions import get_json, run_periods
+    from routers.user import create_simulation_from_template
+
+    Base.metadata.create_all(bind=engine)
+    session=SessionLocal()
+    get_json(session)
+    user=session.query(User).where(User.username=="guest").first()
+    simulation_id=create_simulation_from_template("1",Response(),user,session)["simulation_id"]
+    materialise_by_id(session,simulation_id)  # so that the readers have rows to read from the start
+    session.close()
+
+    stop=threading.Event()
+    counts={"reads":0,"read_errors":0,"periods":0,"write_errors":0,"slowest_read":0.0}
+    lock=threading.Lock()
+
+    def writer():
+        session=SessionLocal()
+        simulation=session.get(Simulation,simulation_id)
+        while not stop.is_set():
+            try:
+                run_periods(session,simulation,1,0.0,False)
+                with lock:
+                    counts["periods"]+=1
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    counts["write_errors"]+=1
+        session.close()
+
+    def reader():
+        session=SessionLocal()
+        while not stop.is_set():
+            started=time.perf_counter()
+            try:
+                session.query(Commodity).where(Commodity.simulation_id==simulation_id).all()
+                session.query(Industry_stock).where(Industry_stock.simulation_id==simulation_id).all()
+                session.query(Class_stock).where(Class_stock.simulation_id==simulation_id).all()
+                session.rollback()
+                with lock:
+                    counts["reads"]+=1
+                    counts["slowest_read"]=max(counts["slowest_read"],time.perf_counter()-started)
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    counts["read_errors"]+=1
+        session.close()
+
+    threads=[threading.Thread(target=writer)]+[threading.Thread(target=reader) for _ in range(readers)]
+    start=time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed=time.perf_counter()-start
+    counts["seconds"]=elapsed
+    counts["reads_per_second"]=counts["reads"]/elapsed
+    counts["periods_per_second"]=counts["periods"]/elapsed
+    return counts
+
+def run_profile(profile:str, readers:int, seconds:float)->dict:
+    """Run the workload in a fresh process and a fresh directory, with the
+    profile turned on or off."""
+    with tempfile.TemporaryDirectory() as directory:
+        os.symlink(os.path.join(ROOT,"static"),os.path.join(directory,"static"))
+        environment=dict(os.environ,SQLITE_PROFILE=profile)
+        result=subprocess.run(
+            [sys.executable,"-m","benchmarks.concurrent_reads","--worker","--readers",str(readers),"--seconds",str(seconds)],
+            cwd=directory,env=dict(environment,PYTHONPATH=ROOT),capture_output=True,text=True,check=True,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers",type=int,default=4)
+    parser.add_argument("--seconds",type=float,default=10)
+    parser.add_argument("--worker",action="store_true",help=argparse.SUPPRESS)
+    args=parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_workload(args.readers,args.seconds)))
+        return
+    results={profile:run_profile(profile,args.readers,args.seconds) for profile in ("off","on")}
+    print(f"{args.readers} readers, one writer, {args.seconds:g} seconds")
+    print(f"{'profile':<10}{'reads/s':>10}{'slowest read (ms)':>19}{'periods/s':>12}{'read errors':>14}{'write errors':>14}")
+    for profile,r in results.items():
+        print(f"{profile:<10}{r['reads_per_second']:>10.1f}{1000*r['slowest_read']:>19.1f}{r['periods_per_second']:>12.2f}{r['read_errors']:>14}{r['write_errors']:>14}")
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Check that no action executes more SQL statements than it is allowed.
+
+Takes a synthetic template (see benchmarks/synthetic.py) once round the
+circuit, and runs each action inside query_budget (see
+report/querywatch.py) with the budget declared for it below: the most
+statements it may execute, and the most times it may repeat any one
+query. The budgets are a little above what each action needs today, so
+a change which adds queries, or which puts a query inside a loop, fails
+the check.
+
+Exits with status 1 if any action is over budget, so it can be run
+before deployment. Runs in a temporary directory, so the working
+database is not touched.
+
+Usage (from the root of the project):
+
+    python -m benchmarks.query_budget
+
+When an action is made cheaper, lower its budget to match.
+"""
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The template the budgets apply to: industries, commodities, classes
+SIZE=(8,8,2)
+
+# For each action: (statements, repeats of any one query)
+budgets={
+    "demand":(25,3),
+    "supply":(16,2),
+    "trade":(55,5),
+    "produce":(30,2),
+    "reproduce":(115,12),
+    "set price":(5,2),
+    "invest":(55,9),
+}
+
+def check()->list[tuple]:
+    """Run the circuit against a database in the current directory and
+    return, for each action, its name, the statements it executed, the
+    most times it repeated a query, and what went over budget (or None)."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0,ROOT)
+    from fastapi import Response
+    from benchmarks.synthetic import generate_template, load_template
+    from actions.clone import materialise
+    from database.database import Base, SessionLocal, engine
+    from models.models import Simulation, User
+    from report.querywatch import QueryBudgetExceeded, query_budget
+    from routers.actions import circuit, conductAction, get_json
+    from routers.user import create_simulation_from_template
+
+    Base.metadata.create_all(bind=engine)
+    session=SessionLocal()
+    get_json(session)
+    template=generate_template(*SIZE)
+    load_template(session,template)
+    session.commit()
+    user=session.query(User).where(User.username=="guest").first()
+    simulation_id=create_simulation_from_template(str(template["simulations.json"][0]["id"]),Response(),user,session)["simulation_id"]
+    simulation=session.get(Simulation,simulation_id)
+    materialise(session,simulation)  # so that the first action is not charged with copying the template
+    session.commit()
+
+    results=[]
+    for _ in circuit:
+        act=circuit[simulation.state]
+        statements,repeats=budgets[act.actionName]
+        failure=None
+        try:
+            with query_budget(statements,repeats) as log:
+                conductAction(act,simulation,session)
+        except QueryBudgetExceeded as e:
+            failure=str(e)
+        most=max((count for text,count in log.fingerprints.items() if text[:6].upper()=="SELECT"),default=0)
+        results.append((act.actionName,log.statements,most,failure))
+    session.close()
+    return results
+
+def main():
+    if "--worker" in sys.argv:
+        with contextlib.redirect_stdout(io.StringIO()):  # the actions print as they go
+            results=check()
+        print(f"{'action':<12}{'statements':>12}{'budget':>8}{'repeats':>9}{'budget':>8}")
+        for name,statements,repeats,failure in results:
+            print(f"{name:<12}{statements:>12}{budgets[name][0]:>8}{repeats:>9}{budgets[name][1]:>8}{'  OVER BUDGET' if failure else ''}")
+            if failure:
+                print("    "+failure.replace("\n","\n    "))
+        sys.exit(1 if any(failure for *_,failure in results) else 0)
+    with tempfile.TemporaryDirectory() as directory:
+        os.symlink(os.path.join(ROOT,"static"),os.path.join(directory,"static"))
+        result=subprocess.run(
+            [sys.executable,"-m","benchmarks.query_budget","--worker"],
+            cwd=directory,env=dict(os.environ,PYTHONPATH=ROOT),
+        )
+    sys.exit(result.returncode)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Benchmark: how the API scales with the size of the economy.
+
+For each size, generates a synthetic template (see benchmarks/synthetic.py)
+and times, through the API as the front end would call it:
+
+    clone: cloning the template
+    demand, supply, trade, produce, consume, prices, invest: each stage
+    period: a whole period (/action/run/1)
+    /commodity/, /industry/, /classes/, /stocks/industry, /stocks/class,
+    /trace/: the list endpoints, on the simulation after those two periods
+
+Each measurement is repeated on a fresh clone, and the median, the
+fastest and the slowest are kept. Each size runs in a new process with a
+new database in a temporary directory, so the working database is not
+touched.
+
+The results are written as JSON, together with the commit they were
+measured on, so that the results of two commits can be compared:
+
+    python -m benchmarks.suite [--sizes 4x4x2,16x16x3,64x64x4] [--repeats 3] [--output results.json]
+    python -m benchmarks.suite --compare before.json after.json
+
+A size NxMxK has N industries, M produced commodities and K classes. With
+N equal to M every industry is the only producer of its commodity, and the
+economy reproduces itself unchanged; with N greater than M, the industries
+that share a commodity compete for its buyers.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+stages=["demand","supply","trade","produce","consume","prices","invest"]
+list_endpoints=["/commodity/","/industry/","/classes/","/stocks/industry","/stocks/class","/trace/"]
+
+def parse_size(text:str)->tuple[int,int,int]:
+    """Read a size written as NxMxK."""
+    industries,commodities,classes=(int(part) for part in text.lower().split("x"))
+    return industries,commodities,classes
+
+def run_size(industries:int, commodities:int, classes:int, repeats:int)->dict:
+    """Time everything for one size, against a database in the current
+    directory, and return the timings in seconds."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0,ROOT)
+    from fastapi.testclient import TestClient
+    from benchmarks.synthetic import generate_template, load_template
+    from database.database import SessionLocal
+    from main import app
+
+    client=TestClient(app)
+    headers={"x-api-key":"guestkey"}
+    client.get("/action/reset")
+    session=SessionLocal()
+    template=generate_template(industries,commodities,classes)
+    load_template(session,template)
+    session.commit()
+    session.close()
+    template_id=template["simulations.json"][0]["id"]
+
+    def timed(url:str)->tuple[float,dict|list]:
+        started=time.perf_counter()
+        response=client.get(url,headers=headers)
+        elapsed=time.perf_counter()-started
+        body=response.json()
+        message=body.get("message","") if isinstance(body,dict) else ""
+        if response.status_code!=200 or message.startswith("Error"):
+            raise RuntimeError(f"{url} failed: {response.status_code} {message}")
+        return elapsed,body
+
+    times={name:[] for name in ["clone",*stages,"period",*list_endpoints]}
+    for _ in range(repeats):
+        elapsed,clone=timed(f"/clone/{template_id}")
+        times["clone"].append(elapsed)
+        for stage in stages:
+            times[stage].append(timed(f"/action/{stage}")[0])
+        times["period"].append(timed("/action/run/1")[0])
+        for url in list_endpoints:
+            times[url].append(timed(url)[0])
+        client.get(f"/simulations/delete/{clone['simulation_id']}",headers=headers)
+    return {
+        "industries":industries,
+        "commodities":commodities,
+        "classes":classes,
+        "stocks":len(template["industry_stocks.json"])+len(template["class_stocks.json"]),
+        "timings":{
+            name:{"median":statistics.median(values),"min":min(values),"max":max(values)}
+            for name,values in times.items()
+        },
+    }
+
+def run_in_process(size:str, repeats:int)->dict:
+    """Run one size in a fresh process and a fresh directory."""
+    with tempfile.TemporaryDirectory() as directory:
+        os.symlink(os.path.join(ROOT,"static"),os.path.join(directory,"static"))
+        result=subprocess.run(
+            [sys.executable,"-m","benchmarks.suite","--worker","--sizes",size,"--repeats",str(repeats)],
+            cwd=directory,env=dict(os.environ,PYTHONPATH=ROOT),capture_output=True,text=True,check=True,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def describe_environment()->dict:
+    """What the results were measured on."""
+    import sqlalchemy
+    try:
+        commit=subprocess.run(["git","rev-parse","HEAD"],cwd=ROOT,capture_output=True,text=True,check=True).stdout.strip()
+        dirty=bool(subprocess.run(["git","status","--porcelain","--untracked-files=no"],cwd=ROOT,capture_output=True,text=True).stdout.strip())
+    except (OSError,subprocess.CalledProcessError):
+        commit,dirty=None,None
+    return {
+        "commit":commit,
+        "uncommitted_changes":dirty,
+        "date":datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python":platform.python_version(),
+        "sqlalchemy":sqlalchemy.__version__,
+        "platform":platform.platform(),
+    }
+
+def compare(before_file:str, after_file:str):
+    """Print the median timings of two result files side by side."""
+    with open(before_file) as file:
+        before=json.load(file)
+    with open(after_file) as file:
+        after=json.load(file)
+    print(f"before: {before['environment']['commit']}  after: {after['environment']['commit']}")
+    earlier={(r["industries"],r["commodities"],r["classes"]):r for r in before["results"]}
+    for result in after["results"]:
+        size=(result["industries"],result["commodities"],result["classes"])
+        if size not in earlier:
+            continue
+        print(f"\n{'x'.join(str(n) for n in size)}")
+        print(f"{'':<18}{'before (ms)':>12}{'after (ms)':>12}{'ratio':>8}")
+        for name,timing in result["timings"].items():
+            old=earlier[size]["timings"].get(name)
+            if old is None:
+                continue
+            print(f"{name:<18}{1000*old['median']:>12.1f}{1000*timing['median']:>12.1f}{timing['median']/old['median']:>8.2f}")
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes",default="4x4x2,16x16x3,64x64x4",help="comma-separated sizes, each NxMxK")
+    parser.add_argument("--repeats",type=int,default=3)
+    parser.add_argument("--output",default="benchmark-results.json")
+    parser.add_argument("--compare",nargs=2,metavar=("BEFORE","AFTER"))
+    parser.add_argument("--worker",action="store_true",help=argparse.SUPPRESS)
+    args=parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.worker:
+        print(json.dumps(run_size(*parse_size(args.sizes),args.repeats)))
+        return
+    results=[]
+    for size in args.sizes.split(","):
+        result=run_in_process(size,args.repeats)
+        results.append(result)
+        print(f"{size:<12} clone {1000*result['timings']['clone']['median']:.1f} ms, period {1000*result['timings']['period']['median']:.1f} ms")
+    with open(args.output,"w") as file:
+        json.dump({"environment":describe_environment(),"repeats":args.repeats,"results":results},file,indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,311 @@
+"""Generate synthetic templates of any size.
+
+The templates in static/ have two or three industries and a handful of
+stocks, which says little about how the actions scale. generate_template
+builds a template with any number of industries, produced commodities and
+social classes, in the same form as the fixtures in static/, so that it
+can be written to a folder or loaded straight into the database.
+
+The economy it describes is consistent:
+
+    1. Every produced commodity is either a means of production or a
+       consumer good, and is produced by at least one industry.
+    2. Each industry uses labour power and up to three means of
+       production, in proportions chosen at random (reproducibly, from
+       'seed'). The means of production and the labour used for one unit
+       of output add up to one, so every produced commodity has a unit
+       value of one, and every industry makes a profit.
+    3. The output scales of the industries producing means of production
+       are set so that they produce exactly what all the industries use.
+    4. The working classes supply exactly the labour power the industries
+       need, and spend their wages on consumer goods. The capitalists, who
+       are always the first class, consume the rest, which is what their
+       profits will buy. So the template reproduces itself unchanged.
+    5. Every owner has exactly one Sales stock and one Money stock, with
+       enough money to buy what it needs for a period.
+
+Besides the commodities asked for, every template has Money, Labour
+Power and Capital Services, as the fixtures do.
+
+If there are more industries than produced commodities, the industries
+take turns at producing each commodity. Trade sells the whole demand for
+a commodity from its first seller (see buy_and_sell in actions/trade.py),
+so in such a template the other producers do not sell what they make,
+and run short of money.
+
+Usage (from the root of the project):
+
+    python -m benchmarks.synthetic --industries 50 --commodities 20 --classes 4 --output static/synthetic
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+from sqlalchemy.orm import Session
+from models.models import Class_stock, Commodity, Industry, Industry_stock, Simulation, SocialClass
+
+# The files of a template, in the order they must be loaded, with the model each holds
+template_files=[
+    ("simulations.json",Simulation),
+    ("classes.json",SocialClass),
+    ("commodities.json",Commodity),
+    ("industries.json",Industry),
+    ("class_stocks.json",Class_stock),
+    ("industry_stocks.json",Industry_stock),
+]
+
+# Names for the working classes. Further classes are numbered.
+class_names=["Workers","Professionals","Artisans","Peasants","Clerks","Servants"]
+
+LABOUR_VALUE=0.5  # the unit value of labour power, as in the fixtures
+
+def generate_template(
+        industries:int,
+        commodities:int,
+        classes:int,
+        simulation_id:int=1000,
+        first_id:int=100000,
+        seed:int=0,
+    )->dict:
+    """Build a synthetic template.
+
+        industries(int):
+            the number of industries; at least 'commodities'
+        commodities(int):
+            the number of produced commodities; at least 2. The first half
+            (rounded down) are means of production, the rest consumer goods
+        classes(int):
+            the number of social classes; at least 2. The first is the
+            capitalists, the rest are working classes
+        simulation_id(int):
+            the id of the template. Must not clash with another simulation
+        first_id(int):
+            the ids of the commodities, industries, classes and stocks are
+            numbered from here. Must not clash with the ids in static/
+        seed(int):
+            the seed of the random choices, so that a template can be
+            generated again exactly
+
+        returns(dict):
+            for each file in template_files, the list of rows it holds
+    """
+    if commodities<2:
+        raise ValueError("A template needs at least two produced commodities")
+    if industries<commodities:
+        raise ValueError("A template needs at least one industry for each produced commodity")
+    if classes<2:
+        raise ValueError("A template needs at least two classes")
+    rng=random.Random(seed)
+    next_id=itertools.count(first_id).__next__
+    means_of_production=max(1,commodities//2)
+
+    # The commodities, and which industry produces which
+    produced=[
+        {"name":f"Means of Production {k+1}","short_name":f"C{k+1}","usage":"PRODUCTIVE"} if k<means_of_production
+        else {"name":f"Consumer Good {k-means_of_production+1}","short_name":f"N{k-means_of_production+1}","usage":"CONSUMPTION"}
+        for k in range(commodities)
+    ]
+    for commodity in produced:
+        commodity.update(id=next_id(),origin="INDUSTRIAL",unit_value=1.0)
+    money={"name":"Money","short_name":"M","usage":"MONEY","origin":"MONEY","id":next_id(),"unit_value":1.0}
+    labour={"name":"Labour Power","short_name":"L","usage":"PRODUCTIVE","origin":"SOCIAL","id":next_id(),"unit_value":LABOUR_VALUE}
+    services={"name":"Capital Services","short_name":"K","usage":"Useless","origin":"SOCIAL","id":next_id(),"unit_value":1.0}
+    output=[j%commodities for j in range(industries)]
+    producers=[[j for j in range(industries) if output[j]==k] for k in range(commodities)]
+
+    # The technology: requirement[j] maps means of production k to the amount used per unit of output of j
+    requirement=[]
+    labour_requirement=[]
+    for j in range(industries):
+        used=rng.sample(range(means_of_production),min(3,means_of_production))
+        weights=[rng.random()+0.1 for _ in used]
+        share=rng.uniform(0.3,0.5)
+        requirement.append({k:share*w/sum(weights) for k,w in zip(used,weights)})
+        labour_requirement.append(1-share)
+
+    # The scales: consumer goods industries are chosen; the rest produce what is used
+    scale=[rng.uniform(500,1500) if output[j]>=means_of_production else 0.0 for j in range(industries)]
+    for _ in range(1000):
+        used=[sum(requirement[j].get(k,0.0)*scale[j] for j in range(industries)) for k in range(means_of_production)]
+        change=0.0
+        for k in range(means_of_production):
+            for j in producers[k]:
+                change=max(change,abs(scale[j]-used[k]/len(producers[k])))
+                scale[j]=used[k]/len(producers[k])
+        if change<1e-9:
+            break
+    supply=[sum(scale[j] for j in producers[k]) for k in range(commodities)]
+    labour_demand=sum(l*s for l,s in zip(labour_requirement,scale))
+
+    # The classes: the capitalists, and working classes who share the labour
+    shares=[rng.random()+0.5 for _ in range(classes-1)]
+    populations=[labour_demand/2]+[labour_demand*s/sum(shares) for s in shares]
+    wage_share=labour_demand*LABOUR_VALUE/sum(supply[means_of_production:])  # of each consumer good
+    names=["Capitalists"]+[class_names[i] if i<len(class_names) else f"Class {i+2}" for i in range(classes-1)]
+
+    rows={name:[] for name,_ in template_files}
+    rows["simulations.json"].append({
+        "id":simulation_id,
+        "name":f"Synthetic economy ({industries} industries, {commodities} commodities, {classes} classes)",
+        "time_stamp":0,
+        "username":"admin",
+        "state":"TEMPLATE",
+        "periods_per_year":1,
+        "population_growth_rate":1,
+        "investment_ratio":1,
+        "labour_supply_response":"UNDEFINED",
+        "price_response_type":"UNDEFINED",
+        "melt_response_type":None,
+        "setPriceMode":"Locked",
+        "currency_symbol":"$",
+        "quantity_symbol":"#",
+        "total_value":0,
+        "total_price":0,
+        "melt":1,
+        "investment_algorithm":"Standard",
+    })
+
+    def stock(owner:dict, owner_key:str, commodity:dict, usage_type:str, size:float, requirement:float=0.0)->dict:
+        id=next_id()
+        value=size*commodity["unit_value"]
+        return {
+            "id":id,
+            owner_key:owner["id"],
+            "simulation_id":simulation_id,
+            "commodity_id":commodity["id"],
+            "usage_type":usage_type,
+            "size":size,
+            "value":value,
+            "price":value,
+            "demand":0,
+            "requirement":requirement,
+            "name":f"{owner['name']}.{usage_type}.{commodity['name']}.(id_{id})(sim_{simulation_id})",
+        }
+
+    money_supply=0.0
+
+    for i,name in enumerate(names):
+        social_class={
+            "id":next_id(),
+            "simulation_id":simulation_id,
+            "name":name,
+            "image_name":"",
+            "population":populations[i],
+            "consumption_ratio":1.0 if i==0 else 0.5,
+            "revenue":0.0,
+            "assets":0.0,
+        }
+        rows["classes.json"].append(social_class)
+        spending=0.0
+        for k in range(means_of_production,commodities):
+            if i==0:
+                per_head=supply[k]*(1-wage_share)/populations[0]
+            else:
+                per_head=supply[k]*wage_share/labour_demand
+            spending+=per_head*populations[i]
+            rows["class_stocks.json"].append(stock(social_class,"class_id",produced[k],"Consumption",0,per_head))
+        rows["class_stocks.json"].append(stock(social_class,"class_id",money,"Money",spending))
+        if i==0:
+            rows["class_stocks.json"].append(stock(social_class,"class_id",services,"Sales",0))
+        else:
+            rows["class_stocks.json"].append(stock(social_class,"class_id",labour,"Sales",populations[i]))
+        money_supply+=spending
+
+    for j in range(industries):
+        commodity=produced[output[j]]
+        industry={
+            "id":next_id(),
+            "name":f"Industry {j+1}",
+            "short_name":f"I{j+1}",
+            "image_name":"",
+            "simulation_id":simulation_id,
+            "output_scale":scale[j],
+            "output_growth_rate":0,
+            "initial_capital":0.0,
+            "work_in_progress":0.0,
+            "current_capital":0.0,
+            "profit":0.0,
+            "profit_rate":0.0,
+        }
+        rows["industries.json"].append(industry)
+        cost=scale[j]*(sum(requirement[j].values())+labour_requirement[j]*LABOUR_VALUE)
+        stocks=[
+            stock(industry,"industry_id",money,"Money",1.5*cost),
+            stock(industry,"industry_id",labour,"Production",0,labour_requirement[j]),
+        ]+[
+            stock(industry,"industry_id",produced[k],"Production",0,amount) for k,amount in sorted(requirement[j].items())
+        ]+[
+            stock(industry,"industry_id",commodity,"Sales",scale[j]),
+        ]
+        for row,origin in zip(stocks,["MONEY","SOCIAL"]+["INDUSTRIAL"]*(len(stocks)-2)):
+            row["origin"]=origin
+        rows["industry_stocks.json"]+=stocks
+        money_supply+=1.5*cost
+
+    sizes={
+        **{c["id"]:supply[k] for k,c in enumerate(produced)},
+        money["id"]:money_supply,
+        labour["id"]:labour_demand,
+        services["id"]:0.0,
+    }
+    for order,commodity in enumerate(produced+[labour,money,services]):
+        size=sizes[commodity["id"]]
+        value=size*commodity["unit_value"]
+        rows["commodities.json"].append({
+            "id":commodity["id"],
+            "simulation_id":simulation_id,
+            "name":commodity["name"],
+            "short_name":commodity["short_name"],
+            "image_name":"",
+            "origin":commodity["origin"],
+            "usage":commodity["usage"],
+            "size":size,
+            "total_value":value,
+            "total_price":value,
+            "unit_value":commodity["unit_value"],
+            "unit_price":commodity["unit_value"],
+            "turnover_time":360.0 if commodity is services else 0.0 if commodity is money else 1.0,
+            "demand":0.0,
+            "supply":0.0 if commodity is money else size,
+            "allocation_ratio":1.0 if commodity["origin"]=="INDUSTRIAL" else 0.0,
+            "display_order":order+1,
+            "tooltip":commodity["name"],
+            "monetarily_effective_demand":0.0,
+            "investment_proportion":0.0,
+        })
+    return rows
+
+def write_template(template:dict, directory:str):
+    """Write a template to 'directory' as fixture files, in the form of static/1."""
+    os.makedirs(directory,exist_ok=True)
+    for name,_ in template_files:
+        with open(os.path.join(directory,name),"w") as file:
+            json.dump(template[name],file,indent=2)
+
+def load_template(session:Session, template:dict):
+    """Add a template to the database, and initialise it, as the fixture
+    loader would (see actions/reload.py). Does not commit."""
+    from actions.reload import initialise_template  # not needed to generate or write a template
+    for name,model in template_files:
+        session.add_all([model(**row) for row in template[name]])
+        session.flush()
+    initialise_template(session,template["simulations.json"][0]["id"])
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--industries",type=int,default=10)
+    parser.add_argument("--commodities",type=int,default=4)
+    parser.add_argument("--classes",type=int,default=2)
+    parser.add_argument("--simulation-id",type=int,default=1000)
+    parser.add_argument("--first-id",type=int,default=100000)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--output",required=True,help="the folder to write the fixture files to")
+    args=parser.parse_args()
+    template=generate_template(args.industries,args.commodities,args.classes,args.simulation_id,args.first_id,args.seed)
+    write_template(template,args.output)
+    print(f"Wrote {sum(len(rows) for rows in template.values())} rows to {args.output}")
+
+if __name__=="__main__":
+    main()
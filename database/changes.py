@@ -0,0 +1,222 @@
+"""Push the changes made to a simulation to the clients watching it.
+
+A client watches a simulation by opening /simulations/changes/{id}, a
+stream of server-sent events. Each time a transaction which changed the
+simulation is committed (normally, once for each action), the client
+receives one 'changes' event, whose data is a delta in JSON:
+
+    {
+        "simulation_id": 7,
+        "simulations": {"7": {"state": "SUPPLY"}},
+        "commodities": {"12": {"demand": 2000.0}, ...},
+        "industries": {...},
+        "social_classes": {...},
+        "industry_stocks": {"31": {"size": 1500.0, "value": 1500.0}, ...},
+        "class_stocks": {...},
+        "trace": [{"level": 2, "time_stamp": 0, "message": "  ...", "event": ...}, ...]
+    }
+
+Only the columns which changed are sent, keyed by table and then by id,
+with the new trace entries in the form of /trace/. A client which falls
+too far behind receives a 'resync' event instead, and should fetch the
+lists again.
+
+The changes are captured from the session as it flushes, and published
+when it commits; a rollback discards them. Nothing is captured for a
+simulation nobody is watching. Changes made with a bulk UPDATE do not
+pass through the flush, so the code which makes them reports them with
+record(). Subscriptions belong to one process, so, as with in-memory
+simulations, this is for a single-worker server.
+
+The same deltas describe what an action would do, when it is previewed
+(see routers/actions.py). The simulation is then watched by the session
+itself, for as long as the preview lasts, and collect() gives the delta
+before the action is rolled back.
+"""
+
+import asyncio
+import copy
+import threading
+import weakref
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models.models import Class_stock, Commodity, Industry, Industry_stock, Simulation, SocialClass
+from report.report import entry_names, render, trace_names
+
+# The models whose changes are sent, by table name
+watched_models={model.__tablename__:model for model in (Simulation, Commodity, Industry, SocialClass, Industry_stock, Class_stock)}
+
+# Columns which are bookkeeping, not state, and are not sent
+ignored_columns={"dirty","successor_id"}
+
+class Subscriber:
+    """One client watching one simulation. Deltas are queued in the event
+    loop which serves the client, so they may be published from any thread."""
+    def __init__(self, simulation_id:int, limit:int=100):
+        self.simulation_id=simulation_id
+        self.loop=asyncio.get_running_loop()
+        self.queue=asyncio.Queue(maxsize=limit)
+        self.overflowed=False
+
+    def put(self, delta:dict):
+        """Called in the event loop of the subscriber."""
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            self.overflowed=True
+
+    def publish(self, delta:dict):
+        """Called from any thread."""
+        self.loop.call_soon_threadsafe(self.put,delta)
+
+# The subscribers to each simulation
+subscribers:dict[int,set[Subscriber]]={}
+_lock=threading.Lock()
+
+def subscribe(simulation_id:int)->Subscriber:
+    """Start watching a simulation. Must be called from the event loop
+    which will read the deltas."""
+    subscriber=Subscriber(simulation_id)
+    with _lock:
+        subscribers.setdefault(simulation_id,set()).add(subscriber)
+    return subscriber
+
+def unsubscribe(subscriber:Subscriber):
+    with _lock:
+        watchers=subscribers.get(subscriber.simulation_id)
+        if watchers is not None:
+            watchers.discard(subscriber)
+            if not watchers:
+                del subscribers[subscriber.simulation_id]
+
+def watched(session:Session, simulation_id:int)->bool:
+    """Whether the changes 'session' makes to the simulation are wanted:
+    because a client is watching it, or because it is being previewed."""
+    return simulation_id in subscribers or simulation_id in session.info.get("preview",())
+
+def record(session:Session, simulation_id:int, table:str, id:int, values:dict):
+    """Note that the row 'id' of 'table' now has 'values', if anyone is
+    watching the simulation."""
+    if session.info.get("replay"):
+        return  # a replay is not the simulation itself (see actions/journal.py)
+    if watched(session,simulation_id):
+        changes=session.info.setdefault("changes",{}).setdefault(simulation_id,{})
+        changes.setdefault(table,{}).setdefault(id,{}).update(values)
+
+@event.listens_for(Session, "after_flush")
+def capture_changes(session:Session, flush_context):
+    """Record the columns of the watched objects which this flush writes."""
+    if session.info.get("replay") or (not subscribers and not session.info.get("preview")):
+        return
+    for item in list(session.new)+list(session.dirty):
+        table=getattr(item,"__tablename__",None)
+        if table not in watched_models:
+            continue
+        simulation_id=item.id if table=="simulations" else item.simulation_id
+        if not watched(session,simulation_id):
+            continue
+        state=inspect(item)
+        values={}
+        for attribute in state.mapper.column_attrs:
+            if attribute.key in ignored_columns:
+                continue
+            history=state.attrs[attribute.key].history
+            if history.added:
+                values[attribute.key]=history.added[0]
+        if values:
+            record(session,simulation_id,table,item.id,values)
+
+@event.listens_for(Session, "before_commit")
+def capture_names(session:Session):
+    """Look up the names needed to render the trace entries which will be
+    sent, while the session can still query."""
+    if session.info.get("replay"):
+        return
+    simulation_ids={
+        entry.simulation_id for entry in session.info.get("pending_trace",[])+session.info.get("written_trace",[])
+        if entry.event is not None and entry.simulation_id in subscribers
+    }
+    if simulation_ids:
+        session.info["trace_names"]={simulation_id:trace_names(session,simulation_id) for simulation_id in simulation_ids}
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session:Session):
+    """Send each watched simulation the changes this transaction made to it."""
+    if session.info.get("replay"):
+        return
+    changes=session.info.pop("changes",{})
+    names=session.info.pop("trace_names",{})
+    trace={}
+    for entry in session.info.get("written_trace",[]):
+        if entry.simulation_id in subscribers:
+            trace.setdefault(entry.simulation_id,[]).append(trace_delta(entry,names.get(entry.simulation_id)))
+    for simulation_id in set(changes)|set(trace):
+        delta=make_delta(simulation_id,changes.get(simulation_id,{}),trace.get(simulation_id,[]))
+        with _lock:
+            watchers=list(subscribers.get(simulation_id,()))
+        for subscriber in watchers:
+            subscriber.publish(delta)
+
+# The changes captured by its session when each savepoint began
+savepoint_changes=weakref.WeakKeyDictionary()
+
+@event.listens_for(Session, "after_transaction_create")
+def mark_changes(session:Session, transaction):
+    """Keep a copy of the changes captured when a savepoint begins, so
+    that rolling the savepoint back discards only those made inside it."""
+    if transaction.nested and session.info.get("changes"):
+        savepoint_changes[transaction]=copy.deepcopy(session.info["changes"])
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session:Session):
+    session.info.pop("changes",None)
+    if session.in_nested_transaction():
+        kept=savepoint_changes.pop(session.get_nested_transaction(),None)
+        if kept is not None:
+            session.info["changes"]=kept
+        return
+    session.info.pop("trace_names",None)
+
+def collect(session:Session, simulation_id:int)->dict:
+    """The delta of everything the transaction of 'session' has done to
+    the simulation so far, while it is being previewed. Flushes first, so
+    that the delta is complete."""
+    session.flush()
+    names=trace_names(session,simulation_id)
+    trace=[
+        trace_delta(entry,names) for entry in session.info.get("written_trace",[])
+        if entry.simulation_id==simulation_id
+    ]
+    return make_delta(simulation_id,session.info.get("changes",{}).get(simulation_id,{}),trace)
+
+def make_delta(simulation_id:int, changed:dict, trace:list)->dict:
+    """A delta, from the changes to a simulation, by table and id, and
+    its new trace entries in the form of /trace/."""
+    delta={"simulation_id":simulation_id}
+    for table in watched_models:
+        delta[table]={str(id):values for id,values in changed.get(table,{}).items()}
+    delta["trace"]=trace
+    return delta
+
+def trace_delta(entry, names:dict|None)->dict:
+    """A trace entry in the form of /trace/, without its id (which is not
+    known, because entries are written in bulk). 'names' are those given
+    by trace_names."""
+    message=entry.message
+    if entry.event is not None and names is not None:
+        message=render(entry,entry_names(entry,names))
+    return {
+        "simulation_id":entry.simulation_id,
+        "time_stamp":entry.time_stamp,
+        "level":entry.level,
+        "message":None if message is None else " "*entry.level+message,
+        "event":entry.event,
+        "commodity_id":entry.commodity_id,
+        "industry_id":entry.industry_id,
+        "class_id":entry.class_id,
+        "stock_id":entry.stock_id,
+        "amount":entry.amount,
+        "size":entry.size,
+        "value":entry.value,
+        "price":entry.price,
+    }
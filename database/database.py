@@ -1,9 +1,59 @@
+"""The database engine and sessions.
+
+The database is chosen by SQLALCHEMY_DATABASE_URL (see authorization/config.py).
+Behaviour peculiar to one dialect is kept in a module of its own
+(database/sqlite.py, database/postgresql.py), and is applied here
+according to the dialect of the engine.
+"""
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from authorization.config import SQLALCHEMY_DATABASE_URL
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from authorization import config
+from database import postgresql, sqlite
+
+def database_url(url:str)->str:
+    """Normalise a database URL. Hosting services often give PostgreSQL
+    URLs the scheme 'postgres://', which SQLAlchemy no longer accepts."""
+    if url.startswith("postgres://"):
+        return "postgresql://"+url[len("postgres://"):]
+    return url
+
+def make_engine(url:str)->Engine:
+    """Create an engine for 'url', with the pool settings from the
+    configuration and whatever the dialect needs."""
+    url=make_url(database_url(url))
+    if url.get_backend_name()=="sqlite" and url.database in (None,"",":memory:"):
+        # One connection, shared by every thread, or each would see its own empty database
+        options=dict(poolclass=StaticPool,connect_args={"check_same_thread":False})
+    else:
+        options=dict(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_pre_ping=config.DB_POOL_PRE_PING,
+        )
+    new_engine=create_engine(url,**options)
+    if new_engine.dialect.name=="sqlite":
+        sqlite.apply_profile(new_engine)
+    return new_engine
 
-engine=create_engine(SQLALCHEMY_DATABASE_URL)
+def before_bulk_load(session:Session, models:list):
+    """Prepare to insert rows with primary keys chosen from the largest ids
+    now in the tables of 'models' (as a fork does). Call it before reading
+    those ids; it holds until the transaction ends."""
+    if session.get_bind().dialect.name=="postgresql":
+        postgresql.lock_tables(session, models)
+
+def after_bulk_load(session:Session, models:list):
+    """Tidy up after rows with explicit primary keys have been inserted into
+    the tables of 'models' (as the fixture loader does)."""
+    if session.get_bind().dialect.name=="postgresql":
+        postgresql.sync_sequences(session, models)
+
+engine=make_engine(config.SQLALCHEMY_DATABASE_URL)
 Base=declarative_base()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -14,4 +64,3 @@ def get_session():
         yield session
     finally:
         session.close()
-
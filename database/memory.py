@@ -0,0 +1,151 @@
+"""Simulations held entirely in memory.
+
+A simulation can be attached to an in-memory SQLite database of its own.
+From then on, every request concerning it (the actions, and the endpoints
+that report its commodities, industries, classes, stocks and trace) is
+served from that database instead of the main one, so running it costs no
+disk I/O at all. Nothing reaches the main database until the simulation
+is saved. If it is discarded instead, the main database still holds the
+simulation as it was when it was attached.
+
+The rows keep their ids, so the simulation can be saved back over itself
+and the user's current simulation does not change.
+
+The in-memory databases belong to the process that created them. With
+several workers, a request served by a worker which did not attach the
+simulation sees the copy in the main database. In-memory simulations are
+therefore meant for a single process: a development server, a batch
+script, or a benchmark.
+"""
+
+import threading
+from fastapi import Depends, Security
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session, sessionmaker
+from actions.clone import materialise_by_id
+from authorization.auth import get_api_key
+from database.database import Base, get_session, make_engine
+from models.models import JournalEntry, Simulation, User, role_columns, simulation_models
+from report.report import Trace
+
+class MemoryStore:
+    """An in-memory SQLite database holding one simulation.
+
+    Requests take the lock for as long as they use the store, because the
+    database has only the one connection.
+    """
+    def __init__(self, simulation_id:int):
+        self.simulation_id=simulation_id
+        self.engine=make_engine("sqlite://")
+        Base.metadata.create_all(bind=self.engine)
+        self.Session=sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.lock=threading.Lock()
+        self.trace_mark=0  # trace entries with higher ids were made in memory
+
+# The in-memory simulations of this process, keyed by simulation id
+stores:dict[int,MemoryStore]={}
+
+def copy_simulation(source:Session, target:Session, simulation_id:int):
+    """Copy one simulation from 'source' to 'target', keeping its ids and
+    replacing whatever 'target' holds of it. Uses one multi-row INSERT per
+    table. The role columns are filled in afterwards, because they refer to
+    stocks which are inserted after their owners. Does not commit.
+
+    The journal is copied whole, in order, with new ids, since deleting the
+    simulation deletes its journal too and journal ids are not kept.
+    """
+    journal=JournalEntry.__table__
+    target.execute(delete(journal).where(journal.c.simulation_id==simulation_id))
+    for model in reversed(simulation_models):
+        target.execute(delete(model.__table__).where(model.__table__.c.simulation_id==simulation_id))
+    target.execute(delete(Simulation.__table__).where(Simulation.__table__.c.id==simulation_id))
+
+    rows=source.execute(select(Simulation.__table__).where(Simulation.__table__.c.id==simulation_id)).mappings().all()
+    target.execute(insert(Simulation.__table__),[dict(row) for row in rows])
+    for model in simulation_models:
+        table=model.__table__
+        roles=role_columns.get(model,())
+        rows=source.execute(select(table).where(table.c.simulation_id==simulation_id)).mappings().all()
+        if rows:
+            target.execute(insert(table),[{**row,**{column:None for column in roles}} for row in rows])
+    for model,columns in role_columns.items():
+        table=model.__table__
+        rows=source.execute(
+            select(table.c.id,*[table.c[column] for column in columns]).where(table.c.simulation_id==simulation_id)
+        ).mappings().all()
+        if rows:
+            target.execute(update(model),[dict(row) for row in rows])
+    rows=source.execute(select(journal).where(journal.c.simulation_id==simulation_id).order_by(journal.c.id)).mappings().all()
+    if rows:
+        target.execute(insert(journal),[{k:v for k,v in row.items() if k!="id"} for row in rows])
+
+def attach(session:Session, simulation_id:int)->MemoryStore:
+    """Copy a simulation, with its trace and journal, from the main database into a new
+    in-memory store, materialising it first if it is a clone which has not
+    been. If it is already in memory, return the existing store."""
+    if simulation_id in stores:
+        return stores[simulation_id]
+    materialise_by_id(session,simulation_id)
+    store=MemoryStore(simulation_id)
+    memory_session=store.Session()
+    try:
+        copy_simulation(session,memory_session,simulation_id)
+        rows=session.execute(select(Trace.__table__).where(Trace.__table__.c.simulation_id==simulation_id)).mappings().all()
+        if rows:
+            memory_session.execute(insert(Trace.__table__),[dict(row) for row in rows])
+            store.trace_mark=max(row["id"] for row in rows)
+        memory_session.commit()
+    finally:
+        memory_session.close()
+    stores[simulation_id]=store
+    return store
+
+def save(session:Session, simulation_id:int):
+    """Write an in-memory simulation back to the main database, with its
+    journal and the trace entries made since it was attached or last
+    saved, and commit. The simulation stays in memory."""
+    store=stores[simulation_id]
+    with store.lock:
+        memory_session=store.Session()
+        try:
+            copy_simulation(memory_session,session,simulation_id)
+            rows=memory_session.execute(
+                select(Trace.__table__).where(
+                    Trace.__table__.c.simulation_id==simulation_id,
+                    Trace.__table__.c.id>store.trace_mark,
+                ).order_by(Trace.__table__.c.id)
+            ).mappings().all()
+            if rows:
+                session.execute(insert(Trace.__table__),[{k:v for k,v in row.items() if k!="id"} for row in rows])
+            session.commit()
+            if rows:
+                store.trace_mark=rows[-1]["id"]  # so that saving again does not add them twice
+        finally:
+            memory_session.close()
+
+def discard(simulation_id:int):
+    """Forget an in-memory simulation. Anything not saved is lost."""
+    store=stores.pop(simulation_id,None)
+    if store is not None:
+        with store.lock:
+            store.engine.dispose()
+
+def get_simulation_session(
+    u:User=Security(get_api_key),
+    session:Session=Depends(get_session),
+):
+    """A dependency which supplies a session holding the current simulation
+    of the user: the in-memory session if it has been attached, otherwise
+    the session on the main database. A clone which has not been
+    materialised is left as it is: the endpoints that change it materialise
+    it, and those that read it read its template (see actions/clone.py)."""
+    store=stores.get(u.current_simulation_id)
+    if store is None:
+        yield session
+        return
+    with store.lock:
+        memory_session=store.Session()
+        try:
+            yield memory_session
+        finally:
+            memory_session.close()
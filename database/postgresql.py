@@ -0,0 +1,34 @@
+"""Behaviour peculiar to PostgreSQL.
+
+PostgreSQL draws primary keys from a sequence for each table. Rows inserted
+with explicit ids, as the fixtures are, do not advance the sequence, so
+the next row created in the ordinary way would be given an id that is
+already taken. sync_sequences() moves each sequence past the largest id
+in its table.
+
+A copy which chooses its own ids from the largest id in each table (see
+actions/clone.py fork_simulation) must also stop anyone else inserting
+rows until the sequences have been moved and it has committed, or two
+copies could choose the same ids, or an ordinary insert could be given
+one of them by the sequence. lock_tables() does this.
+"""
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+def lock_tables(session:Session, models:list):
+    """Lock the table of each model in 'models', in the order given, against
+    writes by other transactions until this one ends. Reads are not blocked."""
+    for model in models:
+        session.execute(text(f"LOCK TABLE {model.__tablename__} IN EXCLUSIVE MODE"))
+
+def sync_sequences(session:Session, models:list):
+    """Set the id sequence of the table of each model in 'models' to the
+    largest id in that table."""
+    session.flush()
+    for model in models:
+        table=model.__tablename__
+        session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}','id'),"
+            f" COALESCE((SELECT MAX(id) FROM {table}),0)+1, false)"
+        ))
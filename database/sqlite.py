@@ -0,0 +1,50 @@
+"""The performance profile for SQLite databases.
+
+By default SQLite uses a rollback journal, syncs to disk on every commit,
+does no memory-mapped I/O, fails at once with 'database is locked' if
+another connection is writing, and ignores foreign keys (so that the
+ondelete="CASCADE" declarations in the models have no effect).
+
+apply_profile() fixes all of these on every new connection:
+
+    journal_mode=WAL      readers do not block the writer, nor it them
+    synchronous=NORMAL    in WAL mode, sync only at checkpoints
+    mmap_size             read the database through memory-mapped I/O
+    cache_size            a larger page cache
+    temp_store=MEMORY     temporary tables and indexes in memory
+    busy_timeout          wait for a lock instead of failing
+    foreign_keys=ON       enforce foreign keys, including cascades
+
+The values come from authorization/config.py, and can be changed from
+config.cfg or the environment.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from authorization import config
+
+def profile_pragmas()->list[str]:
+    """The pragmas that make up the profile, in the order they are applied."""
+    return [
+        f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}",
+        f"PRAGMA temp_store={config.SQLITE_TEMP_STORE}",
+        f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}",
+        f"PRAGMA foreign_keys={config.SQLITE_FOREIGN_KEYS}",
+    ]
+
+def apply_profile(engine:Engine):
+    """Apply the profile to every connection that 'engine' opens.
+    Does nothing if the profile has been turned off in the configuration."""
+    if config.SQLITE_PROFILE.lower()=="off":
+        return
+    pragmas=profile_pragmas()
+
+    @event.listens_for(engine,"connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor=dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
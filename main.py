@@ -1,6 +1,8 @@
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from database.database import Base, engine
+from report.metrics import install as install_metrics
+from report.querywatch import install as install_query_watch
 
 from routers import (
     actions,
@@ -12,10 +14,14 @@ from routers import (
     socialClass,
     stocks,
     trace,
-    templates
+    templates,
+    memory,
+    metrics
 )
 
 app=FastAPI()
+install_metrics(app)
+install_query_watch(app)
 
 users = []
 
@@ -35,6 +41,8 @@ app.include_router(simulation.router)
 app.include_router(stocks.router)
 app.include_router(templates.router)
 app.include_router(trace.router)
+app.include_router(memory.router)
+app.include_router(metrics.router)
 
 # app.include_router(tests.router)
 
@@ -0,0 +1,60 @@
+"""A cache for quantities that are derived from the state of a simulation,
+such as the flow per period of a stock or the unit cost of an industry.
+
+These are calculated from inputs (output_scale, requirement,
+periods_per_year, unit_price and the like) which do not change while an
+action is under way, yet the actions ask for them many times over. A
+method decorated with @memoised is calculated once for each object and
+thereafter served from the cache.
+
+The cache lives in session.info, so it never outlives the session. It
+is emptied at the start of every action (see routers/actions.py), on
+rollback, and whenever one of the inputs registered with invalidate_on()
+is changed.
+"""
+
+import functools
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+cache_key="memo"
+
+def memoised(method):
+    """Decorate a method with signature method(self, session) so that its
+    result is cached in the session, keyed by the method and the object's
+    class and primary key."""
+    @functools.wraps(method)
+    def wrapper(self, session:Session):
+        if session is None or self.id is None:
+            return method(self, session)
+        cache=session.info.setdefault(cache_key,{})
+        key=(method.__qualname__,self.id)
+        if key not in cache:
+            cache[key]=method(self, session)
+        return cache[key]
+    return wrapper
+
+def clear_memo(session:Session):
+    """Forget every cached quantity held by this session."""
+    session.info.pop(cache_key,None)
+
+@event.listens_for(Session, "after_rollback")
+def clear_memo_on_rollback(session:Session):
+    """Quantities calculated from changes that have been rolled back are stale."""
+    clear_memo(session)
+
+def invalidate_on(*attributes):
+    """Empty the cache whenever any of the given mapped attributes is set.
+
+    Any cached quantity may depend on the attribute, so the whole cache is
+    dropped rather than just the entries of the object concerned. These
+    attributes change rarely in the course of an action, so this costs little.
+    """
+    for attribute in attributes:
+        @event.listens_for(attribute,"set")
+        def receive_set(target, value, oldvalue, initiator):
+            if value==oldvalue:
+                return
+            session=object_session(target)
+            if session is not None:
+                clear_memo(session)
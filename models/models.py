@@ -5,11 +5,11 @@ model which is in report.report.py
 
 import typing
 from fastapi import HTTPException
-from sqlalchemy import Column, ForeignKey, Integer, String, Float, Boolean
+from sqlalchemy import JSON, Column, ForeignKey, Integer, String, Float, Boolean
 from sqlalchemy.orm import relationship, Session
 from database.database import Base
 from report.report import report
-from sqlalchemy.orm.exc import NoResultFound
+from models.memo import invalidate_on, memoised
 
 
 Industry_stock = typing.NewType("Industry_stock", None)
@@ -51,6 +51,14 @@ class Simulation(Base):
     currency_symbol = Column(String)
     quantity_symbol = Column(String)
     investment_algorithm = Column(String)
+    template_id = Column(Integer, nullable=True)  # the template this simulation was cloned from
+    materialised = Column(Boolean, nullable=True)  # False for a clone whose rows have not yet been copied (see actions/clone.py)
+
+    commodities = relationship("Commodity", back_populates="simulation", passive_deletes=True)
+    industries = relationship("Industry", back_populates="simulation", passive_deletes=True)
+    social_classes = relationship("SocialClass", back_populates="simulation", passive_deletes=True)
+    industry_stocks = relationship("Industry_stock", back_populates="simulation", passive_deletes=True)
+    class_stocks = relationship("Class_stock", back_populates="simulation", passive_deletes=True)
 
     def set_state(self,state:str,session:Session):
         """Helper function sets the state of a simulation. Does not test 
@@ -61,7 +69,7 @@ class Simulation(Base):
 
         session.add(self)
         self.state = state
-        session.commit()
+        session.flush()
 
 class User(Base):
     """
@@ -132,8 +140,11 @@ class Commodity(Base):
     monetarily_effective_demand = Column(Float)
     investment_proportion = Column(Float)
     successor_id = Column(Integer, nullable=True)  # Helper column to use when cloning
+    dirty = Column(Boolean, default=True)  # changed since last revalued; see actions/dirty.py
 
-    simulation_name = relationship("Simulation")
+    simulation = relationship("Simulation", back_populates="commodities")
+    industry_stocks = relationship("Industry_stock", back_populates="commodity", passive_deletes=True)
+    class_stocks = relationship("Class_stock", back_populates="commodity", passive_deletes=True)
 
     def revalue_stocks(self,session:Session,simulation:Simulation):
         """
@@ -144,7 +155,7 @@ class Commodity(Base):
         session.add(self)
         
         # Reset the values of all industry stocks
-        istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==self.id)
+        istocks=self.industry_stocks
         for si in istocks:
             report(2,simulation.id,f"Reset value (currently {si.value}) with size {si.size} of industrial stock {si.name}",session)
             session.add(si)
@@ -152,13 +163,13 @@ class Commodity(Base):
             report(2,simulation.id,f"Its value is now {si.value}",session)
 
         # Reset the values of all class stocks
-        cstocks=session.query(Class_stock).where(Class_stock.commodity_id==self.id)
+        cstocks=self.class_stocks
         for sc in cstocks:
-            report(2,simulation.id,f"Reset value (currently {si.value}) with size {sc.size} of class stock {sc.name}",session)
+            report(2,simulation.id,f"Reset value (currently {sc.value}) with size {sc.size} of class stock {sc.name}",session)
             session.add(sc)
-            sc.value=si.size*self.unit_value
+            sc.value=sc.size*self.unit_value
             report(2,simulation.id,f"Its value is now {sc.value}",session)
-        session.commit()
+        session.flush()
 
     def reprice_stocks(self,session:Session,simulation:Simulation):
         """
@@ -168,7 +179,7 @@ class Commodity(Base):
         report(1,simulation.id,f"Resetting the price of all stocks of the commodity {self.name}",session)
         session.add(self)
         # Calculate the prices of all industry stocks
-        istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==id)
+        istocks=self.industry_stocks
         for si in istocks:
             report(2,simulation.id,f"Reset price (currently {si.price}) with size {si.size} of industrial stock {si.name}",session)
             session.add(si)
@@ -176,13 +187,13 @@ class Commodity(Base):
             report(2,simulation.id,f"Its price is now {si.value}",session)
 
         # Calculate the contribution of all class stocks
-        cstocks=session.query(Class_stock).where(Class_stock.commodity_id==id)
+        cstocks=self.class_stocks
         for sc in cstocks:
             report(2,simulation.id,f"Reset price (currently {si.value}) with size {sc.size} of class stock {sc.name}",session)
             session.add(sc)
             sc.price=si.size*self.unit_price
             report(2,simulation.id,f"Its price is now {sc.value}",session)
-        session.commit()
+        session.flush()
 
     def resize(self,session:Session,simulation:Simulation):
         """
@@ -194,17 +205,17 @@ class Commodity(Base):
         self.size=0
 
         # Add the sizes of all industry stocks of this commodity
-        istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==id)
+        istocks=self.industry_stocks
         for si in istocks:
             self.size+=si.size
             report(2,simulation.id,f"Adding {si.size} to total {self.size}, from industrial stock {si.name}",session)
 
         # Add the sizes of all class stocks of this commodity
-        cstocks=session.query(Class_stock).where(Class_stock.commodity_id==id)
+        cstocks=self.class_stocks
         for sc in cstocks:
-            self.size+=si.size
+            self.size+=sc.size
             report(2,simulation.id,f"Adding {sc.size} to make new total {self.size}, from class stock {sc.name}",session)
-        session.commit()
+        session.flush()
 
     def revalue(self, session:Session,simulation:Simulation):
         """
@@ -215,14 +226,14 @@ class Commodity(Base):
         total_value:float=0
 
         # Add the values of all industry stocks of this commodity
-        istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==self.id)
+        istocks=self.industry_stocks
         
         for si in istocks:
             total_value+=si.value
             report(2,simulation.id,f"Adding {si.value} to total value {total_value}, from industrial stock {si.name}",session)
 
         # Add the values of all class stocks of this commodity
-        cstocks=session.query(Class_stock).where(Class_stock.commodity_id==self.id)
+        cstocks=self.class_stocks
         for sc in cstocks:
             total_value+=sc.value
             report(2,simulation.id,f"Adding {sc.value} to total value {total_value}, from class stock {sc.name}",session)
@@ -239,7 +250,7 @@ class Commodity(Base):
             if self.unit_value!=new_unit_value:
                 report(2,simulation.id,f"Unit value has changed from {self.unit_value} to {new_unit_value}",session)
                 self.unit_value=new_unit_value
-        session.commit()
+        session.flush()
 
     def reprice(self,session:Session,simulation:Simulation):
         """
@@ -251,13 +262,13 @@ class Commodity(Base):
         total_price=0
 
         # Add the prices of all industry stocks of this commodity
-        istocks=session.query(Industry_stock).where(Industry_stock.commodity_id==id)
+        istocks=self.industry_stocks
         for si in istocks:
             total_price+=si.price
             report(2,simulation.id,f"Adding {si.price} to total {total_price}, from industrial stock {si.name}",session)
 
         # Add the sizes of all class stocks of this commodity
-        cstocks=session.query(Class_stock).where(Class_stock.commodity_id==id)
+        cstocks=self.class_stocks
         for sc in cstocks:
             self.total_price+=si.price
             report(2,simulation.id,f"Adding {sc.value} to make new total {total_price}, from class stock {sc.name}",session)
@@ -271,7 +282,7 @@ class Commodity(Base):
             report(2,simulation.id,f"Unit Price will be changed from {self.unit_price} to {new_unit_price}",session)
             self.unit_price=new_unit_price
 
-        session.commit()
+        session.flush()
 
 class Industry(Base):
     """Each Industry is a basic productive unit.
@@ -310,6 +321,16 @@ class Industry(Base):
     period.
 
     This is provided by the method 'self.unit_cost'.
+
+    The Sales, Money and (if there is only one) Means of Production stocks
+    are recorded in sales_stock_id, money_stock_id and mp_stock_id when
+    the simulation is cloned (see actions/reload.py). Industries loaded
+    straight from the fixtures do not have them, and the methods which
+    return these stocks fall back to searching for them.
+
+    The stocks of an industry are available as Industry.stocks. Queries
+    which visit every stock of many industries should load them eagerly,
+    with selectinload(Industry.stocks), to avoid a query per industry.
     """
 
     __tablename__ = "industries"
@@ -328,15 +349,22 @@ class Industry(Base):
     profit = Column(Float)
     profit_rate = Column(Float)
     successor_id = Column(Integer, nullable=True)  # Helper column to use when cloning
+    sales_stock_id = Column(Integer, ForeignKey("industry_stocks.id", ondelete="SET NULL", use_alter=True, name="fk_industry_sales_stock"), nullable=True)
+    money_stock_id = Column(Integer, ForeignKey("industry_stocks.id", ondelete="SET NULL", use_alter=True, name="fk_industry_money_stock"), nullable=True)
+    mp_stock_id = Column(Integer, ForeignKey("industry_stocks.id", ondelete="SET NULL", use_alter=True, name="fk_industry_mp_stock"), nullable=True)
+
+    simulation = relationship("Simulation", back_populates="industries")
+    stocks = relationship("Industry_stock", back_populates="industry", foreign_keys="Industry_stock.industry_id", order_by="Industry_stock.id")
 
+    def productive_stocks(self)->list[Industry_stock]:
+        """The stocks of this industry that are used up in production."""
+        return [stock for stock in self.stocks if stock.usage_type=="Production"]
+
+    @memoised
     def unit_cost(self, session: Session)->float:
         """Calculate the cost of producing a single unit of output."""
         cost = 0
-        for stock in (
-            session.query(Industry_stock)
-            .where(Industry_stock.industry_id == self.id)
-            .where(Industry_stock.usage_type == "Production")
-        ):
+        for stock in self.productive_stocks():
             # TODO resolve circular import problem with 'report'
             # report(3,self.simulation_id(),
             #     f"Stock called [{stock.name}] is adding {stock.unit_cost(session)} to its industry's unit cost",session
@@ -344,14 +372,10 @@ class Industry(Base):
             cost += stock.unit_cost(session)
         return cost
 
-    def simulation(self, db: Session)->Simulation:
-        """
-        Helper method yields the (unique) Simulation this industry belongs to.
-        """
-        return db.get_one(Simulation, self.simulation_id)
-
     def sales_stock(self, db: Session)->Industry_stock:
         """Helper method yields the Sales Stock of this industry."""
+        if self.sales_stock_id is not None:
+            return db.get(Industry_stock, self.sales_stock_id)
         result = get_industry_sales_stock(self, db)  # workaround because pydantic won't easily accept this query in a built-in function
         if result == None:
             raise Exception(
@@ -361,6 +385,8 @@ class Industry(Base):
 
     def money_stock(self, db)->Industry_stock:
         """Helper method yields the Money Stock of this industry."""
+        if self.money_stock_id is not None:
+            return db.get(Industry_stock, self.money_stock_id)
         return get_industry_money_stock(self, db)  # workaround because pydantic won't easily accept this query in a built-in function
 
     def get_capitalist_help(self, shortfall, session:Session)->float:
@@ -377,12 +403,12 @@ class Industry(Base):
         session.add(money_stock)
         money_stock.change_size(shortfall,session)
         print ("Money was donated")
-        session.commit()
+        session.flush()
         return shortfall
 
     def output_commodity(self, db)->Commodity:
         sales_stock:Industry_stock=self.sales_stock(db)
-        sales_commodity:Commodity =sales_stock.commodity(db)
+        sales_commodity:Commodity =sales_stock.commodity
         return sales_commodity
     
     def mp_stock(self,session:Session)->Session.query:
@@ -390,23 +416,17 @@ class Industry(Base):
         Returns all stocks of this industry which form inputs to production, including Labour Power
         This will fail if there is more than one means of input
         """
-        stocks=session.query(Industry_stock).where(
-            Industry_stock.industry_id==self.id,
-            Industry_stock.usage_type=="Production"
-        )
-        for stock in stocks:
-            input_commodity:Commodity=stock.commodity(session)
+        if self.mp_stock_id is not None:
+            return session.get(Industry_stock, self.mp_stock_id)
+        for stock in self.productive_stocks():
+            input_commodity:Commodity=stock.commodity
             if input_commodity.origin=="INDUSTRIAL":
                 return stock
         return None
 
     def labour_power_stock(self,session:Session)->Session.query:
-        stocks=session.query(Industry_stock).where(
-            Industry_stock.industry_id==self.id,
-            Industry_stock.usage_type=="Productive"
-        )
-        for stock in stocks:
-            input_commodity:Commodity=stock.commodity(session).first()
+        for stock in self.productive_stocks():
+            input_commodity:Commodity=stock.commodity
             if input_commodity.origin=="SOCIAL":
                 return stock
         return None
@@ -425,16 +445,22 @@ class SocialClass(Base):
     revenue = Column(Float)
     assets = Column(Float)
     successor_id = Column(Integer, nullable=True)  # Helper column to use when cloning
+    sales_stock_id = Column(Integer, ForeignKey("class_stocks.id", ondelete="SET NULL", use_alter=True, name="fk_class_sales_stock"), nullable=True)
+    money_stock_id = Column(Integer, ForeignKey("class_stocks.id", ondelete="SET NULL", use_alter=True, name="fk_class_money_stock"), nullable=True)
 
-    def simulation(self, session)->Simulation:
-        return session.get_one(Simulation, self.simulation_id)
+    simulation = relationship("Simulation", back_populates="social_classes")
+    stocks = relationship("Class_stock", back_populates="social_class", foreign_keys="Class_stock.class_id", order_by="Class_stock.id")
 
     def sales_stock(self, session):
         """Helper method yields the Sales Class_stock of this class."""
+        if self.sales_stock_id is not None:
+            return session.get(Class_stock, self.sales_stock_id)
         return get_class_sales_stock(self, session)
 
     def money_stock(self, session):
         """Helper method yields the Money Class_stock of this class."""
+        if self.money_stock_id is not None:
+            return session.get(Class_stock, self.money_stock_id)
         return get_class_money_stock(self, session)
     
     def consumption_stocks(self,session):
@@ -482,20 +508,27 @@ class Industry_stock(Base):
     price = Column(Float)
     requirement = Column(Float)
     demand = Column(Float)
+    dirty = Column(Boolean, default=True)  # changed since last revalued; see actions/dirty.py
+
+    industry = relationship("Industry", back_populates="stocks", foreign_keys=[industry_id])
+    commodity = relationship("Commodity", back_populates="industry_stocks")
+    simulation = relationship("Simulation", back_populates="industry_stocks")
 
+    @memoised
     def annual_flow_rate(self, session: Session) -> float:
         """The annual rate at which this Stock is consumed.
         Returns zero for Money and Sales Stocks.
         """
         if self.usage_type == "Production":
-            industry = session.query(Industry).where(Industry.id == self.industry_id).first()
-            return round(industry.output_scale * self.requirement,4)
+            return round(self.industry.output_scale * self.requirement,4)
         else:
             return 0.0
 
+    @memoised
     def flow_per_period(self, session: Session) -> float:
-        return round(self.annual_flow_rate(session) / self.simulation(session).periods_per_year,4)
+        return round(self.annual_flow_rate(session) / self.simulation.periods_per_year,4)
 
+    @memoised
     def standard_stock(self, session: Session) -> float:
         """The size of the normal stock which an industry must maintain in order to conduct
         production.
@@ -503,21 +536,11 @@ class Industry_stock(Base):
         Returns zero for non-productive Stocks.
         """
         if self.usage_type == "Production":
-            commodity = session.query(Commodity).where(Commodity.id == self.commodity_id).first()
-            return self.annual_flow_rate(session) * commodity.turnover_time
+            return self.annual_flow_rate(session) * self.commodity.turnover_time
         else:
             return 0.0
 
-    def industry(self, session: Session)->Industry:
-        """Returns the  Industry to which this stock belongs."""
-        return session.get_one(Industry, self.industry_id)
-
-    def commodity(self, session: Session)->Commodity:
-        return session.get_one(Commodity, self.commodity_id)
-
-    def simulation(self, session)->Simulation:
-        return session.get_one(Simulation, self.simulation_id)
-
+    @memoised
     def unit_cost(self, session: Session)->float:
         """Money price of using this Stock to make one unit of output
         in a period.
@@ -526,12 +549,8 @@ class Industry_stock(Base):
         nevertheless, caller should invoke this method only on productive
         Stocks.
         """
-        return self.requirement * self.commodity(session).unit_price
+        return self.requirement * self.commodity.unit_price
 
-    def owner(self, db:Session)->Industry: 
-        """Really just for diagnostic purposes """
-        return db.get_one(Industry, self.industry_id)
-    
     def change_size(self,amount:float,session:Session)->bool:
         """Change the size of this Industry_stock by 'amount'.
         
@@ -546,8 +565,9 @@ class Industry_stock(Base):
         unit values and prices.
         """
         self.size += amount
-        self.price=self.size*self.commodity(session).unit_value
-        self.value=self.size*self.commodity(session).unit_price
+        self.value=self.size*self.commodity.unit_value
+        self.price=self.size*self.commodity.unit_price
+        self.dirty=True
 
 class Class_stock(Base):
     """Stocks are produced, consumed, and traded in a
@@ -586,43 +606,27 @@ class Class_stock(Base):
     price = Column(Float)
     requirement = Column(Float)
     demand = Column(Float)
+    dirty = Column(Boolean, default=True)  # changed since last revalued; see actions/dirty.py
 
-    def social_class(self, db: Session)->SocialClass:
-        """Returns:
-               the Class which owns this Class_stock if it exists
-               none if it does not exist
-        TODO create graceful degradation code here and throughout, based on this paradigm (but done right)
-        """
-        try:
-            return db.get_one(SocialClass, self.class_id)
-        except NoResultFound as e:
-            print(f"ERROR: No social class with id {self.class_id} was found")
-            return None
-        except Exception as e:
-            print (f"ERROR: Unknown error searching for class with id {self.id}")
-
-
-    def commodity(self, db: Session)->Commodity:
-        """Returns the Commodity that this Class_stock consists of."""
-        return db.get_one(Commodity, self.commodity_id)
-
-    def simulation(self, session)->Simulation:
-        """Return the Simulation that this Class_stock is part of"""
-        return session.get_one(Simulation, self.simulation_id)
-    
+    social_class = relationship("SocialClass", back_populates="stocks", foreign_keys=[class_id])
+    commodity = relationship("Commodity", back_populates="class_stocks")
+    simulation = relationship("Simulation", back_populates="class_stocks")
+
+    @memoised
     def annual_flow_rate(self, db: Session) -> float:
         """The annual rate at which this Class_stock is consumed.
         Returns zero for Money and Sales Stocks.
         """
         if self.usage_type == "Consumption":
-            social_class:SocialClass = db.query(SocialClass).where(SocialClass.id == self.class_id).first()
-            return self.requirement*social_class.population
+            return self.requirement*self.social_class.population
         else:
             return 0.0
 
+    @memoised
     def flow_per_period(self, session: Session) -> float:
-        return self.annual_flow_rate(session) / self.simulation(session).periods_per_year
+        return self.annual_flow_rate(session) / self.simulation.periods_per_year
 
+    @memoised
     def standard_stock(self, session: Session) -> float:
         """The size of the normal stock which a class must maintain in order to 
         exist at its current population level.
@@ -635,14 +639,10 @@ class Class_stock(Base):
         whilst too little money has results which we wish to investigate.
         """
         if self.usage_type == "Consumption":
-            return self.annual_flow_rate(session) * self.commodity().turnover_time
+            return self.annual_flow_rate(session) * self.commodity.turnover_time
         else:
             return 0.0
 
-    def owner(self, session)->SocialClass: 
-        """Really just for diagnostic purposes """
-        return session.get_one(SocialClass, self.class_id)
-
     def change_size(self,amount:float,db:Session)->bool:
         """Change the size of this Class_stock by 'amount'.
         
@@ -657,8 +657,9 @@ class Class_stock(Base):
         unit values and prices.
         """
         self.size += amount
-        self.price=self.size*self.commodity(db).unit_value
-        self.value=self.size*self.commodity(db).unit_price
+        self.value=self.size*self.commodity.unit_value
+        self.price=self.size*self.commodity.unit_price
+        self.dirty=True
 
 class Buyer(Base):
     """The Buyer class is initialized when a simulation is created,
@@ -681,41 +682,43 @@ class Buyer(Base):
     money_stock_id = Column(Integer)
     commodity_id = Column(Integer)
 
-    def simulation(self, session)->Simulation:
-        """Returns the simulation to which this buyer belongs"""
-        return session.get_one(Simulation, self.simulation_id)
+    simulation = relationship("Simulation", primaryjoin="foreign(Buyer.simulation_id)==Simulation.id", viewonly=True)
+    commodity = relationship("Commodity", primaryjoin="foreign(Buyer.commodity_id)==Commodity.id", viewonly=True)
+    industry_purchase_stock = relationship("Industry_stock", primaryjoin="foreign(Buyer.purchase_stock_id)==Industry_stock.id", viewonly=True)
+    class_purchase_stock = relationship("Class_stock", primaryjoin="foreign(Buyer.purchase_stock_id)==Class_stock.id", viewonly=True)
+    industry_money_stock = relationship("Industry_stock", primaryjoin="foreign(Buyer.money_stock_id)==Industry_stock.id", viewonly=True)
+    class_money_stock = relationship("Class_stock", primaryjoin="foreign(Buyer.money_stock_id)==Class_stock.id", viewonly=True)
 
-    def purchase_stock(self, session)->Industry_stock|Class_stock:
+    @property
+    def purchase_stock(self)->Industry_stock|Class_stock:
         """The stock that must receive the goods.
         This may be either an Industry_stock OR a Class_stock, as indicated by the
-        type annotation of the method result.
+        type annotation of the property.
         Trade assumes that both classes implement methods which allow them to receive goods.
         """
         if self.owner_type=="Industry":
-            return session.get_one(Industry_stock, self.purchase_stock_id)
+            return self.industry_purchase_stock
         else:
-            return session.get_one(Class_stock, self.purchase_stock_id)
+            return self.class_purchase_stock
 
-    def money_stock(self, session)->Industry_stock|Class_stock:
+    @property
+    def money_stock(self)->Industry_stock|Class_stock:
         """The stock that pays for the goods.
         This may be either an Industry_stock OR a Class_stock, as indicated by the
-        type annotation of the method result.
+        type annotation of the property.
         Trade assumes that both classes implement methods which allow them to pay for goods.
         """
         if self.owner_type=="Industry":
-            return session.get_one(Industry_stock, self.money_stock_id)
+            return self.industry_money_stock
         else:
-            return session.get_one(Class_stock, self.money_stock_id)
-
-    def commodity(self, session)->Commodity:
-        """Returns the Commodity which this buyer wants to get for this stock."""
-        return session.get_one(Commodity, self.commodity_id)
+            return self.class_money_stock
 
-    def owner_name(self, session):  # Really just for diagnostic convenience
+    @property
+    def owner_name(self):  # Really just for diagnostic convenience
         if self.owner_type == "Industry":
-            return session.get_one(Industry, self.purchase_stock(session).industry_id).name
+            return self.purchase_stock.industry.name
         else:
-            return session.get_one(SocialClass, self.purchase_stock(session).class_id).name
+            return self.purchase_stock.social_class.name
 
 class Seller(Base):
     """The Seller class is initialized when a simulation is created,
@@ -737,108 +740,109 @@ class Seller(Base):
     money_stock_id = Column(Integer)
     commodity_id = Column(Integer)
 
-    def simulation(self, session)->Simulation:
-        """Returns the simulation to which this buyer belongs"""
-        return session.get_one(Simulation, self.simulation_id)
+    simulation = relationship("Simulation", primaryjoin="foreign(Seller.simulation_id)==Simulation.id", viewonly=True)
+    commodity = relationship("Commodity", primaryjoin="foreign(Seller.commodity_id)==Commodity.id", viewonly=True)
+    industry_sales_stock = relationship("Industry_stock", primaryjoin="foreign(Seller.sales_stock_id)==Industry_stock.id", viewonly=True)
+    class_sales_stock = relationship("Class_stock", primaryjoin="foreign(Seller.sales_stock_id)==Class_stock.id", viewonly=True)
+    industry_money_stock = relationship("Industry_stock", primaryjoin="foreign(Seller.money_stock_id)==Industry_stock.id", viewonly=True)
+    class_money_stock = relationship("Class_stock", primaryjoin="foreign(Seller.money_stock_id)==Class_stock.id", viewonly=True)
 
-    def sales_stock(self, session)->Industry_stock|Class_stock:
-        """The stock that must receive the goods.
+    @property
+    def sales_stock(self)->Industry_stock|Class_stock:
+        """The stock that supplies the goods.
         This may be either an Industry_stock OR a Class_stock, as indicated by the
-        type annotation of the method result.
-        Trade assumes that both classes implement methods which allow them to receive goods.
+        type annotation of the property.
+        Trade assumes that both classes implement methods which allow them to supply goods.
         """
         if self.owner_type=="Industry":
-            return session.get_one(Industry_stock, self.sales_stock_id)
+            return self.industry_sales_stock
         else:
-            return session.get_one(Class_stock, self.sales_stock_id)
+            return self.class_sales_stock
 
-    def money_stock(self, session):
-        """The stock that pays for the goods.
+    @property
+    def money_stock(self)->Industry_stock|Class_stock:
+        """The stock that receives payment for the goods.
         This may be either an Industry_stock OR a Class_stock, as indicated by the
-        type annotation of the method result.
-        Trade assumes that both classes implement methods which allow them to pay for goods.
+        type annotation of the property.
+        Trade assumes that both classes implement methods which allow them to receive money.
         """
         if self.owner_type=="Industry":
-            return session.get_one(Industry_stock, self.money_stock_id)
+            return self.industry_money_stock
         else:
-            return session.get_one(Class_stock, self.money_stock_id)
+            return self.class_money_stock
 
-    def commodity(self, session):
-        """Returns the Commodity which this seller is offering."""
-        return session.get_one(Commodity, self.commodity_id)
-
-    def owner_name(self, session):  # Really just for diagnostic convenience
+    @property
+    def owner(self)->Industry|SocialClass:
+        """The Industry or SocialClass which owns the sales stock"""
         if self.owner_type == "Industry":
-            return session.get_one(Industry, self.sales_stock(session).industry_id).name
+            return self.sales_stock.industry
         else:
-            return session.get_one(SocialClass, self.sales_stock(session).class_id).name
+            return self.sales_stock.social_class
+
+    @property
+    def owner_name(self):  # Really just for diagnostic convenience
+        return self.owner.name
+
+    @property
+    def owner_id(self):  # also just for diagnostic purposes
+        return self.owner.id
+
+class TemplateFixture(Base):
+    """Where each template was loaded from, and a hash of the fixture files
+    it was loaded from, so that a template is only reloaded if its files
+    have changed (see actions/reload.py)."""
+    __tablename__ = "template_fixtures"
+
+    folder = Column(String, primary_key=True, nullable=False)  # such as 'static/3'
+    simulation_id = Column(Integer, nullable=False)
+    content_hash = Column(String, nullable=False)
+
+class JournalEntry(Base):
+    """One thing done to a simulation from outside: an action, a list of
+    prices posted by a user, a change of parameters, or a fast-forward.
+    Taken in order of id, the entries of a simulation are all that is
+    needed to rebuild it from its template (see actions/journal.py), so
+    entries are only ever added.
+
+    time_stamp and state are those of the simulation when the entry was
+    made, before the operation changed them. operation is the name of an
+    action (see routers/actions.py circuit), or 'setprices', 'parameters'
+    or 'fast forward'. data holds whatever else the operation needs.
+    """
+    __tablename__ = "journal"
 
-    def owner_id(self, session):  # also just for diagnostic purposes
-        if self.owner_type == "Industry":
-            return session.get_one(Industry, self.sales_stock(session).industry_id).id
-        else:
-            return session.get_one(SocialClass, self.sales_stock(session).class_id).id
+    id = Column(Integer, primary_key=True, nullable=False)
+    simulation_id = Column(
+        Integer, ForeignKey("simulations.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    time_stamp = Column(Integer, nullable=False)
+    state = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    data = Column(JSON, nullable=True)
 
-"""Helper functions which serve as workarounds for dealing with pydantic limitations"""
+"""Helper functions which serve as workarounds for dealing with pydantic limitations.
+They pick out stocks of a given usage from the stocks of an industry or class,
+so they cost no query if those stocks have been loaded eagerly."""
 
 def get_industry_sales_stock(industry, session)->Industry_stock:
     """Workaround because pydantic won't accept this query in a built-in function."""
-    return (
-        session.query(Industry_stock)
-        .filter(
-            Industry_stock.industry_id == industry.id,
-            Industry_stock.usage_type == "Sales",
-            Industry_stock.simulation_id == industry.simulation_id,
-        )
-        .first()
-    )
+    return next((stock for stock in industry.stocks if stock.usage_type=="Sales"),None)
 
 def get_industry_money_stock(industry, session)->Industry_stock:
     """workaround because pydantic won't accept this query in a built-in function."""
-    return (
-        session.query(Industry_stock)
-        .filter(
-            Industry_stock.industry_id == industry.id,
-            Industry_stock.usage_type == "Money",
-            Industry_stock.simulation_id == industry.simulation_id,
-        )
-        .first()
-    )
+    return next((stock for stock in industry.stocks if stock.usage_type=="Money"),None)
 
 def get_class_sales_stock(social_class, session)->Class_stock:
     """Workaround because pydantic won't accept this query in a built-in function."""
-    return (
-        session.query(Class_stock)
-        .filter(
-            Class_stock.class_id == social_class.id,
-            Class_stock.usage_type == "Sales",
-            Class_stock.simulation_id == social_class.simulation_id,
-        )
-        .first()
-    )
+    return next((stock for stock in social_class.stocks if stock.usage_type=="Sales"),None)
 
 def get_class_money_stock(social_class, session)->Class_stock:
     """Workaround because pydantic won't accept this query in a built-in function."""    
-    return (
-        session.query(Class_stock)
-        .filter(
-            Class_stock.class_id == social_class.id,
-            Class_stock.usage_type == "Money",
-            Class_stock.simulation_id == social_class.simulation_id,
-        )
-        .first()
-    )
+    return next((stock for stock in social_class.stocks if stock.usage_type=="Money"),None)
 
-def get_class_consumption_stocks(social_class,session):
+def get_class_consumption_stocks(social_class,session)->list[Class_stock]:
     """Workaround because pydantic won't accept this query in a built-in function."""    
-    return (
-        session.query(Class_stock)
-        .filter(
-            Class_stock.class_id == social_class.id,
-            Class_stock.usage_type == "Consumption",
-            Class_stock.simulation_id == social_class.simulation_id,
-        )
-    )
+    return [stock for stock in social_class.stocks if stock.usage_type=="Consumption"]
 
 """Helper functions which just put boilerplate code in one place"""
 
@@ -877,3 +881,29 @@ def means_of_production(simulation:Simulation, session:Session)->Commodity:
             Commodity.origin == "INDUSTRIAL",
         )# bodge will fail if there is more than one means of production commodity
         return result.first()
+
+"""Tables whose rows belong to a single simulation (through simulation_id),
+in an order in which they can be inserted. Together with the Simulation
+itself, these make up everything that has to be copied to copy a simulation."""
+simulation_models=[Commodity, Industry, SocialClass, Industry_stock, Class_stock, Buyer, Seller]
+
+"""Columns which refer to other rows of the same simulation and are not
+known until those rows exist (see actions/reload.py assign_stock_roles)."""
+role_columns={
+    Industry:("sales_stock_id","money_stock_id","mp_stock_id"),
+    SocialClass:("sales_stock_id","money_stock_id"),
+}
+
+# The inputs from which the @memoised quantities above are calculated.
+# Changing any of them empties the cache (see models/memo.py)
+invalidate_on(
+    Simulation.periods_per_year,
+    Commodity.unit_price,
+    Commodity.turnover_time,
+    Industry.output_scale,
+    SocialClass.population,
+    Industry_stock.requirement,
+    Industry_stock.usage_type,
+    Class_stock.requirement,
+    Class_stock.usage_type,
+)
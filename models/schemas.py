@@ -16,11 +16,32 @@ class ServerMessage(BaseModel):
     message:str
     statusCode:http.HTTPStatus
 
+# Return message for an action. For a preview, 'changes' is what the action
+# would change, in the form of /simulations/changes/{id} (see database/changes.py)
+class ActionMessage(BaseModel):
+    message:str
+    statusCode:http.HTTPStatus
+    changes:dict|None=None
+
+# Return message for a multi-period run
+# converged_at is the period in which the simulation became stationary, if it did
+class RunMessage(BaseModel):
+    message:str
+    statusCode:http.HTTPStatus
+    periods_run:int
+    converged_at:int|None
+
 class CloneMessage(BaseModel):
     message:str
     statusCode:http.HTTPStatus
     simulation_id:int
 
+# One line of a tracemalloc report: where memory was allocated, and how much is still held
+class AllocationSite(BaseModel):
+    site:str
+    size_kib:float
+    count:int
+
 class UserBase(BaseModel):
     username: str
     current_simulation_id: int
@@ -37,6 +58,53 @@ class PostedPrice(BaseModel):
     unitPrice: float
 
 
+# Selects the simulations to advance together (see /admin/cohort/step).
+# 'usernames' selects the current simulations of those users. Every
+# criterion given must be met. Templates are never selected
+class CohortSelection(BaseModel):
+    usernames: list[str]|None=None
+    template_id: int|None=None
+    state: str|None=None
+    periods: int=1
+
+# The outcome for one simulation of a cohort
+class CohortStepResult(BaseModel):
+    simulation_id: int
+    username: str|None
+    succeeded: bool
+    message: str
+
+class CohortMessage(BaseModel):
+    message:str
+    statusCode:http.HTTPStatus
+    results:list[CohortStepResult]
+
+# One step of a batch (see /action/batch). 'op' is the name of an action
+# route ("demand", "supply", "trade", "produce", "consume", "prices",
+# "invest"), or "setprices" with 'prices', or "parameters" with
+# 'parameters', the new values of parameters of the current simulation
+class BatchOperation(BaseModel):
+    op: str
+    prices: list[PostedPrice]|None=None
+    parameters: dict[str,bool|int|float|str|None]|None=None
+
+# The outcome of one step of a batch, and how long it took
+class BatchStepResult(BaseModel):
+    step: int
+    op: str
+    succeeded: bool
+    message: str
+    seconds: float
+
+# Return message for a batch. 'steps' has a result for each step attempted:
+# the batch stops at the first step that fails. 'committed' is the number of
+# steps which were committed, and stay committed even if a later step fails
+class BatchMessage(BaseModel):
+    message:str
+    statusCode:http.HTTPStatus
+    steps:list[BatchStepResult]
+    committed:int
+
 class SimulationBase(BaseModel):
     id:int
     name: str
@@ -51,6 +119,15 @@ class SimulationBase(BaseModel):
     total_price: float
     melt: float
     investment_algorithm: str
+    template_id: int|None=None
+
+# One period of a projected growth path.
+# output_scales is keyed by industry id, capitalist_requirements by commodity id
+class GrowthStep(BaseModel):
+    period:int
+    output_scales:dict[int,float]
+    labour_demand:float
+    capitalist_requirements:dict[int,float]
 
 class CommodityBase(BaseModel):
     id: int
@@ -88,12 +165,22 @@ class IndustryBase(BaseModel):
     profit: float
     profit_rate: float
 
+# For an event, message is rendered from the event and its fields
 class TraceOut(BaseModel):
     id: int
     simulation_id: int
     time_stamp: int
     level :int
     message: str
+    event: str|None = None
+    commodity_id: int|None = None
+    industry_id: int|None = None
+    class_id: int|None = None
+    stock_id: int|None = None
+    amount: float|None = None
+    size: float|None = None
+    value: float|None = None
+    price: float|None = None
 
 class SocialClassBase(BaseModel):
     id: int
@@ -156,3 +243,22 @@ class SellerBase(BaseModel):
     money_stock_id: int
     commodity_id: int
 
+
+# One entry of the journal of a simulation (see actions/journal.py)
+class JournalEntryOut(BaseModel):
+    id: int
+    simulation_id: int
+    time_stamp: int
+    state: str
+    operation: str
+    data: list|dict|None = None
+
+# A simulation as it was at some point, rebuilt from its journal
+class ReplayedSimulation(BaseModel):
+    entries_replayed: int
+    simulation: SimulationBase
+    commodities: list[CommodityBase]
+    industries: list[IndustryBase]
+    social_classes: list[SocialClassBase]
+    industry_stocks: list[Industry_stock_base]
+    class_stocks: list[Class_stock_base]
@@ -0,0 +1,144 @@
+"""Timing and SQL statement counts, published in the Prometheus text format.
+
+Measures:
+
+    capsim_request_seconds: the latency of each request, by route and status
+    capsim_request_sql_statements: the SQL statements each request executes, by route
+    capsim_action_seconds: the time each action takes, by action
+    capsim_stage_seconds: the time each stage of an action takes, by stage
+
+Measurement is turned on by setting METRICS to 'on' (see
+authorization/config.py). When it is off, which is the default, the
+middleware and the SQL listener are not installed and the stage
+decorator returns the function it decorates unchanged, so the only cost
+is one test in each action.
+
+Stages are marked by decorating the functions which carry them out with
+@stage. Routes are labelled by their path template (such as
+/action/run/{periods}), not the path requested, so that each route has
+one set of figures.
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from authorization import config
+
+enabled=config.METRICS.lower()=="on"
+
+# Seconds, from a millisecond to a minute
+TIME_BUCKETS=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,60.0)
+# Statements, from one to several thousand
+COUNT_BUCKETS=(1,2,5,10,20,50,100,200,500,1000,2000,5000)
+
+class Histogram:
+    """A Prometheus histogram with labels. Safe to use from several threads."""
+    def __init__(self, name:str, description:str, labels:tuple, buckets:tuple):
+        self.name=name
+        self.description=description
+        self.labels=labels
+        self.buckets=buckets
+        self.series={}  # label values -> [count in each bucket, sum, count]
+        self.lock=threading.Lock()
+
+    def observe(self, value:float, *label_values):
+        with self.lock:
+            series=self.series.get(label_values)
+            if series is None:
+                series=self.series[label_values]=[[0]*len(self.buckets),0.0,0]
+            for i,bound in enumerate(self.buckets):
+                if value<=bound:
+                    series[0][i]+=1
+            series[1]+=value
+            series[2]+=1
+
+    def render(self)->list[str]:
+        lines=[f"# HELP {self.name} {self.description}",f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values,(counts,total,count) in sorted(self.series.items()):
+                labels=",".join(f'{label}="{escape(value)}"' for label,value in zip(self.labels,label_values))
+                prefix=labels+"," if labels else ""
+                for bound,bucket_count in zip(self.buckets,counts):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total:g}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+def escape(value)->str:
+    """Escape a label value as the Prometheus text format requires."""
+    return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+request_seconds=Histogram("capsim_request_seconds","Latency of each request",("route","method","status"),TIME_BUCKETS)
+request_statements=Histogram("capsim_request_sql_statements","SQL statements executed by each request",("route","method"),COUNT_BUCKETS)
+action_seconds=Histogram("capsim_action_seconds","Time taken by each action",("action",),TIME_BUCKETS)
+stage_seconds=Histogram("capsim_stage_seconds","Time taken by each stage of an action",("stage",),TIME_BUCKETS)
+histograms=[request_seconds,request_statements,action_seconds,stage_seconds]
+
+# The statements executed so far by the current request, in a list so that
+# the threads and tasks which serve the request all add to the same count
+statement_count:contextvars.ContextVar[list|None]=contextvars.ContextVar("statement_count",default=None)
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter=statement_count.get()
+    if counter is not None:
+        counter[0]+=1
+
+def stage(function):
+    """Decorator which times a stage of an action. If measurement is off,
+    returns the function itself."""
+    if not enabled:
+        return function
+    @functools.wraps(function)
+    def timed(*args,**kwargs):
+        started=time.perf_counter()
+        try:
+            return function(*args,**kwargs)
+        finally:
+            stage_seconds.observe(time.perf_counter()-started,function.__name__)
+    return timed
+
+@contextmanager
+def _time_action(name:str):
+    started=time.perf_counter()
+    try:
+        yield
+    finally:
+        action_seconds.observe(time.perf_counter()-started,name)
+
+def action_timer(name:str):
+    """Context manager which times one action."""
+    return _time_action(name) if enabled else nullcontext()
+
+def install(app):
+    """Add the request middleware to 'app', and count the SQL statements of
+    every engine. Does nothing if measurement is off."""
+    if not enabled:
+        return
+    event.listen(Engine,"before_cursor_execute",count_statement)
+
+    @app.middleware("http")
+    async def measure_request(request, call_next):
+        counter=[0]
+        token=statement_count.set(counter)
+        started=time.perf_counter()
+        status="500"
+        try:
+            response=await call_next(request)
+            status=str(response.status_code)
+            return response
+        finally:
+            elapsed=time.perf_counter()-started
+            statement_count.reset(token)
+            route=request.scope.get("route")
+            path=route.path if route is not None else "unmatched"
+            request_seconds.observe(elapsed,path,request.method,status)
+            request_statements.observe(counter[0],path,request.method)
+
+def render()->str:
+    """Every measurement, in the Prometheus text format."""
+    return "\n".join(line for histogram in histograms for line in histogram.render())+"\n"
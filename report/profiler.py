@@ -0,0 +1,183 @@
+"""A sampling profiler which can be switched on while the server is running.
+
+While it runs, a sampling thread wakes every 'interval' seconds and
+records the stack of every other thread that is doing something (threads
+waiting for work are left out). Between samples nothing at all is done,
+so the cost is set by the interval.
+
+A timer signal (SIGPROF) would be the usual way to take the samples, but
+Python only runs signal handlers in the main thread, and only while it is
+executing Python code. The server runs each request in a worker thread,
+while the main thread waits in the event loop, so a signal handler would
+see almost none of the work. Hence the sampling thread.
+
+The samples are kept as collapsed stacks, one line per distinct stack
+with the number of times it was seen, outermost frame first:
+
+    run (threading.py:975);...;process_demand (actions/demand.py:13) 42
+
+which flamegraph.pl, speedscope and similar tools read directly.
+
+A run lasts either a given number of seconds, or for the next N actions
+(in which case samples are taken only while an action is being carried
+out). With 'memory', tracemalloc is started too, and top_allocations
+reports which lines hold the most memory allocated since. Memory is
+traced until the profiler is explicitly stopped, so that a long batch
+run can be inspected while it goes on.
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Files in which a thread is waiting rather than working
+_idle_files=("threading.py","selectors.py","queue.py",os.path.join("concurrent","futures","thread.py"))
+
+# The root of the project, which is removed from file names to shorten them
+_root=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+os.sep
+
+class ProfilerBusy(Exception):
+    """Raised by start if a run is already in progress."""
+
+class Profiler:
+    """The state of the profiler. There is one, called 'profiler'."""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.running=False
+        self.interval=0.005
+        self.actions_left=None  # for a run limited to N actions, how many remain
+        self.in_action=0  # the number of actions being sampled right now
+        self.stacks=Counter()
+        self.samples=0
+        self.finished=threading.Event()
+        self.thread=None
+
+    def start(self, seconds:float|None=None, actions:int|None=None, interval:float=0.005, memory:bool=False):
+        """Start a run, for 'seconds', or for the next 'actions' actions.
+        Discards the results of the previous run.
+
+            Raises ProfilerBusy if a run is in progress.
+            Raises ValueError unless exactly one of seconds and actions is given.
+        """
+        if (seconds is None)==(actions is None):
+            raise ValueError("Give either a number of seconds or a number of actions")
+        with self.lock:
+            if self.running:
+                raise ProfilerBusy("The profiler is already running")
+            self.running=True
+            self.interval=interval
+            self.actions_left=actions
+            self.in_action=0
+            self.stacks=Counter()
+            self.samples=0
+            self.finished=threading.Event()
+            if memory and not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+            self.thread=threading.Thread(target=self.run,args=(seconds,),name="profiler",daemon=True)
+            self.thread.start()
+
+    def run(self, seconds:float|None):
+        """The sampling thread. Stops when the time is up or stop is called."""
+        own=threading.get_ident()
+        limit=None if seconds is None else int(seconds/self.interval)
+        ticks=0
+        while not self.finished.wait(self.interval):
+            ticks+=1
+            if self.actions_left is None or self.in_action:
+                self.sample(own)
+            if limit is not None and ticks>=limit:
+                break
+        with self.lock:
+            self.running=False
+            self.actions_left=None
+
+    def sample(self, own:int):
+        """Record the stack of each busy thread, other than 'own'."""
+        for thread_id,frame in sys._current_frames().items():
+            if thread_id==own:
+                continue
+            stack=collapse(frame)
+            if stack is not None:
+                self.stacks[stack]+=1
+        self.samples+=1
+
+    def stop(self):
+        """End the run, if there is one. Leaves memory tracing alone."""
+        self.finished.set()
+        thread=self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    @contextmanager
+    def action(self):
+        """Sample while one action is carried out, if a run limited to a
+        number of actions is in progress."""
+        if self.actions_left is None:
+            yield
+            return
+        with self.lock:
+            counting=self.running and self.actions_left is not None and self.actions_left>0
+            if counting:
+                self.actions_left-=1
+                self.in_action+=1
+        try:
+            yield
+        finally:
+            if counting:
+                with self.lock:
+                    self.in_action-=1
+                    done=self.actions_left==0 and self.in_action==0
+                if done:
+                    self.finished.set()
+
+    def collapsed(self)->str:
+        """The samples of the last (or current) run as collapsed stacks."""
+        return "".join(f"{stack} {count}\n" for stack,count in self.stacks.most_common())
+
+    def status(self)->str:
+        state="running" if self.running else "stopped"
+        if self.running and self.actions_left is not None:
+            state+=f", {self.actions_left} actions to go"
+        memory=" Memory is being traced." if tracemalloc.is_tracing() else ""
+        return f"The profiler is {state}. {self.samples} samples, {len(self.stacks)} distinct stacks.{memory}"
+
+def collapse(frame)->str|None:
+    """One stack, outermost frame first, separated by semicolons. None if
+    the thread is waiting rather than working."""
+    if frame is None or frame.f_code.co_filename.endswith(_idle_files):
+        return None
+    names=[]
+    while frame is not None:
+        code=frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.removeprefix(_root)}:{code.co_firstlineno})")
+        frame=frame.f_back
+    return ";".join(reversed(names))
+
+def top_allocations(limit:int=20)->list[dict]:
+    """The lines which hold the most memory allocated since tracemalloc
+    was started, largest first.
+
+        Raises RuntimeError if tracemalloc is not running.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Memory is not being traced. Start the profiler with memory=true")
+    statistics=tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False,tracemalloc.__file__),
+        tracemalloc.Filter(False,"<frozen importlib._bootstrap*>"),
+    ]).statistics("lineno")
+    return [
+        {
+            "site":f"{stat.traceback[0].filename.removeprefix(_root)}:{stat.traceback[0].lineno}",
+            "size_kib":stat.size/1024,
+            "count":stat.count,
+        } for stat in statistics[:limit]
+    ]
+
+def stop_tracing_memory():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+profiler=Profiler()
@@ -0,0 +1,163 @@
+"""Find repeated SQL statements (N+1 queries) and enforce query budgets.
+
+Every statement executed while a QueryLog is being kept is reduced to a
+fingerprint: its text with the literal values, parameters and lists of
+values replaced by placeholders. A query that is executed again and
+again with different values, as happens when a query is issued for each
+row of a loop, therefore counts as one fingerprint repeated many times.
+Only queries (SELECT statements) are checked for repeats; every
+statement counts towards the total.
+
+There are two ways to use this.
+
+Instrumentation: with QUERY_WATCH set to 'on' (see authorization/config.py),
+every request and every action is watched, and each fingerprint repeated
+more than QUERY_REPEAT_THRESHOLD times is written to the log, with the
+route or action that repeated it. When QUERY_WATCH is off, which is the
+default, nothing is installed.
+
+Budgets: query_budget is a context manager which raises
+QueryBudgetExceeded (an AssertionError, so any test runner reports it as
+a failure) if the code inside it executes more statements, or repeats a
+query more often, than it is allowed:
+
+    with query_budget(statements=60, repeats=5):
+        process_demand(session,simulation)
+
+benchmarks/query_budget.py declares a budget for each action and checks
+them all.
+"""
+
+import contextvars
+import re
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from authorization import config
+from report.report import logger
+
+enabled=config.QUERY_WATCH.lower()=="on"
+repeat_threshold=config.QUERY_REPEAT_THRESHOLD
+
+class QueryLog:
+    """The statements executed while the log is kept, by fingerprint."""
+    def __init__(self):
+        self.fingerprints=Counter()
+        self.statements=0
+
+    def add(self, statement:str):
+        self.fingerprints[fingerprint(statement)]+=1
+        self.statements+=1
+
+    def repeated(self, threshold:int)->list[tuple[str,int]]:
+        """The SELECT fingerprints executed more than 'threshold' times, most
+        repeated first. Writes are left out: the session flushes one UPDATE
+        or INSERT per changed row, which is not an N+1 query."""
+        return [
+            (text,count) for text,count in self.fingerprints.most_common()
+            if count>threshold and text[:6].upper()=="SELECT"
+        ]
+
+    def summary(self, limit:int=5)->str:
+        lines=[f"{self.statements} statements, {len(self.fingerprints)} distinct"]
+        for text,count in self.fingerprints.most_common(limit):
+            lines.append(f"  {count} x {text}")
+        return "\n".join(lines)
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by query_budget when the code it watches goes over budget."""
+
+# Patterns which reduce a statement to its fingerprint, applied in order
+_placeholders=[
+    (re.compile(r"'(?:[^']|'')*'"),"?"),                            # string literals
+    (re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b",re.IGNORECASE),"?"), # numbers
+    (re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s"),"?"),                      # named and positional parameters
+    (re.compile(r"__\[POSTCOMPILE_\w+\]"),"?"),                          # expanding IN parameters
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"),"(?)"),                   # lists of values
+    (re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+"),"(?)"),                     # multi-row VALUES
+    (re.compile(r"\s+")," "),
+]
+
+def fingerprint(statement:str)->str:
+    """The statement with its values replaced by placeholders."""
+    for pattern,replacement in _placeholders:
+        statement=pattern.sub(replacement,statement)
+    return statement.strip()
+
+# The logs being kept by the current request or action (and those enclosing it)
+active_logs:contextvars.ContextVar[tuple]=contextvars.ContextVar("active_logs",default=())
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    for log in active_logs.get():
+        log.add(statement)
+
+_listening=False
+
+def listen():
+    """Start passing statements to the active logs. Harmless to call twice."""
+    global _listening
+    if not _listening:
+        event.listen(Engine,"before_cursor_execute",record_statement)
+        _listening=True
+
+@contextmanager
+def watch():
+    """Keep a QueryLog of the statements executed inside the block."""
+    listen()
+    log=QueryLog()
+    token=active_logs.set(active_logs.get()+(log,))
+    try:
+        yield log
+    finally:
+        active_logs.reset(token)
+
+def warn_repeated(log:QueryLog, where:str):
+    """Log every fingerprint repeated more often than the threshold."""
+    for text,count in log.repeated(repeat_threshold):
+        logger.warning(f"N+1 suspect in {where}: {count} x {text}")
+
+@contextmanager
+def _watch_action(name:str):
+    with watch() as log:
+        yield log
+    warn_repeated(log,f"action {name}")
+
+def action_watch(name:str):
+    """Context manager which watches one action, if instrumentation is on."""
+    return _watch_action(name) if enabled else nullcontext()
+
+@contextmanager
+def query_budget(statements:int|None=None, repeats:int|None=None):
+    """Fail if the block executes more than 'statements' statements, or any
+    one query more than 'repeats' times. Either limit may be None.
+
+        Raises QueryBudgetExceeded, with the most frequent statements.
+    """
+    with watch() as log:
+        yield log
+    problems=[]
+    if statements is not None and log.statements>statements:
+        problems.append(f"{log.statements} statements executed; the budget is {statements}")
+    if repeats is not None:
+        for text,count in log.repeated(repeats):
+            problems.append(f"{count} x (more than {repeats}) {text}")
+    if problems:
+        raise QueryBudgetExceeded("\n".join(problems+[log.summary()]))
+
+def install(app):
+    """Watch every request to 'app'. Does nothing if instrumentation is off."""
+    if not enabled:
+        return
+    listen()
+
+    @app.middleware("http")
+    async def watch_request(request, call_next):
+        log=QueryLog()
+        token=active_logs.set(active_logs.get()+(log,))
+        try:
+            return await call_next(request)
+        finally:
+            active_logs.reset(token)
+            route=request.scope.get("route")
+            warn_repeated(log,f"{request.method} {route.path if route is not None else request.url.path}")
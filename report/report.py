@@ -1,8 +1,9 @@
 from colorama import Fore 
 import logging
+import weakref
 from sqlalchemy.orm import Session
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Index, Integer, String, event, insert, select
 from database.database import Base
 
 FORMAT = "%(levelname)s:%(message)s"
@@ -17,6 +18,12 @@ class Trace(Base):
     for the user. It works in combination with logging.report(). A call
     to report() creates a single trace entry in the database and prints
     it on the console
+
+    An entry is either a message, or an event (see 'events') with the ids
+    of the objects it concerns and the numbers it reports, from which the
+    message is rendered when the trace is read (see render). Events take
+    much less room, and can be selected by commodity, owner or period.
+    time_stamp is the period of the simulation when the entry was made.
     """
 
     __tablename__ = "trace"
@@ -25,8 +32,53 @@ class Trace(Base):
     time_stamp = Column(Integer)
     username = Column(String, nullable=True)
     level = Column(Integer)
-    message = Column(String)
+    message = Column(String, nullable=True)  # None for an event
+    event = Column(String, nullable=True)  # a key of 'events'
+    commodity_id = Column(Integer, nullable=True, index=True)
+    industry_id = Column(Integer, nullable=True, index=True)
+    class_id = Column(Integer, nullable=True, index=True)
+    stock_id = Column(Integer, nullable=True)  # an industry stock if industry_id is set, else a class stock
+    amount = Column(Float, nullable=True)
+    size = Column(Float, nullable=True)
+    value = Column(Float, nullable=True)
+    price = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_trace_simulation_period", "simulation_id", "time_stamp"),
+        Index("ix_trace_simulation_event", "simulation_id", "event"),
+    )
+
+# The message of each event. {commodity}, {owner} and {stock} are replaced
+# by the names of the objects the entry refers to, the rest by its fields.
+events = {
+    "demand.grown": "Demand for {commodity} has grown by {amount} to {size}, from [{stock}]",
+    "demand.owner": "Demand for {commodity} with owner ({owner}) is {size}, from [{stock}]",
+    "supply.added": "{owner} adds {amount:.0f} to the supply of {commodity}, which was previously {size:.0f}",
+    "trade.offer": "seller {owner} can sell {size} and is looking for buyers {stock}",
+    "trade.demand": "buyer {owner} will buy {amount}",
+    "trade.buying": "buyer {owner} is buying {amount}",
+    "trade.bought": "{owner} is buying {amount} at price {price} and value {value}",
+    "production.input": "Processing productive input '{stock}' with size {size} and value {value}",
+    "production.labour": "{stock} creates value {amount}",
+    "production.transfer": "{stock} transfers value {amount} at unit value {value} ",
+    "production.sales_value": "Sales value is {value} after inputs from [{stock}]",
+    "consumption.before": "Consuming size  {size} and value {value} by stock [{stock}]",
+    "consumption.after": "Consumption stock size {size}, value {value} and price {price} for [{stock}] ",
+    "commodity.stock": "Processing {owner_kind} stock of {commodity} called [{stock}]",
+    "commodity.size": "Adding {size} to the size of {commodity}",
+    "commodity.value": "Adding {value} to the value of {commodity}",
+    "commodity.price": "Adding {price} to the price of {commodity}",
+    "stock.revalued": "Setting value {value} and price {price} for stock [{stock}]",
+    "capital.stock": "Adding {price} to capital of {owner} for Industry stock [{stock}]",
+    "price.set": "Setting the price of {commodity} to {price}",
+    "price.before": "Commodity {commodity} before processing: total price is {price}",
+    "price.total": "Price of {commodity} is {price} bringing economy-wide total to {amount}",
+    "price.value": "Value of {commodity} is {value} bringing calculated economy-wide total to {amount}",
+    "price.unit_value": "Unit price of {commodity} was {price} so unit value was reset to {value}",
+}
 
+# The colour in which entries of each level are written to the console
+colours = {0: Fore.WHITE, 1: Fore.GREEN, 2: Fore.RED, 3: Fore.BLUE, 4: Fore.LIGHTRED_EX, 5: Fore.LIGHTMAGENTA_EX}
 
 # Logs both to the console and
 # As the simulation proceeds, create entries in the 'Trace' file which can be accesed via an endpoint
@@ -51,48 +103,217 @@ def report(level: int, simulation_id: int, message: str, session: Session):
         session(Session):
             the sqlAlchemy database session to store the report
 
-    Does not commit the change. Assumes this will be done by the caller.
+    Does not commit the change. Assumes this will be done by the caller,
+    once the action or request is complete. Because the entries are not
+    written as they are made (see pending_trace), the level of the last
+    entry for each simulation is remembered in the session rather than
+    read back from the Trace table.
     """
-    match level:
-        case 0:
-            colour = Fore.WHITE
-        case 1:
-            colour = Fore.GREEN
-        case 2:
-            colour = Fore.RED
-        case 3:
-            colour = Fore.BLUE
-        case 4:
-            colour= Fore.LIGHTRED_EX
-        case 5:
-            colour=Fore.LIGHTMAGENTA_EX
-
-    user_message = " " * level + f"{message}"
-    log_message = " " * level+colour + message + Fore.WHITE
+    if session.info.get("replay"):
+        return  # a replay is not traced (see actions/journal.py)
+    log_message = " " * level+colours.get(level, Fore.WHITE) + message + Fore.WHITE
     logging.debug(log_message)
+    add_entry(session, Trace(simulation_id=simulation_id, level=level, message=message))
+
+def report_event(
+    level: int,
+    simulation_id: int,
+    event: str,
+    session: Session,
+    commodity=None,
+    owner=None,
+    stock=None,
+    amount: float=None,
+    size: float=None,
+    value: float=None,
+    price: float=None,
+):
+    """
+    Like report, but stores an event instead of a message. The message is
+    rendered from the template in 'events' when the trace is read.
+
+        event(str):
+            a key of 'events'
+        commodity(Commodity), owner(Industry or SocialClass), stock(Industry_stock or Class_stock):
+            the objects the entry concerns. If stock is given, owner
+            may be left out and is taken to be the owner of the stock.
+        amount, size, value, price(float):
+            the numbers the entry reports
+
+    Objects are passed rather than ids so that the message can be written
+    to the console, which is only done if debug logging is on.
+    """
+    if session.info.get("replay"):
+        return
+    entry = Trace(
+        simulation_id=simulation_id,
+        level=level,
+        event=event,
+        commodity_id=None if commodity is None else commodity.id,
+        stock_id=None if stock is None else stock.id,
+        amount=amount,
+        size=size,
+        value=value,
+        price=price,
+    )
+    if owner is not None:
+        if owner.__tablename__ == "industries":
+            entry.industry_id = owner.id
+        else:
+            entry.class_id = owner.id
+    elif stock is not None:
+        if stock.__tablename__ == "industry_stocks":
+            entry.industry_id = stock.industry_id
+        else:
+            entry.class_id = stock.class_id
+    if logger.root.isEnabledFor(logging.DEBUG):
+        if owner is None and stock is not None:
+            owner = stock.industry if entry.industry_id is not None else stock.social_class
+        names = {
+            "commodity": None if commodity is None else commodity.name,
+            "owner": None if owner is None else owner.name,
+            "stock": None if stock is None else stock.name,
+        }
+        logging.debug(" " * level+colours.get(level, Fore.WHITE) + render(entry, names) + Fore.WHITE)
+    add_entry(session, entry)
+
+def add_entry(session: Session, entry: Trace):
+    """Date the entry with the period of its simulation and add it to the
+    session, after a correction if its level is too far below the last."""
+    entry.time_stamp = current_period(session, entry.simulation_id)
 
     # Get the last trace record that was added
-    lastRecord: Trace =session.query(Trace).where(Trace.simulation_id==simulation_id).order_by(Trace.id.desc()).first()
+    lastRecord: Trace =last_trace(session,entry.simulation_id)
     if lastRecord is not None:
     # print(f"The id of the last Trace record was {lastRecord.id} and its level was {lastRecord.level}")
-        if lastRecord.level - level >1:
-            logging.warning(f"A subitem was not closed. Last record had level {lastRecord.level} and this trace entry has level {level}")
-            logging.warning(f"The last record said {lastRecord.message}")
+        if lastRecord.level - entry.level >1:
+            logging.warning(f"A subitem was not closed. Last record had level {lastRecord.level} and this trace entry has level {entry.level}")
+            logging.warning(f"The last record said {lastRecord.message or lastRecord.event}")
 
             gapentry = Trace(
-                simulation_id=simulation_id,
+                simulation_id=entry.simulation_id,
                 level=lastRecord.level-1,
-                time_stamp=1,
-                message=f"CORRECTION to Minor API error. Previous level was {lastRecord.level} and this entry was {level}. Please tell the developer",
+                time_stamp=entry.time_stamp,
+                message=f"CORRECTION to Minor API error. Previous level was {lastRecord.level} and this entry was {entry.level}. Please tell the developer",
             )
-            session.add(gapentry)
+            pending_trace(session).append(gapentry)
 
-    # TODO check that gapentry and entry are added to the database in the order we add them to the session!
-    entry = Trace(
-        simulation_id=simulation_id,
-        level=level,
-        time_stamp=1,
-        message=user_message,
+    pending_trace(session).append(entry)
+    session.info.setdefault("last_trace",{})[entry.simulation_id]=entry
+
+def pending_trace(session: Session)->list:
+    """The entries made in this session which are yet to be written.
+
+    Entries are not added to the session, because the session would
+    insert them one at a time to learn their ids. Instead they are kept
+    here, in the order they were made, and written with one statement
+    whenever the session flushes or commits (see write_trace).
+    """
+    return session.info.setdefault("pending_trace",[])
+
+@event.listens_for(Session, "before_flush")
+@event.listens_for(Session, "before_commit")
+def write_trace(session: Session, *args):
+    """Write the pending entries of the session, in one statement. They
+    are kept until the transaction ends, for database/changes.py."""
+    entries=session.info.pop("pending_trace",None)
+    if entries:
+        columns=[column.key for column in Trace.__table__.columns if column.key!="id"]
+        session.connection().execute(
+            insert(Trace.__table__),
+            [{column:getattr(entry,column) for column in columns} for entry in entries],
+        )
+        session.info.setdefault("written_trace",[]).extend(entries)
+
+def current_period(session: Session, simulation_id: int)->int:
+    """The period the simulation has reached, or 0 if there is none (as
+    for entries made by the server rather than by a simulation)."""
+    from models.models import Simulation  # models imports this module
+    simulation = session.get(Simulation, simulation_id) if simulation_id else None
+    return 0 if simulation is None else simulation.time_stamp
+
+def render(entry: Trace, names: dict)->str:
+    """The message of a trace entry, without indentation.
+
+        names(dict):
+            'commodity', 'owner' and 'stock', the names of the objects
+            the entry refers to (see trace_names)
+    """
+    if entry.event is None:
+        return entry.message
+    return events[entry.event].format(
+        owner_kind="industrial" if entry.industry_id is not None else "class",
+        amount=entry.amount,
+        size=entry.size,
+        value=entry.value,
+        price=entry.price,
+        **names,
     )
-    session.add(entry)
-    session.commit() # TODO ideally we should not commit every time a new report is made...
+
+def trace_names(session: Session, simulation_id: int)->dict:
+    """The names of the objects of a simulation, by table and id, which
+    are needed to render the messages of trace events."""
+    from models.models import Class_stock, Commodity, Industry, Industry_stock, SocialClass
+    names={}
+    for model in (Commodity,Industry,SocialClass,Industry_stock,Class_stock):
+        names[model.__tablename__]=dict(session.execute(select(model.id,model.name).where(model.simulation_id==simulation_id)).all())
+    return names
+
+def entry_names(entry: Trace, names: dict)->dict:
+    """From the names given by trace_names, those which render needs for
+    this entry."""
+    industrial=entry.industry_id is not None
+    return {
+        "commodity":names["commodities"].get(entry.commodity_id),
+        "owner":names["industries"].get(entry.industry_id) if industrial else names["social_classes"].get(entry.class_id),
+        "stock":names["industry_stocks" if industrial else "class_stocks"].get(entry.stock_id),
+    }
+
+def last_trace(session: Session, simulation_id: int)->Trace:
+    """The last trace entry made for this simulation, whether or not it
+    has been written to the database yet."""
+    remembered=session.info.setdefault("last_trace",{})
+    if simulation_id not in remembered:
+        remembered[simulation_id]=session.query(Trace).where(Trace.simulation_id==simulation_id).order_by(Trace.id.desc()).first()
+    return remembered[simulation_id]
+
+# How far the trace of its session had got when each savepoint began
+savepoint_marks=weakref.WeakKeyDictionary()
+
+@event.listens_for(Session, "after_transaction_create")
+def mark_trace(session: Session, transaction):
+    """Note how far the trace had got when a savepoint begins, so that
+    rolling the savepoint back discards only the entries made inside it.
+    Entries still pending may be written inside the savepoint, and so
+    rolled back with it, so they are kept to be pending again."""
+    if transaction.nested:
+        savepoint_marks[transaction]=(
+            list(session.info.get("pending_trace",[])),
+            len(session.info.get("written_trace",[])),
+            dict(session.info.get("last_trace",{})),
+        )
+
+@event.listens_for(Session, "after_rollback")
+def forget_last_trace(session: Session):
+    """Entries made since the last commit are discarded by a rollback, so
+    forget which was the last. A savepoint which is rolled back discards
+    only the entries made since it began (see mark_trace)."""
+    if session.in_nested_transaction():
+        mark=savepoint_marks.pop(session.get_nested_transaction(),None)
+        if mark is not None:
+            pending,written,last=mark
+            session.info["pending_trace"]=pending
+            del session.info.setdefault("written_trace",[])[written:]
+            session.info["last_trace"]=last
+            return
+    session.info.pop("last_trace",None)
+    session.info.pop("pending_trace",None)
+    session.info.pop("written_trace",None)
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_pending_trace(session: Session, transaction):
+    """Entries which were never written are discarded, like any other
+    change, when the session is closed without committing."""
+    if transaction.parent is None:
+        session.info.pop("pending_trace",None)
+        session.info.pop("written_trace",None)
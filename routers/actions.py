@@ -1,11 +1,19 @@
+import time
 from typing import List
 from fastapi import Depends, APIRouter, HTTPException, Security, status
 from sqlalchemy.orm import Session
 from database.database import get_session
-from models.schemas import PostedPrice, ServerMessage
+from database import changes
+from database.memory import get_simulation_session
+from models.schemas import ActionMessage, BatchMessage, BatchOperation, PostedPrice, RunMessage, ServerMessage
 from authorization.auth import get_api_key
-from report.report import Trace, report
-from actions.reload import clear_table, load_table
+from report.report import Trace, report, report_event
+from report.metrics import action_timer
+from report.querywatch import action_watch
+from report.profiler import profiler
+from actions.clone import materialise
+from actions.journal import record
+from actions.reload import clear_table, load_table, reload_templates
 from actions.demand import process_demand
 from actions.supply import process_supply
 from actions.trade import process_trade
@@ -13,13 +21,20 @@ from actions.production import process_produce
 from actions.invest import process_invest
 from actions.price import process_price_reset, process_setprice
 from actions.consumption import process_consume
+from actions.convergence import is_stationary, snapshot
+from actions.dirty import mark_dirty
+from models.memo import clear_memo
 from models.models import (
+    Buyer,
     Class_stock,
     Industry_stock,
+    JournalEntry,
     Simulation,
     SocialClass,
     Industry,
     Commodity,
+    Seller,
+    TemplateFixture,
     User,
 )
 from actions.utils import revalue_stocks
@@ -39,85 +54,257 @@ class actionObject:
         self.actionName=an
         self.actionItself=ai
  
-def processAction(act:actionObject,u:User,session: Session)->str:
+# The circuit of actions. Each entry is the action that is conducted when
+# the simulation is in the state given by its key. After the action, the
+# simulation moves to the state given by actionObject.nextState
+circuit={
+    "DEMAND":actionObject("CALCULATE DEMAND","Finished DEMAND","SUPPLY","demand",process_demand),
+    "SUPPLY":actionObject("CALCULATE SUPPLY","Finished SUPPLY","TRADE","supply",process_supply),
+    "TRADE":actionObject("CONDUCT TRADE","Finished TRADE","PRODUCE","trade",process_trade),
+    "PRODUCE":actionObject("PRODUCE","Finished PRODUCE","CONSUME","produce",process_produce),
+    "CONSUME":actionObject("REPRODUCE","Finished REPRODUCE","SETPRICE","reproduce",process_consume),
+    "SETPRICE":actionObject("SET PRICES","Finished Setting Prices","INVEST","set price",process_setprice),
+    "INVEST":actionObject("INVEST","Finished INVEST","DEMAND","invest",process_invest),
+}
+
+def conductAction(act:actionObject,simulation:Simulation,session:Session,commit:bool=True):
+    """Carries out one action on 'simulation', then resets the simulation
+    state to the next in the circuit. Does not catch exceptions; the
+    caller should do that, and roll back the session.
+
+    The action, its trace and the change of state are committed together,
+    once, at the end. Nothing the action does is committed if it fails.
+    If 'commit' is False, they are only flushed, so that the caller can
+    commit several actions together.
+
+    Quantities derived from the simulation (see models/memo.py) are
+    cached for the duration of the action only. A clone which has not yet
+    been materialised is materialised first (see actions/clone.py). The
+    action is recorded in the journal of the simulation (see actions/journal.py).
+    """
+    with action_timer(act.actionName), action_watch(act.actionName), profiler.action():
+        materialise(session,simulation)
+        record(session,simulation,act.actionName)
+        clear_memo(session)
+        report(0, simulation.id, act.initialReportString, session)
+        act.actionItself(session,simulation)
+        simulation.set_state(act.nextState,session) # set the next state in the circuit, obliging the user to do this next.
+        report(1,simulation.id, act.closingReportString,session)
+        if commit:
+            session.commit()
+        else:
+            session.flush()
+
+def report_failure(session:Session, simulation_id:int|None, message:str):
+    """Roll back a failed action and record, in a transaction of its own,
+    that it failed (unless there was no simulation to record it against)."""
+    session.rollback()
+    if simulation_id is not None:
+        report(0, simulation_id, message, session)
+        session.commit()
+
+def preview_action(act:actionObject,simulation:Simulation,session:Session)->dict:
+    """Carry out one action on 'simulation' inside a savepoint, and roll
+    it back, so that nothing it does is kept, its trace included.
+
+        returns: what the action changed, as the delta which a client
+        watching the simulation would have been sent (see database/changes.py)
+    """
+    previewing=session.info.setdefault("preview",set())
+    previewing.add(simulation.id)
+    savepoint=session.begin_nested()
+    try:
+        conductAction(act,simulation,session,commit=False)
+        return changes.collect(session,simulation.id)
+    finally:
+        savepoint.rollback()
+        previewing.discard(simulation.id)
+
+def processAction(act:actionObject,u:User,session: Session,preview:bool=False)->str:
     """Handles calls to an action. Carries out the action, then resets 
     the simulation state to the next in the circuit.
 
         u: User (supplied by Oath middleware)
         session: a valid session which stores the results
+        preview: if True, only report what the action would change (see 'preview_action()')
         returns: None if there is no current simulation
         returns: success message if there is a simulation
     """
     print("Conducting an action",actionObject)
+    simulation_id=None
+    if preview:
+        try:
+            simulation:Simulation=u.current_simulation(session)
+            if simulation.materialised is False:
+                materialise(session,simulation)  # kept, so that the preview shows what the action changes, not the copy
+                session.commit()
+            delta=preview_action(act,simulation,session)
+        except Exception as e:
+            return {"message":f"Error {e} previewing {act.actionName} for user {u.username}","statusCode":status.HTTP_200_OK}
+        finally:
+            session.rollback()  # the savepoint has been rolled back; keep nothing else the preview did either
+        return {"message":f"Preview of {act.actionName} for user {u.username}: nothing was changed","statusCode":status.HTTP_200_OK,"changes":delta}
     try:
         simulation:Simulation=u.current_simulation(session)
-        report(0, simulation.id, act.initialReportString, session)
-        act.actionItself(session,simulation)
-        simulation.set_state(act.nextState,session) # set the next state in the circuit, obliging the user to do this next.
-        report(1,simulation.id, act.closingReportString,session)
+        simulation_id=simulation.id
+        conductAction(act,simulation,session)
     except Exception as e:
-        return{"message":f"Error {e} processing {act.actionName} for user {u.username}: no action taken","statusCode":status.HTTP_200_OK}
+        message=f"Error {e} processing {act.actionName} for user {u.username}: no action taken"
+        report_failure(session,simulation_id,message)
+        return{"message":message,"statusCode":status.HTTP_200_OK}
     return {"message":f"Completed {act.actionName} for user {u.username}","statusCode":status.HTTP_200_OK}
 
-@router.get("/demand",response_model=ServerMessage)
+def advance_period(session:Session,simulation:Simulation):
+    """Take 'simulation' to the start of its next period: round the rest
+    of the circuit if it is part of the way round, or once round if it is
+    at the start. The actions are flushed but not committed."""
+    while True:
+        act=circuit.get(simulation.state)
+        if act is None:
+            raise Exception(f"Simulation {simulation.id} is in state {simulation.state}, which is not part of the circuit")
+        conductAction(act,simulation,session,commit=False)
+        if act.nextState=="DEMAND":
+            return
+
+def run_periods(session:Session,simulation:Simulation,periods:int,tolerance:float,fast_forward:bool)->tuple[int,int|None]:
+    """Take 'simulation' round the circuit 'periods' times, starting from
+    whatever state it is in. At the end of each period, compare its state
+    with the state at the end of the previous period. If nothing has changed,
+    the simulation is stationary and there is no point continuing.
+
+        periods: the number of periods to run
+        tolerance: the relative change below which the state is treated as unchanged
+        fast_forward: if True, a stationary simulation is moved on to the
+            last period without calculating the periods in between, since
+            they would all reproduce the same state. If False, stop early.
+
+        returns: the number of periods run (including any that were fast-forwarded)
+        and the period in which the simulation became stationary, or None if it did not.
+    """
+    completed=0
+    previous=None
+    while completed<periods:
+        act=circuit.get(simulation.state)
+        if act is None:
+            raise Exception(f"Simulation {simulation.id} is in state {simulation.state}, which is not part of the circuit")
+        conductAction(act,simulation,session)
+        if act.nextState!="DEMAND":
+            continue
+        completed+=1
+        current=snapshot(session,simulation)
+        if is_stationary(previous,current,tolerance):
+            converged_at=simulation.time_stamp-1
+            report(0,simulation.id,f"STATIONARY STATE REACHED IN PERIOD {converged_at}",session)
+            if fast_forward and completed<periods:
+                report(1,simulation.id,f"Fast-forwarding {periods-completed} periods to period {simulation.time_stamp+periods-completed}",session)
+                session.add(simulation)
+                record(session,simulation,"fast forward",{"periods":periods-completed})
+                simulation.time_stamp+=periods-completed
+                session.commit()
+                completed=periods
+            return completed, converged_at
+        previous=current
+    return completed, None
+
+@router.get("/demand",response_model=ActionMessage,response_model_exclude_none=True)
 def demandHandler(
+    preview:bool=False,
     u:User=Security(get_api_key),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'Demand' action. See 'processAction()' for details """
-    demandObject=actionObject("CALCULATE DEMAND","Finished DEMAND","SUPPLY","demand",process_demand)
-    return processAction(demandObject,u,session)
+    return processAction(circuit["DEMAND"],u,session,preview)
 
-@router.get("/supply",response_model=ServerMessage)
+@router.get("/supply",response_model=ActionMessage,response_model_exclude_none=True)
 def supplyHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'Supply' action. See 'processAction()' for details """
-    return processAction(actionObject("CALCULATE SUPPLY","Finished SUPPLY","TRADE","supply",process_supply), u, session)
+    return processAction(circuit["SUPPLY"],u,session,preview)
 
 
-@router.get("/trade",response_model=ServerMessage)
+@router.get("/trade",response_model=ActionMessage,response_model_exclude_none=True)
 def tradeHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'Trade' action. See 'processAction()' for details """
-    return processAction(actionObject("CONDUCT TRADE","Finished TRADE","PRODUCE","trade",process_trade), u, session)
+    return processAction(circuit["TRADE"],u,session,preview)
 
 
-@router.get("/produce",response_model=ServerMessage)
+@router.get("/produce",response_model=ActionMessage,response_model_exclude_none=True)
 def produceHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'Produce' action. See 'processAction()' for details """
-    return processAction(actionObject("PRODUCE","Finished PRODUCE","CONSUME","produce",process_produce), u, session)
+    return processAction(circuit["PRODUCE"],u,session,preview)
 
 
-@router.get("/consume",response_model=ServerMessage)
+@router.get("/consume",response_model=ActionMessage,response_model_exclude_none=True)
 def consumeHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'consume (reproduce)' action. See 'processAction()' for details """
-    return processAction(actionObject("REPRODUCE","Finished REPRODUCE","SETPRICE","reproduce",process_consume), u, session)
+    return processAction(circuit["CONSUME"],u,session,preview)
 
-@router.get("/prices",response_model=ServerMessage)
+@router.get("/prices",response_model=ActionMessage,response_model_exclude_none=True)
 def consumeHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'consume (reproduce)' action. See 'processAction()' for details """
-    return processAction(actionObject("SET PRICES","Finished Setting Prices","INVEST","set price",process_setprice), u, session)
+    return processAction(circuit["SETPRICE"],u,session,preview)
 
-@router.get("/invest",response_model=ServerMessage)
+@router.get("/invest",response_model=ActionMessage,response_model_exclude_none=True)
 def investHandler(
-    u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    preview:bool=False,
+    u:User=Security(get_api_key),
+    session: Session = Depends(get_simulation_session),
 )->str:
     """Handles calls to the 'Supply' action. See 'processAction()' for details """
-    return processAction(actionObject("INVEST","Finished INVEST","DEMAND","invest",process_invest), u, session)
+    return processAction(circuit["INVEST"],u,session,preview)
+
+@router.get("/run/{periods}",response_model=RunMessage)
+def runHandler(
+    periods:int,
+    tolerance:float=1e-6,
+    fast_forward:bool=False,
+    u:User=Security(get_api_key),    
+    session: Session = Depends(get_simulation_session),
+)->str:
+    """Runs the current simulation of the user through 'periods' complete
+    circuits, starting from whatever state it is in. Stops early if the
+    simulation reaches a stationary state. See 'run_periods()' for details.
+
+        periods: the number of periods to run
+        tolerance: relative change below which the state is treated as unchanged
+        fast_forward: if true, a stationary simulation is moved on to the
+            final period instead of stopping
+        returns: the number of periods run and the period in which the simulation
+            became stationary, if it did
+    """
+    simulation_id=None
+    try:
+        simulation:Simulation=u.current_simulation(session)
+        simulation_id=simulation.id
+        periods_run,converged_at=run_periods(session,simulation,periods,tolerance,fast_forward)
+    except Exception as e:
+        message=f"Error {e} running the simulation for user {u.username}"
+        report_failure(session,simulation_id,message)
+        return{"message":message,"statusCode":status.HTTP_200_OK,"periods_run":0,"converged_at":None}
+    if converged_at is None:
+        message=f"Ran {periods_run} periods for user {u.username}"
+    else:
+        message=f"Ran {periods_run} periods for user {u.username}. The simulation became stationary in period {converged_at}"
+    return {"message":message,"statusCode":status.HTTP_200_OK,"periods_run":periods_run,"converged_at":converged_at}
 
 
 @router.get("/reset",response_model=ServerMessage)
@@ -127,7 +314,9 @@ def get_json(session: Session = Depends(get_session))->ServerMessage:
 
         Logs out all users and sets their current simulation to 0.  
         Should only be available to admin since it reinitialises everything.  
-        If 'reload' is false in the call to reload_table, does not re-initialise
+        Loads every template in static/ (see actions/reload.py). To reload
+        templates without touching users or their simulations, use
+        /admin/templates/reload instead.
     """
     report(1,0,"RESETTING ENTIRE DATABASE",session)
     clear_table(session, Trace, 1) # This should be done first, to ensure the Trace table includes what follows
@@ -137,18 +326,15 @@ def get_json(session: Session = Depends(get_session))->ServerMessage:
     clear_table(session, Industry, 1)
     clear_table(session, Industry_stock, 1)
     clear_table(session, Class_stock, 1)
+    clear_table(session, Buyer, 1)
+    clear_table(session, Seller, 1)
+    clear_table(session, TemplateFixture, 1)
+    clear_table(session, JournalEntry, 1)
     clear_table(session, User, 1)
 
-    for i in range(1,7):
-        print("Loading table", i)
-        load_table(session, Simulation, f"static/{i}/simulations.json", True, 1)
-        load_table(session, SocialClass, f"static/{i}/classes.json", True, 1)
-        load_table(session, Commodity, f"static/{i}/commodities.json", True, 1)
-        load_table(session, Industry, f"static/{i}/industries.json", True, 1)
-        load_table(session, Class_stock, f"static/{i}/class_stocks.json", True, 1)
-        load_table(session, Industry_stock, f"static/{i}/industry_stocks.json", True, 1)
-
+    reload_templates(session)
     load_table(session, User,"static/users.json", True, 1)
+    session.commit()
 
     return {"message":f"Database Reloaded","statusCode":status.HTTP_200_OK}
 
@@ -156,7 +342,7 @@ def get_json(session: Session = Depends(get_session))->ServerMessage:
 def setPriceHandler(
     # form_data: Annotated[OAuth2PasswordRequestForm, Depends()], (we didn't use this in the end; delete this comment in due course)
     user_data:List[PostedPrice], # The user data
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
     u:User=Security(get_api_key)
 )->str:
     """Accept a form that sets the unit price of all commodities, externally to the simulation.
@@ -171,36 +357,179 @@ def setPriceHandler(
         Return status: 422 if the commodity exists but not in the specified simulation
     """
 
-    simulationId=user_data[0].simulationId
-    report(0,simulationId,f"USER {u.username} IS RESETTING PRICES IN SIMULATION {simulationId}",session)
-
-    # Process all the fields in the form that the user filled in
-    # Check that each field is valid (because the client could be flaky)
-    # Reset unit prices to be what the user asked for
-    # Then process the results using 'process_price_reset()' from the prices module
+    if len(user_data)==0:
+        return {"message":f"No prices were posted by user {u.username}: no action taken","statusCode":status.HTTP_200_OK}
     try:
-        for datum in user_data:
-            commodity:Commodity=session.query(Commodity).where(
-            Commodity.id == datum.commodityId
-            ).first()
-        
-            if commodity is None:
-                raise HTTPException(status_code=404, detail=f'Commodity {datum.commodityId} does not exist')
-
-            if commodity.simulation_id!=datum.simulationId:
-                raise HTTPException(status_code=422, detail=f'Commodity {Commodity.id} does not belong to simulation {datum.simulationId}')
-
-            simulation:Simulation=session.query(Simulation).where(
-                Simulation.id==datum.simulationId
-            ).first()
-            
-            session.add(commodity)
-            report(1,simulation.id,f"Setting the price of {commodity.name} to {datum.unitPrice}",session)
-            commodity.unit_price=datum.unitPrice
-        session.commit()
-        process_price_reset(session,simulation)
-        report(1,simulation.id,"Finished user-requested Price Reset",session)
+        set_prices(session,own_prices(session,u.current_simulation(session),user_data),u.username)
     except Exception as e:
+        session.rollback()
         return{"message":f"Error {e} processing price changes for user {u.username}: no action taken","statusCode":status.HTTP_200_OK}
     return {"message":f"Price changes conducted for user {u.username}","statusCode":status.HTTP_200_OK}
 
+def own_prices(session:Session, simulation:Simulation, user_data:List[PostedPrice])->List[PostedPrice]:
+    """Materialise 'simulation' if it is a clone which has not been, because
+    its prices are about to change, and return the posted prices with any
+    that were posted for commodities of its template made into prices for
+    its own commodities of the same name. A client which read the simulation
+    before it was materialised was shown the template's commodities (see
+    actions/clone.py rows_of), and the template must not change. Does not
+    commit."""
+    materialise(session,simulation)
+    if not any(datum.simulationId==simulation.template_id for datum in user_data):
+        return user_data
+    names={c.id:c.name for c in session.query(Commodity).where(Commodity.simulation_id==simulation.template_id)}
+    ids={c.name:c.id for c in session.query(Commodity).where(Commodity.simulation_id==simulation.id)}
+    return [
+        PostedPrice(commodityId=ids[names[datum.commodityId]],simulationId=simulation.id,unitPrice=datum.unitPrice)
+        if datum.simulationId==simulation.template_id and names.get(datum.commodityId) in ids else datum
+        for datum in user_data
+    ]
+
+def set_prices(session:Session, user_data:List[PostedPrice], username:str):
+    """Set the unit prices of commodities as the user asked, and process
+    the results using 'process_price_reset()' from the prices module.
+    Does not catch exceptions; the caller should do that, and roll back
+    the session.
+
+        Raises HTTPException 404 if a commodity does not exist
+        Raises HTTPException 422 if a commodity is not in the specified simulation
+    """
+    simulationId=user_data[0].simulationId
+    report(0,simulationId,f"USER {username} IS RESETTING PRICES IN SIMULATION {simulationId}",session)
+
+    # Check that each field is valid (because the client could be flaky)
+    # The commodities are all fetched with one query, and validated before any is changed
+    commodities={c.id:c for c in session.query(Commodity).where(
+        Commodity.id.in_({datum.commodityId for datum in user_data})
+    )}
+    for datum in user_data:
+        commodity:Commodity=commodities.get(datum.commodityId)
+        if commodity is None:
+            raise HTTPException(status_code=404, detail=f'Commodity {datum.commodityId} does not exist')
+        if commodity.simulation_id!=datum.simulationId or datum.simulationId!=simulationId:
+            raise HTTPException(status_code=422, detail=f'Commodity {datum.commodityId} does not belong to simulation {simulationId}')
+
+    simulation:Simulation=session.get(Simulation,simulationId)
+    record(session,simulation,"setprices",[
+        {"commodity":commodities[datum.commodityId].name,"unit_price":datum.unitPrice} for datum in user_data
+    ])
+    for datum in user_data:
+        commodity=commodities[datum.commodityId]
+        report_event(1,simulation.id,"price.set",session,commodity=commodity,price=datum.unitPrice)
+        if commodity.unit_price!=datum.unitPrice:
+            mark_dirty(commodity)
+        commodity.unit_price=datum.unitPrice
+    session.flush()
+    process_price_reset(session,simulation)
+    report(1,simulation.id,"Finished user-requested Price Reset",session)
+    session.commit()
+
+# The parameters of a simulation which a client may change (see set_parameters)
+simulation_parameters=(
+    "periods_per_year",
+    "population_growth_rate",
+    "investment_ratio",
+    "labour_supply_response",
+    "price_response_type",
+    "melt_response_type",
+    "setPriceMode",
+    "investment_algorithm",
+)
+
+def set_parameters(session:Session, simulation:Simulation, parameters:dict, username:str):
+    """Change parameters of 'simulation'. All are checked before any is
+    changed. Does not catch exceptions; the caller should do that, and
+    roll back the session.
+
+        parameters: new values, by name (see simulation_parameters)
+
+        Raises ValueError if a name is not a parameter, or a value is None
+        or of the wrong type (an int will do for a float, but a bool will not)
+    """
+    for name,value in parameters.items():
+        if name not in simulation_parameters:
+            raise ValueError(f"{name} is not a parameter of a simulation")
+        kind=Simulation.__table__.c[name].type.python_type
+        if value is None:
+            valid=False # the columns are nullable by default, but every parameter is needed
+        elif isinstance(value,bool):
+            valid=kind is bool # bool is a subclass of int, but not a number here
+        elif kind is float:
+            valid=isinstance(value,(int,float))
+        else:
+            valid=isinstance(value,kind)
+        if not valid:
+            raise ValueError(f"{value!r} is not a valid value for {name}")
+    materialise(session,simulation)  # so that its rows are copied from the template as it stands
+    report(0,simulation.id,f"USER {username} IS CHANGING PARAMETERS OF SIMULATION {simulation.id}",session)
+    session.add(simulation)
+    record(session,simulation,"parameters",dict(parameters))
+    for name,value in parameters.items():
+        report(1,simulation.id,f"{name} changed from {getattr(simulation,name)} to {value}",session)
+        setattr(simulation,name,value)
+    session.commit()
+
+# The action routes, by name, so that a batch can name the actions it wants
+batch_actions={
+    "demand":"DEMAND",
+    "supply":"SUPPLY",
+    "trade":"TRADE",
+    "produce":"PRODUCE",
+    "consume":"CONSUME",
+    "prices":"SETPRICE",
+    "invest":"INVEST",
+}
+
+def conduct_operation(operation:BatchOperation, u:User, session:Session):
+    """Carry out one step of a batch on the user's current simulation.
+    Does not catch exceptions; the caller should do that, and roll back
+    the session."""
+    if operation.op in batch_actions:
+        conductAction(circuit[batch_actions[operation.op]],u.current_simulation(session),session)
+    elif operation.op=="setprices":
+        if not operation.prices:
+            raise ValueError("setprices needs a list of prices")
+        set_prices(session,own_prices(session,u.current_simulation(session),operation.prices),u.username)
+    elif operation.op=="parameters":
+        if not operation.parameters:
+            raise ValueError("parameters needs the parameters to change")
+        set_parameters(session,u.current_simulation(session),operation.parameters,u.username)
+    else:
+        raise ValueError(f"{operation.op} is not an operation")
+
+@router.post("/batch", status_code=200,response_model=BatchMessage)
+def batchHandler(
+    operations:List[BatchOperation],
+    session: Session = Depends(get_simulation_session),
+    u:User=Security(get_api_key)
+)->BatchMessage:
+    """Carries out a list of operations (actions, price settings and
+    parameter changes) in order, with one request, for clients that
+    script the simulation. Each operation is committed when it is done,
+    exactly as if it had been requested on its own. The batch stops at
+    the first operation that fails, which is rolled back. The batch as a
+    whole is NOT rolled back: the operations before the failure remain
+    committed, and the response says how many there were.
+
+        operations: list of {op, prices, parameters} (see BatchOperation)
+        returns: the outcome of each operation attempted, and how long it
+            took, and the number of operations committed
+    """
+    simulation_id=session.query(Simulation.id).where(Simulation.id==u.current_simulation_id).scalar()  # to record failures against
+    steps=[]
+    for number,operation in enumerate(operations):
+        started=time.perf_counter()
+        try:
+            conduct_operation(operation,u,session)
+        except Exception as e:
+            message=f"Error {e} processing {operation.op} for user {u.username}"
+            report_failure(session,simulation_id,message)
+            steps.append({"step":number,"op":operation.op,"succeeded":False,"message":message,"seconds":time.perf_counter()-started})
+            return {
+                "message":f"Batch stopped at step {number} of {len(operations)} for user {u.username}: step {number} was rolled back, and the {number} steps before it remain committed",
+                "statusCode":status.HTTP_200_OK,
+                "steps":steps,
+                "committed":number,
+            }
+        steps.append({"step":number,"op":operation.op,"succeeded":True,"message":f"Completed {operation.op}","seconds":time.perf_counter()-started})
+    return {"message":f"Completed {len(operations)} operations for user {u.username}","statusCode":status.HTTP_200_OK,"steps":steps,"committed":len(operations)}
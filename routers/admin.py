@@ -4,16 +4,23 @@
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, Security
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException, Security, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Security, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from fastapi.responses import PlainTextResponse
 from report.report import report,logger
-from models.schemas import UserCreate, UserRegistrationMessage, ServerMessage
+from actions.pool import drain_pool, fill_pool, pool_size
+from actions.reload import reload_templates, template_folders, folder_template_id
+from report.profiler import ProfilerBusy, profiler, stop_tracing_memory, top_allocations
+from models.schemas import AllocationSite, CohortMessage, CohortSelection, UserCreate, UserRegistrationMessage, ServerMessage
 
 from models.schemas import UserBase
 from database.database import get_session
+from database.memory import stores
 from authorization.auth import get_api_key
-from models.models import User
+from models.models import Simulation, User
+from routers.actions import advance_period, report_failure
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -158,3 +165,214 @@ def unlock_user(
     user.is_locked=False
     session.commit()
     return {'message': f'User {username} was unlocked',"statusCode":status.HTTP_200_OK}
+
+@router.get("/templates/reload",response_model=ServerMessage)
+def reload_templates_for_admin(
+    template_id:int|None=None,
+    u: User = Security(get_api_key),
+    session:Session =Depends(get_session)
+)->ServerMessage:
+    """Reload templates from their fixture files in static/, without
+    touching users or their simulations. Only admin can do this.
+
+        template_id: reload just this template, whether or not its files
+        have changed. Otherwise reload every template whose files have
+        changed since it was loaded, and load any new ones.
+
+        Return status: 400 if not the admin user.
+        Return status: 404 if no folder in static/ holds the template.
+        The message says what was done with each folder.
+    """
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    folders=template_folders()
+    if template_id is not None:
+        folders=[folder for folder in folders if folder_template_id(folder)==template_id]
+        if len(folders)==0:
+            raise HTTPException(status_code=404, detail=f'There is no template {template_id} in static/')
+    results=reload_templates(session,folders,only_changed=template_id is None)
+    for folder,outcome in results.items():
+        if outcome=="loaded":
+            drain_pool(session,folder_template_id(folder))  # its pooled clones are copies of the old template
+    session.commit()
+    logger.info(f"Templates reloaded by {u.username}: {results}")
+    return {"message":"; ".join(f"{folder}: {outcome}" for folder,outcome in results.items()),"statusCode":status.HTTP_200_OK}
+
+@router.get("/pool/fill",response_model=ServerMessage)
+def fill_pool_for_admin(
+    background_tasks: BackgroundTasks,
+    u: User = Security(get_api_key),
+)->ServerMessage:
+    """Fill the pool of ready-made clones of every template (see
+    actions/pool.py), in the background, for example before a class
+    begins. Only admin can do this.
+
+        Return status: 400 if not the admin user.
+        Return status: 409 if there is no pool, because CLONE_POOL_SIZE is 0.
+    """
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    if pool_size<=0:
+        raise HTTPException(status_code=409, detail='There is no pool of clones: CLONE_POOL_SIZE is 0')
+    background_tasks.add_task(fill_pool)
+    return {"message":f"Filling the pools with {pool_size} clones of each template","statusCode":status.HTTP_200_OK}
+
+@router.post("/cohort/step",response_model=CohortMessage)
+def step_cohort(
+    selection:CohortSelection,
+    u: User = Security(get_api_key),
+    session:Session =Depends(get_session)
+)->CohortMessage:
+    """Advance a group of simulations (for example, those of a class of
+    students, or every clone of one template) to the start of the next
+    period, or on by several periods, with one request. Only admin can do this.
+
+        selection: which simulations, and by how many periods (see CohortSelection)
+
+        Each simulation is committed when it has been advanced, so one
+        that fails is rolled back without holding up the others.
+
+        Return status: 400 if not the admin user, or nothing selects the simulations.
+        Return status: 422 if periods is less than 1.
+        The results say what happened to each simulation.
+    """
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    if selection.usernames is None and selection.template_id is None and selection.state is None:
+        raise HTTPException(status_code=400, detail='Select the simulations by usernames, template_id or state')
+    if selection.periods<1:
+        raise HTTPException(status_code=422, detail='periods must be at least 1')
+
+    cohort=select_cohort(session,selection)
+    results=[]
+    for simulation in cohort:
+        store=stores.get(simulation.id)
+        if store is None:
+            results.append(advance_simulation(session,simulation,selection.periods))
+            continue
+        with store.lock:
+            memory_session=store.Session()
+            try:
+                results.append(advance_simulation(memory_session,memory_session.get(Simulation,simulation.id),selection.periods))
+            finally:
+                memory_session.close()
+    failures=sum(not result["succeeded"] for result in results)
+    logger.info(f"Cohort of {len(results)} simulations advanced by {u.username}, {failures} failed")
+    return {
+        "message":f"Advanced {len(results)-failures} of {len(results)} simulations by {selection.periods} periods",
+        "statusCode":status.HTTP_200_OK,
+        "results":results,
+    }
+
+def select_cohort(session:Session, selection:CohortSelection)->list[Simulation]:
+    """The simulations which meet every criterion of 'selection', in order
+    of id, found with one query. Templates and pooled clones are left out. A simulation
+    held in memory is selected by its state in the main database."""
+    query=session.query(Simulation).where(Simulation.state.not_in(("TEMPLATE","POOL")))
+    if selection.usernames is not None:
+        query=query.where(Simulation.id.in_(
+            select(User.current_simulation_id).where(User.username.in_(selection.usernames))
+        ))
+    if selection.template_id is not None:
+        query=query.where(Simulation.template_id==selection.template_id)
+    if selection.state is not None:
+        query=query.where(Simulation.state==selection.state)
+    return query.order_by(Simulation.id).all()
+
+def advance_simulation(session:Session, simulation:Simulation, periods:int)->dict:
+    """Advance one simulation of a cohort by 'periods' periods and commit,
+    or roll back if it fails."""
+    simulation_id=simulation.id
+    username=simulation.username
+    try:
+        for _ in range(periods):
+            advance_period(session,simulation)
+        session.commit()
+    except Exception as e:
+        message=f"Error {e} advancing simulation {simulation_id}: no action taken"
+        report_failure(session,simulation_id,message)
+        return {"simulation_id":simulation_id,"username":username,"succeeded":False,"message":message}
+    return {"simulation_id":simulation_id,"username":username,"succeeded":True,"message":f"Now at the start of period {simulation.time_stamp}"}
+
+@router.get("/profiler/start",response_model=ServerMessage)
+def start_profiler(
+    seconds:float|None=None,
+    actions:int|None=None,
+    interval:float=0.005,
+    memory:bool=False,
+    u: User = Security(get_api_key),
+)->ServerMessage:
+    """Start the sampling profiler (see report/profiler.py), for a number of
+    seconds or for the next few actions. Only admin can do this.
+
+        seconds: how long to sample for
+        actions: the number of actions to sample (give this or seconds)
+        interval: the seconds of CPU time between samples
+        memory: if true, also trace memory allocation (see /profiler/memory)
+
+        Return status: 400 if not the admin user, or the parameters are wrong.
+        Return status: 409 if the profiler is already running.
+    """
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    if interval<0.001:
+        raise HTTPException(status_code=400, detail='The interval must be at least 0.001 seconds')
+    try:
+        profiler.start(seconds,actions,interval,memory)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Profiler started by {u.username}")
+    return {"message":profiler.status(),"statusCode":status.HTTP_200_OK}
+
+@router.get("/profiler/stop",response_model=ServerMessage)
+def stop_profiler(
+    u: User = Security(get_api_key),
+)->ServerMessage:
+    """Stop the sampling profiler before its time is up. Memory tracing,
+    if it was started, is stopped too. Only admin can do this."""
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    profiler.stop()
+    stop_tracing_memory()
+    return {"message":profiler.status(),"statusCode":status.HTTP_200_OK}
+
+@router.get("/profiler/status",response_model=ServerMessage)
+def profiler_status(
+    u: User = Security(get_api_key),
+)->ServerMessage:
+    """Whether the profiler is running, and how many samples it has. Only admin can do this."""
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    return {"message":profiler.status(),"statusCode":status.HTTP_200_OK}
+
+@router.get("/profiler/stacks",response_class=PlainTextResponse)
+def profiler_stacks(
+    u: User = Security(get_api_key),
+)->str:
+    """The samples of the last run, as collapsed stacks for a flame graph
+    (for example, flamegraph.pl or speedscope). Only admin can do this."""
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    return PlainTextResponse(profiler.collapsed())
+
+@router.get("/profiler/memory",response_model=List[AllocationSite])
+def profiler_memory(
+    top:int=20,
+    u: User = Security(get_api_key),
+)->List[dict]:
+    """The lines which hold the most memory allocated since the profiler
+    was started with memory=true. Can be called repeatedly during a long
+    run. Only admin can do this.
+
+        top: how many lines to report
+
+        Return status: 409 if memory is not being traced.
+    """
+    if u.username!='admin':
+        raise HTTPException(status_code=400, detail='Only admin can do this')
+    try:
+        return top_allocations(top)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
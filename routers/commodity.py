@@ -1,8 +1,10 @@
 from fastapi import Depends, APIRouter, HTTPException, Security
 from sqlalchemy.orm import Session
 from typing import List
+from actions.clone import rows_of
 from authorization.auth import get_api_key
 from database.database import get_session
+from database.memory import get_simulation_session
 from models.models import Commodity, Simulation, User
 from models.schemas import CommodityBase
  
@@ -11,7 +13,7 @@ router = APIRouter(prefix="/commodity", tags=["Commodity"])
 @router.get("/", response_model=List[CommodityBase])
 def get_commodities(
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
 ):
     """Get all commodities in the simulation of the logged-in user.
        
@@ -25,14 +27,14 @@ def get_commodities(
 
     if simulation_id == 0:
         return []
-    commodities = session.query(Commodity).where(Commodity.simulation_id == simulation_id)
+    commodities = session.query(Commodity).where(Commodity.simulation_id == rows_of(session,simulation_id))
     return commodities
 
 @router.get("/{id}",response_model=CommodityBase)
 def get_commodity(
     id: str, 
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session)):
+    session: Session = Depends(get_simulation_session)):
 
     """Get the commodity defined by id.
     Calls get_api_key to authorize access but does not use it to locate the user
@@ -2,8 +2,10 @@ from typing import List
 from fastapi import HTTPException, Security, Depends, APIRouter, Security
 from sqlalchemy.orm import Session
 
+from actions.clone import rows_of
 from authorization.auth import get_api_key
 from database.database import get_session
+from database.memory import get_simulation_session
 from models.models import Simulation, Industry, User
 from models.schemas import IndustryBase
 
@@ -12,7 +14,7 @@ router = APIRouter(prefix="/industry", tags=["Industry"])
 @router.get("/", response_model=List[IndustryBase])
 def get_Industries(
     u:User = Security(get_api_key),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
     ):
     
     """Get all industries in the simulation of the logged-in user
@@ -22,14 +24,14 @@ def get_Industries(
     simulation_id:Simulation=u.current_simulation_id
     if simulation_id == 0:
         return []
-    Industries = session.query(Industry).where(Industry.simulation_id == simulation_id)
+    Industries = session.query(Industry).where(Industry.simulation_id == rows_of(session,simulation_id))
     return Industries
 
 @router.get("/{id}", response_model=IndustryBase)
 def get_Industry(
     id: str, 
     u:User = Security(get_api_key),
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
     ):
 
     """Get one industry defined by id.
@@ -0,0 +1,50 @@
+"""Endpoints which move the current simulation of a user into memory and
+back again. See database/memory.py.
+"""
+
+from fastapi import APIRouter, Depends, Security, status
+from sqlalchemy.orm import Session
+from authorization.auth import get_api_key
+from database import memory
+from database.database import get_session
+from models.models import Simulation, User
+from models.schemas import ServerMessage
+
+router = APIRouter(prefix="/memory", tags=["Memory"])
+
+@router.get("/attach",response_model=ServerMessage)
+def attach_simulation(
+    u:User=Security(get_api_key),
+    session:Session=Depends(get_session),
+):
+    """Run the current simulation of the user in memory from now on.
+    Its changes are not written to the database until it is saved.
+
+        Raise httpException if the user has no current simulation
+    """
+    simulation:Simulation=u.current_simulation(session)
+    memory.attach(session,simulation.id)
+    return {"message":f"Simulation {simulation.id} of user {u.username} is now held in memory","statusCode":status.HTTP_200_OK}
+
+@router.get("/save",response_model=ServerMessage)
+def save_simulation(
+    u:User=Security(get_api_key),
+    session:Session=Depends(get_session),
+):
+    """Write the in-memory copy of the current simulation of the user to the
+    database. The simulation stays in memory."""
+    if u.current_simulation_id not in memory.stores:
+        return {"message":f"The current simulation of user {u.username} is not held in memory","statusCode":status.HTTP_404_NOT_FOUND}
+    memory.save(session,u.current_simulation_id)
+    return {"message":f"Saved simulation {u.current_simulation_id} of user {u.username}","statusCode":status.HTTP_200_OK}
+
+@router.get("/discard",response_model=ServerMessage)
+def discard_simulation(
+    u:User=Security(get_api_key),
+):
+    """Stop holding the current simulation of the user in memory, without
+    saving it. It reverts to its state when it was last attached or saved."""
+    if u.current_simulation_id not in memory.stores:
+        return {"message":f"The current simulation of user {u.username} is not held in memory","statusCode":status.HTTP_404_NOT_FOUND}
+    memory.discard(u.current_simulation_id)
+    return {"message":f"Discarded the in-memory copy of simulation {u.current_simulation_id}","statusCode":status.HTTP_200_OK}
@@ -0,0 +1,21 @@
+"""The endpoint from which Prometheus collects measurements.
+See report/metrics.py.
+"""
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from report import metrics
+
+router = APIRouter(tags=["Metrics"])
+
+@router.get("/metrics",response_class=PlainTextResponse)
+def get_metrics()->str:
+    """Request latency, SQL statement counts and action and stage timings,
+    as Prometheus histograms.
+
+    Requires no api key, so that Prometheus can collect them.
+
+        Raise httpException 404 if measurement is turned off.
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Metrics are turned off")
+    return PlainTextResponse(metrics.render(),media_type="text/plain; version=0.0.4")
@@ -1,13 +1,33 @@
+import asyncio
 import http
-from fastapi import  HTTPException, Security, status, Depends, APIRouter,status
+import json
+from fastapi import  HTTPException, Request, Security, status, Depends, APIRouter,status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List
 
 from report.report import report
 from database.database import  get_session
-from models.models import Simulation, User
-from models.schemas import  ServerMessage, SimulationBase
+from database.memory import get_simulation_session
+from database import changes, memory
+from models.models import Class_stock, Commodity, Industry, Industry_stock, JournalEntry, Simulation, SocialClass, User
+from models.schemas import (
+    Class_stock_base,
+    CloneMessage,
+    CommodityBase,
+    GrowthStep,
+    Industry_stock_base,
+    IndustryBase,
+    JournalEntryOut,
+    ReplayedSimulation,
+    ServerMessage,
+    SimulationBase,
+    SocialClassBase,
+)
 from authorization.auth import get_api_key
+from actions.clone import fork_simulation, rows_of
+from actions.growth import project_growth
+from actions.journal import journal, replay
 
 """Endpoints to retrieve data about Simulations.
 At present these are all public.
@@ -36,6 +56,7 @@ def delete_simulation(id:int,session:Session)->bool:
     query = session.query(Simulation).where(Simulation.id==id)
     if (query is None):
         return False
+    session.query(JournalEntry).where(JournalEntry.simulation_id==id).delete(synchronize_session=False)  # its id may be reused
     query.delete(synchronize_session=False)
     session.commit()
     return True
@@ -71,9 +92,51 @@ def get_simulation(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This simulation does not exist')
     return simulation
 
+@router.get("/changes/{id}")
+async def watch_simulation(
+    id:int,
+    request:Request,
+    u:User=Security(get_api_key),
+    session: Session=Depends(get_session)):
+
+    """Stream the changes to one simulation, as server-sent events: a
+    'changes' event after each committed action, with only what changed
+    (see database/changes.py), and a 'resync' event if the client has
+    fallen behind and should fetch everything again.
+
+        id is the actual simulation number.
+
+        Raise httpException if there is no such simulation
+    """
+    exists=session.query(Simulation.id).where(Simulation.id==id).first() is not None
+    session.close()  # the stream may stay open for hours; the connection is not needed
+    if not exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This simulation does not exist')
+    subscriber=changes.subscribe(id)
+
+    async def events():
+        try:
+            yield f": watching simulation {id}\n\n"
+            while not await request.is_disconnected():
+                if subscriber.overflowed:
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.overflowed=False
+                    yield "event: resync\ndata: {}\n\n"
+                try:
+                    delta=await asyncio.wait_for(subscriber.queue.get(),timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: changes\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            changes.unsubscribe(subscriber)
+
+    return StreamingResponse(events(),media_type="text/event-stream",headers={"Cache-Control":"no-cache"})
+
 @router.get("/current",response_model=List[SimulationBase])
 def get_current_user_simulation(
-    session: Session = Depends (get_session), 
+    session: Session = Depends(get_simulation_session), 
     u:User=Security(get_api_key),    
     ):
 
@@ -84,12 +147,126 @@ def get_current_user_simulation(
         Raise httpException otherwise
     """
     report(1,0,f"User {u.username} requested simulation {u.current_simulation_id}",session)
+    session.commit()
     simulations:Simulation=session.query(Simulation).where(Simulation.id==u.current_simulation_id)
     if simulations is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This user has no simulations')
     return simulations
 
 
+@router.get("/projection/{periods}",response_model=List[GrowthStep])
+def get_growth_projection(
+    periods:int,
+    session: Session = Depends(get_simulation_session), 
+    u:User=Security(get_api_key),    
+    ):
+
+    """Project the balanced growth path of the current simulation of the
+    api_key user for 'periods' periods. Does not change the simulation.
+    See 'actions.growth' for the method.
+
+        Return one entry per period with the output scale of each industry,
+        the demand for labour power and the consumption per head of the
+        capitalists.
+
+        Raise httpException if the user has no current simulation
+    """
+    simulation=u.current_simulation(session)
+    if simulation.materialised is False:
+        simulation=session.get(Simulation,rows_of(session,simulation.id))  # it is its template until it is changed
+    return project_growth(session,simulation,periods)
+
+@router.get("/journal/{id}",response_model=List[JournalEntryOut])
+def get_journal(
+    id:int,
+    period:int|None=None,
+    session: Session = Depends(get_session),
+    u:User=Security(get_api_key),
+    ):
+    """Get the journal of one simulation: everything done to it, in order
+    (see actions/journal.py).
+
+        period: if given, only the entries made before this period
+    """
+    return journal(session,id,period)
+
+@router.get("/replay/{id}",response_model=ReplayedSimulation)
+def replay_simulation(
+    id:int,
+    period:int|None=None,
+    entries:int|None=None,
+    session: Session = Depends(get_session),
+    u:User=Security(get_api_key),
+    ):
+    """Rebuild one simulation as it was at some point, by replaying its
+    journal on a fresh copy of its template in memory (see
+    actions/journal.py). Does not change the simulation.
+
+        period: the state at the start of this period
+        entries: the state after this many entries of the journal
+        If neither is given, the simulation as it is now.
+
+        Raise httpException 404 if the simulation does not exist
+        Raise httpException 409 if it cannot be replayed
+    """
+    if session.get(Simulation,id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This simulation does not exist')
+    try:
+        store,replica_session,replica,replayed=replay(session,id,period,entries)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    try:
+        def rows(model,schema):
+            return [
+                schema.model_validate(row,from_attributes=True)
+                for row in replica_session.query(model).where(model.simulation_id==id).order_by(model.id)
+            ]
+        return {
+            "entries_replayed":replayed,
+            "simulation":SimulationBase.model_validate(replica,from_attributes=True),
+            "commodities":rows(Commodity,CommodityBase),
+            "industries":rows(Industry,IndustryBase),
+            "social_classes":rows(SocialClass,SocialClassBase),
+            "industry_stocks":rows(Industry_stock,Industry_stock_base),
+            "class_stocks":rows(Class_stock,Class_stock_base),
+        }
+    finally:
+        replica_session.close()
+        store.engine.dispose()
+
+@router.post("/{id}/fork",response_model=CloneMessage)
+def fork_one_simulation(
+    id:int,
+    session: Session = Depends(get_session),
+    u:User=Security(get_api_key),
+    ):
+    """Start a new simulation, belonging to the user, which is a copy of
+    simulation 'id' as it is now, in the same period and state, and make
+    it the user's current simulation. The original is left alone, so a
+    'what if' can be explored from any point of a run without losing it.
+    See 'fork_simulation()' in actions/clone.py.
+
+        Raise httpException 404 if the simulation does not exist
+        Raise httpException 400 if it is a template (clone it instead)
+        Raise httpException 409 if it is held in memory and has to be saved first
+    """
+    source=session.get(Simulation,id)
+    if source is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='This simulation does not exist')
+    if source.state in ("TEMPLATE","POOL"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Simulation {id} is a template, which should be cloned instead')
+    if id in memory.stores:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f'Simulation {id} is held in memory. Save it before forking it')
+    try:
+        fork=fork_simulation(session,source,u.username)
+        session.add(u)
+        u.current_simulation_id=fork.id
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f'Fork failed: {e}')
+    return {"message":f"Forked simulation {id} into simulation {fork.id}","statusCode":status.HTTP_200_OK,"simulation_id":fork.id}
+
 @router.get("/delete/{id}",response_model=ServerMessage)
 def delete_one_simulation(
     id:str,
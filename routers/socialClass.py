@@ -4,8 +4,10 @@
 from typing import List
 from fastapi import Depends, APIRouter, HTTPException, Security
 from sqlalchemy.orm import Session
+from actions.clone import rows_of
 from authorization.auth import get_api_key
 from database.database import  get_session
+from database.memory import get_simulation_session
 from models.models import SocialClass,Simulation, User
 from models.schemas import SocialClassBase
 
@@ -17,7 +19,7 @@ router=APIRouter(
 @router.get("/",response_model=List[SocialClassBase])
 def get_socialClasses(
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_simulation_session)
     ):
 
     """Get all social classes in the current user simulation
@@ -28,14 +30,14 @@ def get_socialClasses(
     simulation_id:Simulation=u.current_simulation_id
     if (simulation_id==0):
         return []
-    socialClasses=session.query(SocialClass).where(SocialClass.simulation_id==simulation_id)
+    socialClasses=session.query(SocialClass).where(SocialClass.simulation_id==rows_of(session,simulation_id))
     return socialClasses
 
 @router.get("/{id}")
 def get_socialClass(
     id:str,
     u:User=Security(get_api_key),    
-    session:Session = Depends(get_session)
+    session:Session = Depends(get_simulation_session)
     ):
 
     """Get one SocialClass defined by id.
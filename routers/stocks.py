@@ -1,8 +1,10 @@
 from fastapi import Depends, APIRouter, HTTPException, Security
 from sqlalchemy.orm import Session
 from typing import List
+from actions.clone import rows_of
 from authorization.auth import get_api_key
 from database.database import get_session
+from database.memory import get_simulation_session
 from models.models import Class_stock, Industry_stock, Simulation, User
 from models.schemas import Class_stock_base, Industry_stock_base
 
@@ -11,7 +13,7 @@ router = APIRouter(prefix="/stocks", tags=["Stocks"])
 @router.get("/industry", response_model=List[Industry_stock_base])
 def find_industry_stocks(
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_simulation_session)
   ):
     """Get all industry stocks in one simulation.
     Return empty list if simulation is None."""
@@ -20,13 +22,13 @@ def find_industry_stocks(
 
     if simulation_id ==0:
         return []
-    return session.query(Industry_stock).filter(Industry_stock.simulation_id == simulation_id)
+    return session.query(Industry_stock).filter(Industry_stock.simulation_id == rows_of(session,simulation_id))
 
 @router.get("/industry/{id}")
 def get_stock(
     id: str, 
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_simulation_session),
     ):
 
     """Get one industry stock with the given id.
@@ -46,7 +48,7 @@ def get_stock(
 @router.get("/class", response_model=List[Class_stock_base])
 def find_class_stocks(
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_simulation_session)
     ):
 
     """Get all class stocks in one simulation.
@@ -57,7 +59,7 @@ def find_class_stocks(
 
     if simulation_id == 0:
         return []
-    return session.query(Class_stock).filter(Class_stock.simulation_id == simulation_id)
+    return session.query(Class_stock).filter(Class_stock.simulation_id == rows_of(session,simulation_id))
 
 @router.get("/class/{id}")
 def get_stock(id: str, session: Session = Depends(get_session)):
@@ -1,11 +1,13 @@
 from fastapi import  Depends, APIRouter, Security
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import List
 from authorization.auth import get_api_key
 from database.database import  get_session
-from models.models import Simulation,User
+from database.memory import get_simulation_session
+from models.models import Simulation, User
 from models.schemas import TraceOut
-from report.report import Trace
+from report.report import Trace, entry_names, render, trace_names
 
 router=APIRouter(
     prefix="/trace",
@@ -14,15 +16,58 @@ router=APIRouter(
 
 @router.get("/",response_model=List[TraceOut])
 def get_trace(
+    period:int|None=None,
+    event:str|None=None,
+    commodity_id:int|None=None,
+    industry_id:int|None=None,
+    class_id:int|None=None,
     u:User=Security(get_api_key),    
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_simulation_session)
     ):
     """Get the trace records in the current simulation of the user.
+    Optionally, only those of one period, one event, or which concern
+    one commodity, industry or class.
 
         Return empty list if the user doesn't have a simulation yet.
     """
     simulation_id:Simulation=u.current_simulation_id
     if (simulation_id==0):
         return []
-    trace=session.query(Trace).where(Trace.simulation_id==simulation_id)
-    return trace
+    query=select(Trace).where(Trace.simulation_id==simulation_id)
+    if period is not None:
+        query=query.where(Trace.time_stamp==period)
+    if event is not None:
+        query=query.where(Trace.event==event)
+    if commodity_id is not None:
+        query=query.where(Trace.commodity_id==commodity_id)
+    if industry_id is not None:
+        query=query.where(Trace.industry_id==industry_id)
+    if class_id is not None:
+        query=query.where(Trace.class_id==class_id)
+    entries=session.scalars(query.order_by(Trace.id)).all()
+    names=trace_names(session,simulation_id) if any(entry.event is not None for entry in entries) else None
+    return [trace_out(entry,names) for entry in entries]
+
+def trace_out(entry:Trace, names:dict|None)->dict:
+    """A trace entry as TraceOut, with its message rendered and indented
+    by its level."""
+    if entry.event is None:
+        message=entry.message
+    else:
+        message=render(entry,entry_names(entry,names))
+    return {
+        "id":entry.id,
+        "simulation_id":entry.simulation_id,
+        "time_stamp":entry.time_stamp,
+        "level":entry.level,
+        "message":" "*entry.level+message,
+        "event":entry.event,
+        "commodity_id":entry.commodity_id,
+        "industry_id":entry.industry_id,
+        "class_id":entry.class_id,
+        "stock_id":entry.stock_id,
+        "amount":entry.amount,
+        "size":entry.size,
+        "value":entry.value,
+        "price":entry.price,
+    }